@@ -0,0 +1,323 @@
+"""
+Local bond analytics: yield to convention and z-spread from price, without a Bloomberg request.
+Released under Apache 2.0 license. More info at http://www.apache.org/licenses/LICENSE-2.0
+
+Classes:
+ZeroCurve: continuously compounded zero rates, linearly interpolated
+BondAnalyticsEngine: cashflow cache and solvers for the bonds of the pricer, sinking funds included (BondSolver for many bonds at once)
+
+Functions:
+bootstrapSwapCurve(): builds a ZeroCurve from a SwapHistory object (money market rates, then annual par swap rates)
+sinkScheduleFromBloomberg(): list of (date, amount) from the SINK_SCHEDULE bulk field as returned by BLPTS
+settlementDate(): T+2 business days, weekends only
+addMonths(): date plus a number of months, day clipped to the end of the month
+days30360(): 30/360 day count between two dates
+
+Conventions, good to a few bp against Bloomberg for most bullet bonds but not all (day counts, curve, distressed prices),
+so the caller should check each bond against Bloomberg before using it:
+yield is street convention, compounded at the coupon frequency, with 30/360 accrued and a fractional first period.
+The z-spread is a spread over the swap zero curve compounded at the coupon frequency, like Bloomberg's, ACT/365 times from settlement.
+Sinking funds amortise on their schedule, so both measures are on the average-life cashflows rather than to final maturity.
+Bonds that don't fit (unknown frequency or maturity, unsolvable price) return NaN so the caller can fall back to Bloomberg.
+"""
+
+import bisect
+import calendar
+import datetime
+import math
+
+import numpy
+
+import BondSolver
+
+
+def addMonths(d, months):
+    month = d.month - 1 + months
+    year = d.year + month // 12
+    month = month % 12 + 1
+    return datetime.date(year, month, min(d.day, calendar.monthrange(year, month)[1]))
+
+
+def days30360(d1, d2):
+    day1 = min(d1.day, 30)
+    day2 = min(d2.day, 30) if day1 == 30 else d2.day
+    return 360 * (d2.year - d1.year) + 30 * (d2.month - d1.month) + (day2 - day1)
+
+
+def _toDate(value):
+    if isinstance(value, datetime.datetime):
+        return value.date()
+    if isinstance(value, datetime.date):
+        return value
+    for fmt in ['%Y-%m-%d', '%m/%d/%Y', '%d/%m/%Y', '%Y%m%d']:
+        try:
+            return datetime.datetime.strptime(str(value)[:10], fmt).date()
+        except ValueError:
+            pass
+    return None
+
+
+def sinkScheduleFromBloomberg(value):
+    """List of (date, amount) sorted by date from a SINK_SCHEDULE value: a list of rows (or a single row), each a dictionary
+    with one date and one amount element whatever Bloomberg names them. Amounts are per 100 of original face. Empty list if unreadable.
+    """
+    rows = value if isinstance(value, list) else [value]
+    schedule = []
+    for row in rows:
+        if not isinstance(row, dict):
+            continue
+        (date, amount) = (None, None)
+        for x in row.values():
+            if date is None and _toDate(x) is not None:
+                date = _toDate(x)
+                continue
+            try:
+                amount = float(x)
+            except (TypeError, ValueError):
+                pass
+        if date is not None and amount is not None:
+            schedule.append((date, amount))
+    return sorted(schedule)
+
+
+def settlementDate(today=None, days=2):
+    d = datetime.date.today() if today is None else today
+    while days > 0:
+        d = d + datetime.timedelta(days=1)
+        if d.weekday() < 5:
+            days -= 1
+    return d
+
+
+class ZeroCurve():
+    """Continuously compounded zero rates (decimal) at times in years, linear in between and flat outside.
+    """
+    def __init__(self, times, rates):
+        order = numpy.argsort(times)
+        self.times = numpy.asarray(times, dtype=float)[order]
+        self.rates = numpy.asarray(rates, dtype=float)[order]
+
+    def zeroRate(self, t):
+        return numpy.interp(t, self.times, self.rates)
+
+    def discount(self, t, spread=0.):
+        return numpy.exp(-(self.zeroRate(t) + spread) * t)
+
+
+def bootstrapSwapCurve(swapHistory, maxYears=30):
+    """ZeroCurve from a SwapHistory: tenors under a year from its money market rates (simple interest),
+    then one point a year from its interpolated par swap rates, treated as annual.
+    """
+    times = []
+    rates = []
+    for (years, rate) in zip(swapHistory.df['years'], swapHistory.df['LAST_PRICE']):
+        if years < 1 and rate == rate:
+            times.append(years)
+            rates.append(math.log(1 + rate / 100. * years) / years)
+    annuity = 0.
+    for n in range(1, maxYears + 1):
+        swapRate = swapHistory.getRateFromYears(n) / 100.
+        if swapRate != swapRate:
+            break
+        discount = (1 - swapRate * annuity) / (1 + swapRate)
+        if discount <= 0:
+            break
+        annuity += discount
+        times.append(float(n))
+        rates.append(-math.log(discount) / n)
+    return ZeroCurve(times, rates)
+
+
+def _solve(f, x0, lo, hi, tol=1e-10, maxIterations=50):
+    """Root of f (returning value and derivative) by Newton from x0, falling back to bisection on [lo, hi]
+    when a step leaves the bracket. Returns NaN if the root isn't bracketed or the iteration doesn't converge.
+    """
+    (flo, dummy) = f(lo)
+    (fhi, dummy) = f(hi)
+    if flo * fhi > 0:
+        return numpy.nan
+    x = x0
+    for i in range(0, maxIterations):
+        (fx, dfx) = f(x)
+        if abs(fx) < tol:
+            return x
+        if fx * flo > 0:
+            (lo, flo) = (x, fx)
+        else:
+            hi = x
+        step = x - fx / dfx if dfx != 0 else lo - 1.
+        x = step if lo < step < hi else (lo + hi) / 2.
+    return x if abs(f(x)[0]) < 1e-6 else numpy.nan
+
+
+class BondAnalyticsEngine():
+    """Yield and z-spread from price for the bonds added with addBond().
+    Cashflows are built once per bond and settlement date, then every solve is a few numpy operations.
+    Results are cached per bond and price until the curve, the settlement date or the bond change, so repeated quotes cost a lookup.
+
+    Keyword arguments:
+    settle : settlement date (defaults to settlementDate() if not specified)
+    """
+    def __init__(self, settle=None):
+        self.settle = settlementDate() if settle is None else settle
+        self.curves = {} # currency -> ZeroCurve
+        self.bonds = {} # bond -> dictionary of static data
+        self.cache = {} # bond -> (times, periods, amounts, accrued)
+        self.results = {} # bond -> {price: (yield, z-spread)}
+        self.maxCachedPrices = 64
+
+    def setCurve(self, currency, curve):
+        self.curves[currency] = curve
+        self.results = {}
+
+    def setSettlement(self, settle):
+        self.settle = settle
+        self.cache = {}
+        self.results = {}
+
+    def addBond(self, bond, coupon, maturity, frequency, currency, sinkSchedule=None, factor=1.):
+        """
+        Keyword arguments:
+        coupon : annual coupon in percent
+        maturity : datetime.date or datetime.datetime
+        frequency : coupons a year (1, 2, 4 or 12, other bonds are not added)
+        currency : to find the discount curve
+        sinkSchedule : list of (date, amount per 100 original face) for sinking funds (defaults to a bullet bond if not specified)
+        factor : principal factor, outstanding face over original face - prices and cashflows are per 100 outstanding
+        """
+        if not frequency in [1, 2, 4, 12]:
+            return
+        if isinstance(maturity, datetime.datetime):
+            maturity = maturity.date()
+        if factor != factor or factor <= 0:
+            factor = 1.
+        self.bonds[bond] = {'coupon': float(coupon), 'maturity': maturity, 'frequency': int(frequency), 'currency': currency,
+                            'sinkSchedule': [] if sinkSchedule is None else sorted(sinkSchedule), 'factor': float(factor)}
+        self.cache.pop(bond, None)
+        self.results.pop(bond, None)
+
+    def hasBond(self, bond):
+        return bond in self.bonds and self.bonds[bond]['currency'] in self.curves
+
+    def cashflows(self, bond):
+        """(times in years ACT/365, periods to each cashflow, amounts per 100 face, accrued per 100 face) at self.settle.
+        """
+        if not bond in self.cache:
+            static = self.bonds[bond]
+            frequency = static['frequency']
+            maturity = static['maturity']
+            step = 12 / frequency
+            dates = [maturity]
+            while addMonths(maturity, -step * len(dates)) > self.settle:
+                dates.append(addMonths(maturity, -step * len(dates)))
+            previous = addMonths(maturity, -step * len(dates))
+            dates.reverse()
+            coupon = static['coupon'] / frequency
+            # principal repaid on each coupon date, per 100 outstanding: sinks after settlement go to the next coupon date, the rest at maturity
+            principal = numpy.zeros(len(dates))
+            for (sinkDate, amount) in static['sinkSchedule']:
+                if self.settle < sinkDate < maturity:
+                    principal[min(bisect.bisect_left(dates, sinkDate), len(dates) - 1)] += amount / static['factor']
+            principal[-1] = 0.
+            principal[-1] = max(100. - principal.sum(), 0.)
+            outstanding = 100. - numpy.concatenate(([0.], numpy.cumsum(principal)[:-1]))
+            amounts = coupon * outstanding / 100. + principal
+            times = numpy.array([(d - self.settle).days / 365. for d in dates])
+            firstPeriod = days30360(self.settle, dates[0]) / (360. / frequency)
+            periods = firstPeriod + numpy.arange(0, len(dates))
+            accrued = static['coupon'] * days30360(previous, self.settle) / 360.
+            self.cache[bond] = (times, periods, amounts, accrued)
+        return self.cache[bond]
+
+    def yieldFromPrice(self, bond, price):
+        """Yield in percent from clean price, NaN on failure.
+        """
+        if not bond in self.bonds or price != price or price <= 0:
+            return numpy.nan
+        (times, periods, amounts, accrued) = self.cashflows(bond)
+        frequency = float(self.bonds[bond]['frequency'])
+        dirty = price + accrued
+
+        def f(y):
+            discount = (1 + y / frequency) ** -periods
+            return ((amounts * discount).sum() - dirty, -(amounts * periods * discount).sum() / (frequency + y))
+
+        y = _solve(f, self.bonds[bond]['coupon'] / 100., -0.5 * frequency + 1e-6, 2.)
+        return 100. * y
+
+    def zSpreadFromPrice(self, bond, price):
+        """Z-spread in bp from clean price, NaN on failure.
+        """
+        if not self.hasBond(bond) or price != price or price <= 0:
+            return numpy.nan
+        (times, periods, amounts, accrued) = self.cashflows(bond)
+        discount = self.curves[self.bonds[bond]['currency']].discount(times)
+        frequency = float(self.bonds[bond]['frequency'])
+        dirty = price + accrued
+
+        def f(z):
+            spread = (1 + z / frequency) ** (-frequency * times)
+            return ((amounts * discount * spread).sum() - dirty, -(amounts * times * discount * spread).sum() / (1 + z / frequency))
+
+        return 10000. * _solve(f, 0.02, -0.1, 2.)
+
+    def analytics(self, bond, price):
+        """(yield in percent, z-spread in bp) from clean price, from the cache if the bond was already solved at that price.
+        """
+        cached = self.results.setdefault(bond, {})
+        if price in cached:
+            return cached[price]
+        out = (self.yieldFromPrice(bond, price), self.zSpreadFromPrice(bond, price))
+        if price != price:
+            return out
+        if len(cached) >= self.maxCachedPrices:
+            cached.clear()
+        cached[price] = out
+        return out
+
+    def analyticsMany(self, bonds, prices, curveShift=0.):
+        """(yields in percent, z-spreads in bp) arrays for a list of bonds and clean prices, solved together with BondSolver.
+        NaN for bonds the engine doesn't have or can't solve. Without a curve shift, cached prices are not solved again
+        and the results are cached.
+
+        Keyword arguments:
+        curveShift : parallel shift of the zero curves in bp, for scenarios
+        """
+        prices = numpy.asarray(prices, dtype=float)
+        yields = numpy.full(len(bonds), numpy.nan)
+        spreads = numpy.full(len(bonds), numpy.nan)
+        todo = []
+        for (i, bond) in enumerate(bonds):
+            price = prices[i]
+            if not self.hasBond(bond) or price != price or price <= 0:
+                continue
+            cached = self.results.get(bond, {})
+            if curveShift == 0 and price in cached:
+                (yields[i], spreads[i]) = cached[price]
+            else:
+                todo.append(i)
+        if len(todo) == 0:
+            return (yields, spreads)
+        flows = [self.cashflows(bonds[i]) for i in todo]
+        times = BondSolver.padCashflows([flow[0] for flow in flows])
+        periods = BondSolver.padCashflows([flow[1] for flow in flows])
+        amounts = BondSolver.padCashflows([flow[2] for flow in flows])
+        currencies = numpy.array([self.bonds[bonds[i]]['currency'] for i in todo])
+        discount = numpy.ones_like(times)
+        for currency in set(currencies):
+            rows = currencies == currency
+            discount[rows] = self.curves[currency].discount(times[rows], curveShift / 10000.)
+        dirty = prices[todo] + numpy.array([flow[3] for flow in flows])
+        frequency = numpy.array([self.bonds[bonds[i]]['frequency'] for i in todo], dtype=float)
+        coupons = numpy.array([self.bonds[bonds[i]]['coupon'] for i in todo]) / 100.
+        (y, dummy) = BondSolver.solveYields(periods, amounts, frequency, dirty, coupons)
+        (z, dummy) = BondSolver.solveZSpreads(times, amounts, discount, dirty, frequency=frequency)
+        yields[todo] = 100. * y
+        spreads[todo] = 10000. * z
+        if curveShift == 0:
+            for (row, i) in enumerate(todo):
+                cached = self.results.setdefault(bonds[i], {})
+                if len(cached) >= self.maxCachedPrices:
+                    cached.clear()
+                cached[prices[i]] = (yields[i], spreads[i])
+        return (yields, spreads)
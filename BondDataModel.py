@@ -7,22 +7,37 @@ Released under Apache 2.0 license. More info at http://www.apache.org/licenses/L
 Classes:
 MessageContainer: simple wrapper
 RFDdata: used to poll risk free prices every few minutes
+BDMpublisher: sends the bonds updated since its last run to the grids, at a fixed cadence
+AnalyticsBatcher: in streaming mode, asks Bloomberg for the analytics of the bonds whose price changed, in one request every few hundred ms
+StagedLoader: runs the first pass of the remaining tabs in the background once the visible tab is loaded, reporting progress
 BondDataModel: the main class, basically a huge table with data getting updated from Bloomberg in real time.
 StreamWatcher: helper class to send analytics data (both real time price data and static data) to the BondDataModel
 
 Functions:
 getMaturityDate(): helper function to convert Bloomberg date format to datetime format
+_hasMoved(): helper function to compare an old and a new price, NaN included
 """
 import wx
 from wx.lib.pubsub import pub
 
+import numpy
 import pandas
 import blpapiwrapper
+import blpapirecorder
+from LatencyMonitor import LatencyMonitor
+from LivePriceStore import LivePriceStore
+import PriceHistoryStore
+import BondAnalytics
+import SwapHistory
 import threading
 import datetime
+import glob
 import os
 import time
-from win32api import GetUserName
+try:
+    from win32api import GetUserName
+except ImportError: # not on Windows
+    from getpass import getuser as GetUserName
 from enum import Enum
 
 from StaticDataImport import ccy, countries, bonds, TEMPPATH, bonduniverseexclusionsList, frontToEmail, SPECIALBONDS, SINKABLEBONDS, BBGHand, regsToBondName, bbgToBdmDic, PHPATH, traderLogins
@@ -30,7 +45,7 @@ from StaticDataImport import ccy, countries, bonds, TEMPPATH, bonduniverseexclus
 
 
 # This is 7x slower than checking string but safer (770ns vs 110ns)
-BloombergQuery = Enum('BloombergQuery', ['BID', 'PRICEONLY', 'RTGACC', 'ANALYTICS', 'FIRSTPASS'])
+BloombergQuery = Enum('BloombergQuery', ['BID', 'PRICEONLY', 'RTGACC', 'ANALYTICS', 'FIRSTPASS', 'STREAM'])
 
 
 class MessageContainer():
@@ -41,6 +56,7 @@ class MessageContainer():
 class StreamWatcher(blpapiwrapper.Observer):
     """StreamWatcher class : Class to stream and update analytic data from Bloomberg
     BID keyword for watching events, ANALYTICS to get everything once event triggered, FIRSTPASS for first pass, RTGACC for ratings
+    STREAM for a stream carrying the prices themselves (see BondDataModel.streamAllPrices)
     """
     def __init__(self, bdm, qtype = BloombergQuery.BID):
         self.bdm = bdm
@@ -50,6 +66,13 @@ class StreamWatcher(blpapiwrapper.Observer):
         if kwargs['field'] == 'ALL':
             self.bdm.updatePrice(kwargs['security'], kwargs['field'], kwargs['data'], self.qtype)
 
+    def updateBatch(self, updates, time=None):
+        if self.qtype == BloombergQuery.STREAM:
+            self.bdm.updateStreamPrices(updates)
+            return
+        for u in updates:
+            self.bdm.updatePrice(u.security, 'ALL', 0, self.qtype)
+
 
 def getMaturityDate(d):
     # Function to parse maturity date in YYYY-MM-DD format. Override for perps
@@ -60,6 +83,11 @@ def getMaturityDate(d):
     return output
 
 
+def _hasMoved(old, new):
+    # NaN to NaN is not a move
+    return old != new and not (pandas.isnull(old) and pandas.isnull(new))
+
+
 class RFdata(wx.Timer):
     def __init__(self, secs, req, bdm):
         wx.Timer.__init__(self)
@@ -70,8 +98,7 @@ class RFdata(wx.Timer):
 
     def refreshRFBonds(self,event):
         self.req.get()
-        out = self.req.output.astype(float)
-        for (isinkey, data) in out.iterrows():
+        for (isinkey, data) in self.req.output.iterrows():
             self.bdm.updatePrice(isinkey, 'ALL', data, BloombergQuery.ANALYTICS)
 
 
@@ -79,18 +106,136 @@ class BDMdata(wx.Timer):
     def __init__(self, secs, bdm):
         wx.Timer.__init__(self)
         self.bdm = bdm
-        self.dic = pandas.Series((self.bdm.df['ISIN'] + '@BGN Corp').values, index=self.bdm.df.index).to_dict()
+        self.refreshUniverse()
         self.Bind(wx.EVT_TIMER, self.refreshBDMPrice)
         self.Start(1000 * secs, oneShot=False)
 
+    def refreshUniverse(self):
+        self.dic = pandas.Series((self.bdm.df['ISIN'] + '@BGN Corp').values, index=self.bdm.df.index).to_dict()
+
     def refreshBDMPrice(self,event):
-        out = blpapiwrapper.simpleReferenceDataRequest(self.dic,'PX_MID')['PX_MID']
+        out = blpapiwrapper.simpleReferenceDataRequest(self.dic, 'PX_MID', fieldTypes={'PX_MID': float})['PX_MID']
         self.bdm.lock.acquire()
-        self.bdm.df['BGN_MID'] = out.astype(float)
+        self.bdm.df['BGN_MID'] = out
+        self.bdm.touchTable()
         self.bdm.lock.release()
         pub.sendMessage('BGN_PRICE_UPDATE', message=MessageContainer('empty'))
 
 
+class BDMpublisher(wx.Timer):
+    def __init__(self, secs, bdm):
+        wx.Timer.__init__(self)
+        self.bdm = bdm
+        self.Bind(wx.EVT_TIMER, self.publish)
+        self.Start(int(1000 * secs), oneShot=False)
+
+    def publish(self, event):
+        self.bdm.publishDirty()
+
+
+class AnalyticsBatcher(threading.Thread):
+    """Collects bonds whose price changed and asks for their analytics every interval seconds, in one request for all of them.
+    Bonds priced by the local engine are added with rsiOnly=True and only get the cheaper RSI request.
+    A bond added several times before the request goes out is only asked for once.
+    """
+    def __init__(self, bdm, interval=0.25):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.bdm = bdm
+        self.interval = interval
+        self.pending = set()
+        self.pendingRSI = set()
+        self.condition = threading.Condition()
+        self.isRunning = True
+        self.requestsSent = 0
+
+    def add(self, bonds, rsiOnly=False):
+        self.condition.acquire()
+        if rsiOnly:
+            self.pendingRSI.update(bonds)
+        else:
+            self.pending.update(bonds)
+        self.condition.notify()
+        self.condition.release()
+
+    def run(self):
+        while self.isRunning:
+            self.condition.acquire()
+            if len(self.pending) == 0 and len(self.pendingRSI) == 0:
+                self.condition.wait(1.)
+            self.condition.release()
+            time.sleep(self.interval) # ticks arriving meanwhile join the batch
+            self.condition.acquire()
+            bonds = list(self.pending)
+            rsiBonds = list(self.pendingRSI - self.pending) # the full analytics request has RSI too
+            self.pending = set()
+            self.pendingRSI = set()
+            self.condition.release()
+            if len(bonds) > 0 and self.isRunning:
+                try:
+                    self.bdm.requestAnalytics(bonds)
+                    self.requestsSent += 1
+                except Exception as e:
+                    print 'Analytics request failed: ' + str(e)
+            if len(rsiBonds) > 0 and self.isRunning:
+                try:
+                    self.bdm.requestRSI(rsiBonds)
+                    self.requestsSent += 1
+                except Exception as e:
+                    print 'RSI request failed: ' + str(e)
+
+    def stop(self):
+        self.isRunning = False
+        self.condition.acquire()
+        self.condition.notify()
+        self.condition.release()
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+
+
+class StagedLoader(threading.Thread):
+    """Runs BondDataModel.fillHistoricalPricesAndRating() and firstPass() for one stage (typically one tab) after the other, skipping bonds already loaded.
+    After each stage a BDM_LOAD_PROGRESS message is sent on the GUI thread with (label, bonds loaded, bonds to load),
+    and BDM_LOAD_COMPLETE once all the stages are done.
+
+    Keyword arguments:
+    bdm : BondDataModel
+    stages : list of (label, list of bonds)
+    loaded : bonds already loaded (e.g. the visible tab)
+    """
+    def __init__(self, bdm, stages, loaded=[]):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.bdm = bdm
+        self.loaded = set(loaded)
+        self.stages = []
+        for (label, bondList) in stages:
+            todo = [bond for bond in bondList if bond in bdm.df.index and not bond in self.loaded]
+            todo = sorted(set(todo), key=todo.index)
+            self.loaded.update(todo)
+            if len(todo) > 0:
+                self.stages.append((label, todo))
+        self.total = len(self.loaded)
+        self.count = len(set(loaded))
+        self.isRunning = True
+
+    def run(self):
+        for (label, bondList) in self.stages:
+            if not self.isRunning:
+                return
+            try:
+                self.bdm.fillHistoricalPricesAndRating(bondList)
+                self.bdm.firstPass(bondList)
+            except Exception as e:
+                print 'First pass failed for ' + label + ': ' + str(e)
+            self.count += len(bondList)
+            wx.CallAfter(pub.sendMessage, 'BDM_LOAD_PROGRESS', message=MessageContainer((label, self.count, self.total)))
+        wx.CallAfter(pub.sendMessage, 'BDM_LOAD_COMPLETE', message=MessageContainer(self.bdm))
+
+    def stop(self):
+        self.isRunning = False
+
+
 class BDMEODsave(wx.Timer):
     def __init__(self, bdm):
         wx.Timer.__init__(self)
@@ -103,13 +248,14 @@ class BDMEODsave(wx.Timer):
 
     def saveFile(self, event):
         self.bdm.firstPass()
-        out = self.bdm.df[['ISIN', 'BOND', 'MID', 'YLDM', 'ZM', 'BGN_MID']].copy()
+        out = self.bdm.snapshot().toDataFrame()[['ISIN', 'BOND', 'MID', 'YLDM', 'ZM', 'BGN_MID']].copy()
         out.set_index('ISIN', inplace=True)
         filename = 'bdm-' + datetime.datetime.today().strftime('%Y-%m-%d') + '-' + GetUserName() + '.csv'
         out.to_csv(PHPATH + filename)
+        self.bdm.saveWarmStart()
 
 
-class BondDataModel():
+class BondDataModel(object):
     """BondDataModel class : Class to define the bond data model
 
     Attributes:
@@ -122,6 +268,9 @@ class BondDataModel():
     self.th : trade history data. (defaults to None if mainframe is not specified. 
                                     This is to allow Pricer to be launched independently without having to connect to Front)
     self.df : pandas.DataFrame consisting of all the bonds' information
+    self.live : LivePriceStore holding the columns updated on every tick (self.colsLive) and the inputs of the static analytics
+                (self.colsLiveInputs). self.df gets the live columns copied in when it is read after a change.
+    self.lock : held by writers. Readers that need consistent rows (runs, axes, end of day save) use self.snapshot() instead.
 
     Methods:
     __init__()
@@ -136,6 +285,8 @@ class BondDataModel():
     reOpenConnection()
     refreshSwapRates()
     fillHistoricalPricesAndRating()
+    saveWarmStart()
+    loadWarmStart()
     updateBenchmarks()
     """
     def __init__(self, parent, mainframe=None):
@@ -167,8 +318,24 @@ class BondDataModel():
         colsPrice = ['BID', 'ASK', 'MID', 'BID_SIZE', 'ASK_SIZE', 'BGN_MID', 'OLDBID', 'OLDASK']
         colsAnalytics = ['YLDB', 'YLDA', 'YLDM', 'ZB', 'ZA', 'ZM','RSI14','RISK_MID']#,'INTSWAP'
         colsChanges = ['DP1FRT', 'DP1D', 'DP1W', 'DP1M', 'DY1D', 'DY1W', 'DY1M','DISP1D','DISP1W','DISP1M']
+        self.colsChanges = colsChanges
         colsPosition = ['POSITION', 'REGS', '144A','MV','RISK']
         self.colsAll = colsDescription + colsPriceHistory + colsRating + colsAccrued + colsPrice + colsAnalytics + colsChanges + colsPosition  # +colsPricingHierarchy+colsUpdate
+        # the store is the master copy of colsLive. colsLiveInputs are written to self.df in bulk and copied to the store by loadLiveInputs()
+        self.colsLive = [c for c in colsPrice + colsAnalytics + colsChanges if not c in ['BGN_MID', 'RISK_MID']]
+        self.colsLiveInputs = ['P1DFRT', 'P1D', 'P1W', 'P1M', 'Y1D', 'Y1W', 'Y1M', 'ISP1D', 'ISP1W', 'ISP1M', 'RISK_MID']
+        # columns saved by saveWarmStart() and shown, flagged stale, at the next launch until Bloomberg sends fresh data
+        self.colsWarmStart = colsPriceHistory + colsRating + colsAccrued + colsPrice + colsAnalytics + colsChanges + ['SIZE']
+        self.lock = threading.RLock() # re-entrant: self.df takes it too, and writers holding it read self.df
+        self.live = LivePriceStore(self.colsLive + self.colsLiveInputs)
+        self._df = pandas.DataFrame()
+        self._dfVersion = self.live.version
+        # bumped by writes to the table outside the store, see touchTable()
+        self.tableVersion = 0
+        self._tableCopy = None
+        self._tableCopyVersion = -1
+        self._snapshot = None
+        self._snapshotVersion = None
 
         self.df = pandas.DataFrame(columns=self.colsAll, index=bonds.index)
         # self.df.drop(bonduniverseexclusionsList,inplace=True)
@@ -176,7 +343,6 @@ class BondDataModel():
         self.df['ISIN'] = bonds['REGS']
         self.df['SERIES'] = 'REGS'
         self.gridList = []
-        self.lock = threading.Lock()
         for c in list(set(colsDescription) & set(bonds.columns)):
             self.df[c] = bonds[c]
         self.df.rename(columns={'AMT_OUTSTANDING': 'SIZE'}, inplace=True)
@@ -190,6 +356,7 @@ class BondDataModel():
         self.bbgPriceOnlyQuery = ['BID', 'ASK', 'BID_SIZE', 'ASK_SIZE']
         self.bbgPriceQuery = ['YLD_CNV_BID', 'Z_SPRD_BID', 'RSI_14D']
         self.bbgPriceSpecialQuery = ['YLD_CNV_BID', 'OAS_SPREAD_BID', 'RSI_14D']
+        self.bbgRSIQuery = ['RSI_14D'] # bonds priced by the local engine still get their RSI from Bloomberg
         self.bbgPriceLongQuery = ['BID', 'ASK', 'YLD_CNV_BID', 'Z_SPRD_BID', 'RSI_14D', 'BID_SIZE', 'ASK_SIZE']
         self.bbgPriceLongSpecialQuery = ['BID', 'ASK', 'YLD_CNV_BID', 'OAS_SPREAD_BID', 'RSI_14D', 'BID_SIZE', 'ASK_SIZE']
 
@@ -201,19 +368,189 @@ class BondDataModel():
         # self.bbgPriceSinkableQuery = ['BID', 'ASK', 'YLD_CNV_BID', 'YLD_CNV_ASK', 'RSI_14D', 'BID_SIZE', 'ASK_SIZE']
         self.riskFreeIssuers = ['T', 'DBR', 'UKT', 'OBL']
         self.bbgPriceRFQuery = ['BID', 'ASK', 'BID_YIELD', 'ASK_YIELD']
-        self.bbgSinkRequest = blpapiwrapper.BLPTS()
+        # Streaming mode: the EM stream carries bbgPriceOnlyQuery, prices are written as they arrive and the analytics of the bonds
+        # that moved are requested in batches every analyticsInterval seconds. False for BID events followed by PRICEONLY and ANALYTICS requests.
+        self.streamAllPrices = True
+        self.analyticsInterval = 0.25
+        self.analyticsBatcher = None
+        # Startup loads the visible tab first, then the other tabs in the background
+        self.stagedLoader = None
+        # Warm start: the table saved at shutdown and at the end of the day is shown at launch, bonds stay stale until fresh data comes in
+        self.warmStartPath = TEMPPATH + 'bdmwarmstart-' + GetUserName() + '.npz'
+        self.warmStartMaxAge = 7 # days
+        self.staleBonds = set()
+        self.priceHistory = None # PriceHistoryStore, built by the first fillHistoricalPricesAndRating()
+        self.historyLock = threading.Lock() # today's history and ratings file is shared by the loading stages
+        # all the fields above are numeric - typed columns save an astype(float) on every response
+        self.bbgFloatTypes = dict.fromkeys(set(self.bbgPriceLongQuery + self.bbgPriceLongSpecialQuery + self.bbgPriceRFQuery + ['YAS_ZSPREAD']), float)
+        self.bbgSinkRequest = blpapiwrapper.BLPTS(sessionPool=blpapiwrapper.defaultSessionPool, fieldTypes=self.bbgFloatTypes)
+        self.sinkRequestLock = threading.Lock()
+        # BID ticks for the same bond within conflationWindow seconds are merged into one updatePrice - 0 (the default) is off.
+        # conflationGroupWindows overrides it per TICKER, for instance {'ARGENT': 2.}
+        self.conflationWindow = 0
+        self.conflationGroupWindows = {}
+        self.bidConflator = None
+        # BID events are handed to a queue so the stream thread never waits on updatePrice - one consumer as BLPTS objects are not thread safe
+        self.bidQueueSize = 1000
+        self.bidQueue = None
+        # Tick to grid latency, dumped from the pricer
+        self.latency = LatencyMonitor(keyFunction=lambda security: regsToBondName.get(security[0:12]))
+        # Updated bonds are marked dirty and published together every publishInterval seconds - 0 to publish each update straight away
+        self.publishInterval = 0.2
+        self.publisher = None
+        self.dirty = set()
+        self.dirtyLock = threading.Lock()
+        self.colsPublished = self.colsLive + ['SNP', 'MDY', 'FTC']
+        self.recorder = None
+        self.replay = None
+        # Yield and z-spread computed in process from the price when possible, Bloomberg is only asked for the bonds the engine can't do.
+        # A bond is only priced locally once the first pass has checked the engine against Bloomberg for it: within localTolerance bp
+        # on both yield and z-spread, and the difference is kept in localBasis (bond -> (yield, z-spread)) and added to every local solve.
+        self.localAnalytics = True
+        self.analyticsEngine = None
+        self.localTolerance = 3.
+        self.localBasis = {}
+        # Slow-moving static fields, time to live in days
+        referenceTTL = {'RTG_SP': 1, 'RTG_MOODY': 1, 'RTG_FITCH': 1, 'INT_ACC': 1, 'DAYS_TO_NEXT_COUPON': 1, 'YRS_TO_SHORTEST_AVG_LIFE': 1,
+                        'RISK_MID': 1, 'PRINCIPAL_FACTOR': 1, 'AMT_OUTSTANDING': 7, 'CPN_FREQ': 30}
+        self.referenceCache = blpapiwrapper.ReferenceDataCache(TEMPPATH + 'refdatacache-' + GetUserName() + '.csv', ttl=referenceTTL, sessionPool=blpapiwrapper.defaultSessionPool)
+        # history requests (SwapHistory, simpleHistoryRequest) are cached next to it rather than in the system temp directory
+        blpapiwrapper.defaultHistoryCache = blpapiwrapper.HistoryCache(TEMPPATH + 'bbghistorycache-' + GetUserName(), sessionPool=blpapiwrapper.defaultSessionPool)
         pass
 
+    @property
+    def df(self):
+        # live columns are copied in only if the store changed since the last read, under the lock so writers and
+        # snapshot() never see a half copied table. Readers outside the model should use snapshot() instead.
+        self.lock.acquire()
+        try:
+            version = self.live.version
+            if version != self._dfVersion:
+                self.live.copyTo(self._df, self.colsLive)
+                self._dfVersion = version
+            return self._df
+        finally:
+            self.lock.release()
+
+    @df.setter
+    def df(self, frame):
+        # a new table (universe change, history join): the store is rebuilt from it
+        self.lock.acquire()
+        try:
+            self._df = frame
+            self.live.reset(frame)
+            self._dfVersion = self.live.version
+            self.tableVersion += 1
+        finally:
+            self.lock.release()
+
+    def loadLiveInputs(self):
+        """Copies the static analytics inputs (history and risk) to the store, after they are written to self.df.
+        """
+        self.lock.acquire()
+        self.live.load(self._df, self.colsLiveInputs)
+        self._dfVersion = self.live.version
+        self.touchTable()
+        self.lock.release()
+
+    def touchTable(self):
+        """To be called after writing to self.df outside the live columns, so the next snapshot picks it up.
+        """
+        self.tableVersion += 1
+
+    def snapshot(self):
+        """Consistent read-only LivePriceSnapshot of the whole table, to read without the lock for as long as needed.
+        Snapshots are shared while nothing changes. The lock is only held to hand the store arrays over (copy on write),
+        plus a copy of the table outside the live columns when it changed since the last snapshot (positions, BGN prices).
+        """
+        self.lock.acquire()
+        version = (self.live.version, self.tableVersion)
+        if self._snapshotVersion != version:
+            if self._tableCopyVersion != self.tableVersion:
+                self._tableCopy = self._df.copy()
+                self._tableCopyVersion = self.tableVersion
+            self._snapshot = self.live.snapshot(static=self._tableCopy)
+            self._snapshotVersion = version
+        snapshot = self._snapshot
+        self.lock.release()
+        return snapshot
+
+    def bondRecords(self, bonds, snapshot):
+        """numpy record array with one record per bond: BOND, then the self.colsPublished columns, read from snapshot.
+        """
+        ids = [snapshot.bondId[bond] for bond in bonds]
+        static = [c for c in self.colsPublished if not c in self.colsLive]
+        columns = [numpy.array(bonds, dtype=object)] + [snapshot.arrays[c][ids] for c in self.colsLive] + [snapshot.static.loc[bonds, c].values for c in static]
+        return numpy.rec.fromarrays(columns, names=['BOND'] + self.colsLive + static)
+
+    def publishUpdates(self, bonds):
+        """Marks bonds dirty for the next publishDirty(), or publishes them now if publishInterval is 0.
+        """
+        self.dirtyLock.acquire()
+        self.dirty.update(bonds)
+        self.dirtyLock.release()
+        if self.publishInterval == 0:
+            self.publishDirty()
+
+    def publishDirty(self):
+        """Sends one BOND_PRICE_BATCH_UPDATE message with the records of the bonds updated since the last call, if any.
+        """
+        self.dirtyLock.acquire()
+        dirty = self.dirty
+        self.dirty = set()
+        self.dirtyLock.release()
+        snapshot = self.snapshot()
+        bonds = [bond for bond in dirty if bond in snapshot]
+        if len(bonds) == 0:
+            return
+        records = self.bondRecords(bonds, snapshot)
+        for bond in bonds:
+            self.latency.mark(bond, 'PUBLISH')
+        pub.sendMessage('BOND_PRICE_BATCH_UPDATE', message=MessageContainer(records))
+
     def reduceUniverse(self):
         """Reduce the bond universe to bonds that are in any one grid
         """
         self.bondList = list(set([bond for grid in self.parent.gridList for bond in grid.bondList]))#set removes duplicates
+        self.dfUniverse = self.df.copy() # static data for the whole universe, so bonds can be added later by refreshUniverse()
         self.df = self.df.reindex(self.bondList)
         self.df = self.df[pandas.notnull(self.df['ISIN'])]
+        self.splitUniverse()
+
+    def splitUniverse(self):
         self.rfbonds = list(self.df.loc[self.df['TICKER'].isin(self.riskFreeIssuers)].index)
         self.embondsisins = self.df.loc[~self.df['TICKER'].isin(self.riskFreeIssuers), 'ISIN']
         self.rfbondsisins = self.df.loc[self.df['TICKER'].isin(self.riskFreeIssuers), 'ISIN']
 
+    def refreshUniverse(self):
+        """Brings the universe in line with the bonds now in the grids, without restarting the feed: removed bonds are unsubscribed
+        and dropped, added bonds get their history and ratings, are subscribed and get a first pass. Call after startUpdates(),
+        once the grids' bond lists are reloaded (see PricingGrid.reloadTab()).
+        Added bonds stay on Bloomberg analytics until the local analytics engine is rebuilt.
+        """
+        newBondList = set([bond for grid in self.parent.gridList for bond in grid.bondList])
+        added = [bond for bond in newBondList if not bond in self.df.index and bond in self.dfUniverse.index and pandas.notnull(self.dfUniverse.at[bond, 'ISIN'])]
+        removed = [bond for bond in self.df.index if not bond in newBondList]
+        if len(added) == 0 and len(removed) == 0:
+            return
+        removedIsins = list((self.df.loc[removed, 'ISIN'] + BBGHand + ' Corp').astype(str))
+        self.lock.acquire()
+        self.df = pandas.concat([self.df.drop(removed), self.dfUniverse.loc[added]])
+        self.lock.release()
+        self.bondList = list(self.df.index)
+        self.splitUniverse()
+        self.bbgstreamBIDEM.unsubscribe(removedIsins)
+        addedEm = self.embondsisins.reindex(added).dropna()
+        addedIsins = list((addedEm + BBGHand + ' Corp').astype(str))
+        if self.bidConflator is not None:
+            self.bidConflator.groups.update(zip(addedIsins, self.df.loc[addedEm.index, 'TICKER']))
+        self.bbgstreamBIDEM.subscribe(addedIsins)
+        self.RFtimer.req.fillRequest(list((self.rfbondsisins + '@CBBT' + ' Corp').astype(str)), self.bbgPriceRFQuery)
+        self.BDMdata.refreshUniverse()
+        if len(added) > 0:
+            self.fillHistoricalPricesAndRating(added)
+            self.firstPass(priorityBondList=added)
+
     def fillPositions(self):
         """Fills positions if trade history data is available
         """
@@ -224,7 +561,9 @@ class BondDataModel():
             self.df['POSITION'].fillna(0, inplace=True)
             self.df['REGS'].fillna(0, inplace=True)
             self.df['144A'].fillna(0, inplace=True)
-            self.df['RISK'] = -self.df['RISK_MID'] * self.df['POSITION'] / 10000.
+            if 'RISK_MID' in self.df.columns: # otherwise set by fillHistoricalPricesAndRating()
+                self.df['RISK'] = -self.df['RISK_MID'].astype(float) * self.df['POSITION'] / 10000.
+            self.touchTable()
 
     def updatePrice(self, isinkey, field, data, qtype):
         """
@@ -238,40 +577,46 @@ class BondDataModel():
         """
         isin = isinkey[0:12]
         bond = regsToBondName[isin]
+        if not bond in self.live:
+            return # removed by refreshUniverse() while the tick or response was on its way
         if qtype == BloombergQuery.BID:
+            self.latency.mark(bond, 'UPDATE_PRICE')
             # 1/ WE CACHE THE OLD PRICE
-            self.updateCell(bond, 'OLDBID', self.df.at[bond, 'BID'])
-            self.updateCell(bond, 'OLDASK', self.df.at[bond, 'ASK'])
+            self.lock.acquire()
+            self.live.setRow(bond, [('OLDBID', self.live.get(bond, 'BID')), ('OLDASK', self.live.get(bond, 'ASK'))])
+            self.lock.release()
             # 2/ WE CHECK IF PRICE CHANGED
             if bond in self.rfbonds:
                 self.blptsAnalytics.get(isin + '@CBBT' + ' Corp', self.bbgPriceRFQuery)
             else:
                 self.blptsPriceOnly.get(isin + BBGHand + ' Corp', self.bbgPriceOnlyQuery)
         elif qtype == BloombergQuery.PRICEONLY:
-            data = data.astype(float)
+            self.latency.mark(bond, 'PRICE_RESPONSE')
+            self.staleBonds.discard(bond)
             # for item, value in data.iteritems():
             #     self.updateCell(bond,bbgToBdmDic[item],value)
             self.lock.acquire()
-            for item, value in data.iteritems():
-                self.df.at[bond, bbgToBdmDic[item]] = value
+            self.live.setRow(bond, [(bbgToBdmDic[item], value) for (item, value) in data.iteritems()])
             self.lock.release()
-            if (data['BID'] != self.df.at[bond, 'OLDBID']) or (data['ASK'] != self.df.at[bond, 'OLDASK']):
-                if bond in SPECIALBONDS:
-                    self.blptsAnalytics.get(isin + BBGHand + ' Corp', self.bbgPriceSpecialQuery)
+            if (data['BID'] != self.live.get(bond, 'OLDBID')) or (data['ASK'] != self.live.get(bond, 'OLDASK')):
+                if bond in self.applyLocalAnalytics([bond]):
+                    if bond in SPECIALBONDS:
+                        self.blptsAnalytics.get(isin + BBGHand + ' Corp', self.bbgPriceSpecialQuery)
+                    else:
+                        self.blptsAnalytics.get(isin + BBGHand + ' Corp', self.bbgPriceQuery)
                 else:
-                    self.blptsAnalytics.get(isin + BBGHand + ' Corp', self.bbgPriceQuery)
+                    self.blptsAnalytics.get(isin + BBGHand + ' Corp', self.bbgRSIQuery) # yield and spread are local
                     # try:
                     #     self.blptsAnalytics.get(isin + BBGHand + ' Corp', self.bbgPriceQuery)
                     # except:
                     #     print 'error asking analytics for ' + bond
             else:
                 # print 'Update event without a price change for ' + bond
-                pub.sendMessage('BOND_PRICE_UPDATE', message=MessageContainer(self.df.loc[bond]))
+                self.publishUpdates([bond])
         elif qtype == BloombergQuery.RTGACC:
             for item, value in data.iteritems():
                 self.updateCell(bond,bbgToBdmDic[item],value)
         else:#'ANALYTICS' or 'FIRSTPASS'
-            data = data.astype(float)
             # try:
             #     for item, value in data.iteritems():
             #         self.updateCell(bond,bbgToBdmDic[item],value)
@@ -280,60 +625,291 @@ class BondDataModel():
             self.lock.acquire()
             try:
                 for item, value in data.iteritems():
-                    self.df.at[bond, bbgToBdmDic[item]] = value
+                    self.setCell(bond, bbgToBdmDic[item], value)
             except:
-                self.lock.release()
                 print data
             self.lock.release()
+            self.staleBonds.discard(bond)
             if bond in SINKABLEBONDS:
-                #self.bbgSinkRequest.fillRequest(isin + ' Corp', ['YAS_ZSPREAD'], strOverrideField='YAS_BOND_PX', strOverrideValue=data['BID'])
-                self.bbgSinkRequest.fillRequest(isin + ' Corp', ['YAS_ZSPREAD'], strOverrideField='YAS_BOND_PX', strOverrideValue=self.df.at[bond, 'BID'])
-                self.bbgSinkRequest.get()
-                self.updateCell(bond, 'ZB', float(self.bbgSinkRequest.output.values[0,0]))
+                self.updateSinkableSpread(bond, isin)
                 #self.bbgSinkRequest.fillRequest(isin + ' Corp', ['YAS_ZSPREAD'], strOverrideField='YAS_BOND_PX', strOverrideValue=data['ASK'])
                 # self.bbgSinkRequest.fillRequest(isin + ' Corp', ['YAS_ZSPREAD'], strOverrideField='YAS_BOND_PX', strOverrideValue=self.df.at[bond, 'ASK'])
                 # self.bbgSinkRequest.get()                
                 # self.updateCell(bond, 'ZA', float(self.bbgSinkRequest.output.values[0,0]))
             if qtype == BloombergQuery.ANALYTICS:
-                self.updateStaticAnalytics(bond)
+                self.latency.mark(bond, 'ANALYTICS_RESPONSE')
+                self.updateStaticAnalytics([bond])
+
+    def updateStreamPrices(self, updates):
+        """Gets called by StreamWatcher in streaming mode with the StreamUpdate list of one event.
+        Prices and sizes go straight to the store. Bonds whose bid or ask moved are handed to the analytics batcher, and all of them are published.
+        """
+        updated = []
+        moved = []
+        self.lock.acquire()
+        for u in updates:
+            bond = regsToBondName.get(u.security[0:12])
+            if bond is None or not bond in self.live:
+                continue
+            self.latency.mark(bond, 'UPDATE_PRICE')
+            (oldBid, oldAsk) = (self.live.get(bond, 'BID'), self.live.get(bond, 'ASK'))
+            self.live.setRow(bond, [('OLDBID', oldBid), ('OLDASK', oldAsk)] + [(bbgToBdmDic[f], v) for (f, v) in zip(u.fields, u.values)])
+            updated.append(bond)
+            self.staleBonds.discard(bond)
+            if _hasMoved(oldBid, self.live.get(bond, 'BID')) or _hasMoved(oldAsk, self.live.get(bond, 'ASK')):
+                moved.append(bond)
+        self.lock.release()
+        remaining = self.applyLocalAnalytics(moved)
+        if len(moved) > 0 and self.analyticsBatcher is not None:
+            self.analyticsBatcher.add(remaining)
+            self.analyticsBatcher.add(set(moved) - set(remaining), rsiOnly=True)
+        if len(updated) > 0:
+            self.publishUpdates(updated)
+
+    def updateSinkableSpread(self, bond, isin):
+        """Z-spread of a sinking fund at its bid: from the local engine (sink schedule aware, cached per price) if it has the bond,
+        otherwise a blocking YAS_ZSPREAD request with the bid as YAS_BOND_PX override.
+        """
+        engine = self.analyticsEngine
+        if self.localAnalytics and engine is not None and bond in self.localBasis:
+            z = engine.analytics(bond, self.live.get(bond, 'BID'))[1] + self.localBasis[bond][1]
+            if z == z:
+                self.updateCell(bond, 'ZB', z)
+                return
+        self.sinkRequestLock.acquire() # ticks of several streams can get here at the same time
+        self.bbgSinkRequest.fillRequest(isin + ' Corp', ['YAS_ZSPREAD'], strOverrideField='YAS_BOND_PX', strOverrideValue=self.live.get(bond, 'BID'))
+        self.bbgSinkRequest.get()
+        z = self.bbgSinkRequest.output.values[0,0]
+        self.sinkRequestLock.release()
+        self.updateCell(bond, 'ZB', z)
+
+    def loadSinkSchedules(self):
+        """Returns a dictionary bond -> list of (date, amount per 100 original face) for the SINKABLEBONDS of the table.
+        Requested from Bloomberg (SINK_SCHEDULE) once a day, the day's file in TEMPPATH is read after that.
+        """
+        sinkables = [bond for bond in SINKABLEBONDS if bond in self.df.index]
+        savepath = TEMPPATH + 'sinkschedules-' + self.dtToday.strftime('%Y-%m-%d') + '.csv'
+        schedules = {}
+        if os.path.exists(savepath):
+            saved = pandas.read_csv(savepath, parse_dates=['DATE'])
+            for (bond, date, amount) in zip(saved['BOND'], saved['DATE'], saved['AMOUNT']):
+                schedules.setdefault(bond, []).append((date.date(), amount))
+        toFetch = [bond for bond in sinkables if not bond in schedules]
+        if len(toFetch) > 0:
+            isins = list((self.df.loc[toFetch, 'ISIN'] + ' Corp').astype(str))
+            blpts = blpapiwrapper.BLPTS(isins, ['SINK_SCHEDULE'], sessionPool=blpapiwrapper.defaultSessionPool)
+            blpts.get()
+            blpts.closeSession()
+            for (bond, isin) in zip(toFetch, isins):
+                try:
+                    schedules[bond] = BondAnalytics.sinkScheduleFromBloomberg(blpts.output.at[isin, 'SINK_SCHEDULE'])
+                except KeyError:
+                    print 'No sink schedule for ' + bond
+            rows = [(bond, date, amount) for (bond, schedule) in schedules.iteritems() for (date, amount) in schedule]
+            pandas.DataFrame(rows, columns=['BOND', 'DATE', 'AMOUNT']).to_csv(savepath, index=False)
+        return schedules
+
+    def loadAnalyticsEngine(self):
+        """Builds the local analytics engine: swap zero curves for the currencies SwapHistory knows, the bullet bonds of the universe,
+        and the SINKABLEBONDS with their sink schedule and principal factor.
+        SPECIALBONDS (OAS), risk free bonds, sinkables without a schedule and bonds without a proper maturity or coupon frequency stay on Bloomberg analytics.
+        """
+        engine = BondAnalytics.BondAnalyticsEngine()
+        for currency in set(self.df['CRNCY'].dropna()) & set(SwapHistory.allSwapTickers.keys()):
+            try:
+                engine.setCurve(currency, BondAnalytics.bootstrapSwapCurve(SwapHistory.SwapHistory(currency, self.dtToday)))
+            except Exception as e:
+                print 'No local analytics for ' + currency + ' bonds, swap curve failed: ' + str(e)
+        tickers = pandas.Series((self.df['ISIN'] + ' Corp').values, index=self.df.index)
+        frequencies = self.referenceCache.get(list(tickers.unique()), ['CPN_FREQ'], fieldTypes={'CPN_FREQ': float}).reindex(tickers.values)['CPN_FREQ']
+        frequencies.index = tickers.index
+        try:
+            schedules = self.loadSinkSchedules()
+        except Exception as e:
+            print 'Sink schedules not loaded, sinkable bonds stay on Bloomberg analytics: ' + str(e)
+            schedules = {}
+        excluded = set(SPECIALBONDS) | set(self.rfbonds) | (set(SINKABLEBONDS) - set(bond for (bond, schedule) in schedules.iteritems() if len(schedule) > 0))
+        for (bond, row) in self.df[['COUPON', 'MATURITYDT', 'CRNCY', 'PRINCIPAL_FACTOR']].iterrows():
+            if bond in excluded or row['MATURITYDT'].year >= 2049: # getMaturityDate() default for perps
+                continue
+            if bond in SINKABLEBONDS:
+                engine.addBond(bond, row['COUPON'], row['MATURITYDT'], frequencies[bond], row['CRNCY'], schedules[bond], row['PRINCIPAL_FACTOR'])
+            else:
+                engine.addBond(bond, row['COUPON'], row['MATURITYDT'], frequencies[bond], row['CRNCY'])
+        self.localBasis = {} # new curves: bonds go back to Bloomberg until the next first pass checks them again
+        self.analyticsEngine = engine
+
+    def calibrateLocalAnalytics(self, bonds):
+        """Compares the local engine with the Bloomberg analytics just written by the first pass, at the same bid.
+        Bonds within self.localTolerance bp on both yield and z-spread are priced locally from now on, with the difference
+        kept in self.localBasis so the local numbers carry on from Bloomberg's. The others stay on Bloomberg analytics.
+        """
+        engine = self.analyticsEngine
+        if not self.localAnalytics or engine is None:
+            return
+        bonds = [bond for bond in bonds if bond in self.live and engine.hasBond(bond)]
+        if len(bonds) == 0:
+            return
+        i = [self.live.bondId[bond] for bond in bonds]
+        (yields, spreads) = engine.analyticsMany(bonds, self.live.arrays['BID'][i])
+        dy = self.live.arrays['YLDB'][i] - yields
+        dz = self.live.arrays['ZB'][i] - spreads
+        with numpy.errstate(invalid='ignore'):
+            within = (numpy.abs(dy) * 100 <= self.localTolerance) & (numpy.abs(dz) <= self.localTolerance) # NaN fails both
+        for (bond, ok, y, z) in zip(bonds, within, dy, dz):
+            if ok:
+                self.localBasis[bond] = (y, z)
+            else:
+                self.localBasis.pop(bond, None)
+        if (~within).sum() > 0:
+            print str((~within).sum()) + ' of ' + str(len(bonds)) + ' bonds stay on Bloomberg analytics, local engine more than ' + str(self.localTolerance) + 'bp away'
+
+    def applyLocalAnalytics(self, bonds, staticAnalytics=True):
+        """Computes YLDB and ZB from the bid for bonds in one batched solve, writes them and updates static analytics once.
+        Returns the bonds that need Bloomberg analytics instead: not checked against Bloomberg (see calibrateLocalAnalytics()), or the solver failed.
+
+        Keyword arguments:
+        staticAnalytics : False if the caller updates static analytics itself
+        """
+        engine = self.analyticsEngine
+        if not self.localAnalytics or engine is None:
+            return bonds
+        local = [bond for bond in bonds if bond in self.live and bond in self.localBasis]
+        others = [bond for bond in bonds if not bond in local]
+        bonds = local
+        if len(bonds) == 0:
+            return others
+        bids = self.live.arrays['BID'][[self.live.bondId[bond] for bond in bonds]]
+        (yields, spreads) = engine.analyticsMany(bonds, bids)
+        yields = yields + numpy.array([self.localBasis[bond][0] for bond in bonds])
+        spreads = spreads + numpy.array([self.localBasis[bond][1] for bond in bonds])
+        solved = ~(numpy.isnan(yields) | numpy.isnan(spreads))
+        done = [bond for (bond, ok) in zip(bonds, solved) if ok]
+        if len(done) > 0:
+            self.lock.acquire()
+            a = self.live.writable(['YLDB', 'ZB'])
+            i = numpy.array([self.live.bondId[bond] for bond in done], dtype=int)
+            a['YLDB'][i] = yields[solved]
+            a['ZB'][i] = spreads[solved]
+            self.live.touch()
+            self.lock.release()
+            for bond in done:
+                self.latency.mark(bond, 'ANALYTICS_RESPONSE')
+            if staticAnalytics:
+                self.updateStaticAnalytics(done)
+        return others + [bond for (bond, ok) in zip(bonds, solved) if not ok]
+
+    def scenarioAnalytics(self, prices=None, curveShift=0.):
+        """Returns a DataFrame (YLDB, ZB) solved by the local engine for a scenario, without touching the table.
+        Bonds the engine can't price are NaN.
+
+        Keyword arguments:
+        prices : pandas Series bond -> clean price (defaults to the current bids if not specified)
+        curveShift : parallel shift of the swap curves in bp
+        """
+        if self.analyticsEngine is None:
+            self.loadAnalyticsEngine()
+        if prices is None:
+            prices = pandas.Series(self.live.arrays['BID'].copy(), index=self.live.bonds)
+        (yields, spreads) = self.analyticsEngine.analyticsMany(list(prices.index), prices.values, curveShift)
+        return pandas.DataFrame({'YLDB': yields, 'ZB': spreads}, index=prices.index, columns=['YLDB', 'ZB'])
 
-    def send_price_update(self, bonddata):
-        pub.sendMessage('BOND_PRICE_UPDATE', message=MessageContainer(bonddata))
+    def requestAnalytics(self, bonds):
+        """Asks for the analytics of bonds in one request (two if some are in SPECIALBONDS), writes them and updates static analytics once.
+        Called from the analytics batcher thread.
+        """
+        special = [bond for bond in bonds if bond in SPECIALBONDS]
+        for (subset, query) in [([bond for bond in bonds if not bond in SPECIALBONDS], self.bbgPriceQuery), (special, self.bbgPriceSpecialQuery)]:
+            isins = self.bondIsins(subset)
+            if len(isins) == 0:
+                continue
+            self.blptsAnalyticsBatch.get(isins, query)
+            for (isinkey, data) in self.blptsAnalyticsBatch.output.dropna(how='all').iterrows():
+                self.updatePrice(isinkey, 'ALL', data, BloombergQuery.FIRSTPASS)
+        for bond in bonds:
+            self.latency.mark(bond, 'ANALYTICS_RESPONSE')
+        self.updateStaticAnalytics(bonds)
 
-    def updateStaticAnalytics(self, bond):
-        """Updates static analytics.
+    def bondIsins(self, bonds):
+        """Bloomberg tickers (ISIN + BBGHand + ' Corp') of the bonds still in the table, read under the lock as refreshUniverse() may
+        be removing bonds from another thread.
         """
         self.lock.acquire()
-        dv01 = self.df.at[bond, 'RISK_MID']
-        if dv01 != 0:
-            delta = (self.df.at[bond, 'ASK'] - self.df.at[bond, 'BID']) / dv01
-            self.df.at[bond, 'YLDA'] = self.df.at[bond,'YLDB'] - delta
-            self.df.at[bond, 'ZA'] = self.df.at[bond,'ZB'] - delta*100
-        else:
-            self.df.at[bond, 'YLDA'] = pandas.np.nan
-            self.df.at[bond, 'ZA'] = pandas.np.nan
-        self.df.at[bond, 'MID'] = (self.df.at[bond, 'BID'] + self.df.at[bond, 'ASK']) / 2.
-        self.df.at[bond, 'DP1FRT'] = self.df.at[bond, 'MID'] - self.df.at[bond, 'P1DFRT']     
-        self.df.at[bond, 'DP1D'] = self.df.at[bond, 'MID'] - self.df.at[bond, 'P1D']
-        self.df.at[bond, 'DP1W'] = self.df.at[bond, 'MID'] - self.df.at[bond, 'P1W']
-        self.df.at[bond, 'DP1M'] = self.df.at[bond, 'MID'] - self.df.at[bond, 'P1M']
-        self.df.at[bond, 'YLDM'] = (self.df.at[bond, 'YLDB'] + self.df.at[bond, 'YLDA']) / 2.
-        self.df.at[bond, 'DY1D'] = (self.df.at[bond, 'YLDM'] - self.df.at[bond, 'Y1D']) * 100
-        self.df.at[bond, 'DY1W'] = (self.df.at[bond, 'YLDM'] - self.df.at[bond, 'Y1W']) * 100
-        self.df.at[bond, 'DY1M'] = (self.df.at[bond, 'YLDM'] - self.df.at[bond, 'Y1M']) * 100
-        self.df.at[bond, 'ZM'] = (self.df.at[bond, 'ZB'] + self.df.at[bond, 'ZA']) / 2.
-        self.df.at[bond, 'DISP1D'] = self.df.at[bond, 'ZM'] - self.df.at[bond, 'ISP1D']
-        self.df.at[bond, 'DISP1W'] = self.df.at[bond, 'ZM'] - self.df.at[bond, 'ISP1W']
-        self.df.at[bond, 'DISP1M'] = self.df.at[bond, 'ZM'] - self.df.at[bond, 'ISP1M']
+        bonds = [bond for bond in bonds if bond in self.live]
+        isins = list((self._df.loc[bonds, 'ISIN'] + BBGHand + ' Corp').astype(str))
+        self.lock.release()
+        return isins
+
+    def requestRSI(self, bonds):
+        """Asks for RSI_14D of bonds priced by the local engine in one request, writes it and publishes the bonds.
+        Called from the analytics batcher thread.
+        """
+        isins = self.bondIsins(bonds)
+        if len(isins) == 0:
+            return
+        self.blptsAnalyticsBatch.get(isins, self.bbgRSIQuery)
+        updated = []
+        self.lock.acquire()
+        for (isinkey, data) in self.blptsAnalyticsBatch.output.dropna(how='all').iterrows():
+            bond = regsToBondName.get(isinkey[0:12])
+            if bond in self.live:
+                self.setCell(bond, 'RSI14', data['RSI_14D'])
+                updated.append(bond)
+        self.lock.release()
+        self.publishUpdates(updated)
+
+    def updateStaticAnalytics(self, bonds):
+        """Updates static analytics for a list of bonds with whole-array operations, under one lock, then publishes them in one message.
+        """
+        if isinstance(bonds, basestring):
+            bonds = [bonds]
+        bonds = [bond for bond in bonds if bond in self.live]
+        if len(bonds) == 0:
+            return
+        self.lock.acquire()
+        a = self.live.writable(['YLDA', 'ZA', 'MID', 'YLDM', 'ZM'] + self.colsChanges)
+        i = numpy.array([self.live.bondId[bond] for bond in bonds], dtype=int)
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            dv01 = a['RISK_MID'][i]
+            delta = numpy.where(dv01 != 0, (a['ASK'][i] - a['BID'][i]) / dv01, numpy.nan)
+            a['YLDA'][i] = a['YLDB'][i] - delta
+            a['ZA'][i] = a['ZB'][i] - delta*100
+            mid = (a['BID'][i] + a['ASK'][i]) / 2.
+            a['MID'][i] = mid
+            a['DP1FRT'][i] = mid - a['P1DFRT'][i]
+            a['DP1D'][i] = mid - a['P1D'][i]
+            a['DP1W'][i] = mid - a['P1W'][i]
+            a['DP1M'][i] = mid - a['P1M'][i]
+            yldm = (a['YLDB'][i] + a['YLDA'][i]) / 2.
+            a['YLDM'][i] = yldm
+            a['DY1D'][i] = (yldm - a['Y1D'][i]) * 100
+            a['DY1W'][i] = (yldm - a['Y1W'][i]) * 100
+            a['DY1M'][i] = (yldm - a['Y1M'][i]) * 100
+            zm = (a['ZB'][i] + a['ZA'][i]) / 2.
+            a['ZM'][i] = zm
+            a['DISP1D'][i] = zm - a['ISP1D'][i]
+            a['DISP1W'][i] = zm - a['ISP1W'][i]
+            a['DISP1M'][i] = zm - a['ISP1M'][i]
+        self.live.touch()
         self.lock.release()
-        pub.sendMessage('BOND_PRICE_UPDATE', message=MessageContainer(self.df.loc[bond]))
+        for bond in bonds:
+            self.latency.mark(bond, 'STATIC_ANALYTICS')
+        self.publishUpdates(bonds)
 
     def updateCell(self, bond, field, value):
         # Thread safe implementation to update individual cells
         self.lock.acquire()
-        self.df.at[bond, field] = value
+        self.setCell(bond, field, value)
         self.lock.release()
 
+    def setCell(self, bond, field, value):
+        # Caller holds the lock. Live columns go to the store, others to the table, static analytics inputs to both
+        if self.live.hasColumn(field):
+            self.live.set(bond, field, value)
+        if not field in self.colsLive:
+            self._df.at[bond, field] = value
+            self.touchTable()
+
     def updatePositions(self, message=None):
         # Thread safe implementation to update positions
         self.lock.acquire()
@@ -343,29 +919,165 @@ class BondDataModel():
         self.df['144A'].fillna(0, inplace=True)
         self.df['POSITION'] = self.df['REGS'] + self.df['144A']
         self.df['RISK'] = -self.df['RISK_MID'] * self.df['POSITION'] / 10000.
+        self.touchTable()
         self.lock.release()
 
     def startUpdates(self):
         """Starts live feed from Bloomberg.
         """
         # Analytics stream
-        self.blptsAnalytics = blpapiwrapper.BLPTS()
+        self.blptsAnalytics = blpapiwrapper.BLPTS(sessionPool=blpapiwrapper.defaultSessionPool, fieldTypes=self.bbgFloatTypes)
         self.streamWatcherAnalytics = StreamWatcher(self, BloombergQuery.ANALYTICS)
-        self.blptsAnalytics.register(self.streamWatcherAnalytics)
+        self.blptsAnalytics.register(self.streamWatcherAnalytics, fields=['ALL'])
         # Price only stream
-        self.blptsPriceOnly = blpapiwrapper.BLPTS()
+        self.blptsPriceOnly = blpapiwrapper.BLPTS(sessionPool=blpapiwrapper.defaultSessionPool, fieldTypes=self.bbgFloatTypes)
         self.streamWatcherPriceOnly = StreamWatcher(self, BloombergQuery.PRICEONLY)
-        self.blptsPriceOnly.register(self.streamWatcherPriceOnly)
+        self.blptsPriceOnly.register(self.streamWatcherPriceOnly, fields=['ALL'])
+        if self.localAnalytics and self.analyticsEngine is None:
+            self.loadAnalyticsEngine()
         # Price change subscription
-        self.streamWatcherBID = StreamWatcher(self,BloombergQuery.BID)
-        self.bbgstreamBIDEM = blpapiwrapper.BLPStream(list((self.embondsisins + BBGHand + ' Corp').astype(str)), 'BID', 0)
-        self.bbgstreamBIDEM.register(self.streamWatcherBID)
-        self.bbgstreamBIDEM.start()
+        if self.streamAllPrices:
+            # single hop: the stream writes prices itself (cheap, no queue needed) and analytics are batched
+            self.streamWatcherBID = StreamWatcher(self, BloombergQuery.STREAM)
+            self.blptsAnalyticsBatch = blpapiwrapper.BLPTS(sessionPool=blpapiwrapper.defaultSessionPool, fieldTypes=self.bbgFloatTypes)
+            self.analyticsBatcher = AnalyticsBatcher(self, self.analyticsInterval)
+            self.analyticsBatcher.start()
+            self.bbgstreamBIDEM = blpapiwrapper.BLPStream(list((self.embondsisins + BBGHand + ' Corp').astype(str)), self.bbgPriceOnlyQuery, 0, sessionPool=blpapiwrapper.defaultSessionPool)
+            self.bbgstreamBIDEM.register(self.latency, fields=['ALL']) # first, so the trace starts on receipt
+            self.bbgstreamBIDEM.register(self.streamWatcherBID)
+            self.bbgstreamBIDEM.start()
+        else:
+            self.startBIDUpdates()
         # Risk free bonds: no streaming as too many updates - poll every 15 minutes
-        rfRequest = blpapiwrapper.BLPTS(list((self.rfbondsisins + '@CBBT' + ' Corp').astype(str)), self.bbgPriceRFQuery)
+        rfRequest = blpapiwrapper.BLPTS(list((self.rfbondsisins + '@CBBT' + ' Corp').astype(str)), self.bbgPriceRFQuery, sessionPool=blpapiwrapper.defaultSessionPool, fieldTypes=self.bbgFloatTypes)
         self.RFtimer = RFdata(900, rfRequest, self)
         self.BDMdata = BDMdata(900, self) #15 MINUTES
         self.BDMEODsave = BDMEODsave(self)
+        if self.publisher is None and self.publishInterval > 0:
+            self.publisher = BDMpublisher(self.publishInterval, self)
+
+    def startBIDUpdates(self):
+        """BID events, each followed by a PRICEONLY request, and by an ANALYTICS request if the price moved.
+        """
+        self.streamWatcherBID = StreamWatcher(self,BloombergQuery.BID)
+        self.bidQueue = blpapiwrapper.QueuedObserver(self.streamWatcherBID, maxSize=self.bidQueueSize, consumers=1)
+        self.bbgstreamBIDEM = blpapiwrapper.BLPStream(list((self.embondsisins + BBGHand + ' Corp').astype(str)), 'BID', 0, sessionPool=blpapiwrapper.defaultSessionPool)
+        self.bbgstreamBIDEM.register(self.latency, fields=['ALL']) # first, so the trace starts on receipt
+        if self.conflationWindow > 0 or len(self.conflationGroupWindows) > 0:
+            groups = dict(zip(self.embondsisins + BBGHand + ' Corp', self.df.loc[self.embondsisins.index, 'TICKER']))
+            self.bidConflator = blpapiwrapper.ConflatingObserver(self.bidQueue, window=self.conflationWindow, groups=groups, groupWindows=self.conflationGroupWindows)
+            self.bbgstreamBIDEM.register(self.bidConflator)
+        else:
+            self.bbgstreamBIDEM.register(self.bidQueue)
+        self.bbgstreamBIDEM.start()
+
+    def startRecording(self, path=None):
+        """Records the live feed (BID stream, price only and analytics requests) to a blpapirecorder log. Call after startUpdates().
+        The state the feed starts from is written first (see recordState()), so startReplay() needs no Bloomberg connection.
+
+        Keyword arguments:
+        path : log file (defaults to TEMPPATH + 'bbg-YYYY-MM-DD-user.rec' if not specified)
+        """
+        if path is None:
+            path = TEMPPATH + 'bbg-' + datetime.datetime.today().strftime('%Y-%m-%d') + '-' + GetUserName() + '.rec'
+        self.recorder = blpapirecorder.BLPRecorder(path)
+        self.recordState()
+        self.recorder.attach(self.bbgstreamBIDEM, BloombergQuery.BID.name)
+        self.recorder.attach(self.blptsPriceOnly, BloombergQuery.PRICEONLY.name)
+        self.recorder.attach(self.blptsAnalytics, BloombergQuery.ANALYTICS.name)
+        if self.analyticsBatcher is not None:
+            self.recorder.attach(self.blptsAnalyticsBatch, BloombergQuery.ANALYTICS.name)
+
+    def stopRecording(self):
+        if self.recorder is not None:
+            self.recorder.close()
+            self.recorder = None
+
+    def recordState(self):
+        """Writes what the feed starts from to the recorder as reference records, under their own tags:
+        TABLE - one record per bond with the self.colsWarmStart columns (first pass prices and analytics, history, ratings, accrued),
+        CURVE - one record per currency with the local engine's zero curve (fields are times in years, values zero rates),
+        ENGINE - one record per bond of the local engine with its static data, sink schedule and local basis (NaN if on Bloomberg analytics).
+        """
+        table = self.snapshot().toDataFrame()
+        columns = [c for c in self.colsWarmStart if c in table.columns]
+        for (bond, row) in table[columns].iterrows():
+            values = [None if (not isinstance(x, float) and pandas.isnull(x)) else x for x in row.values]
+            self.recorder.write(blpapirecorder.REFERENCE, 'TABLE', bond, '', columns, values)
+        engine = self.analyticsEngine
+        if engine is None:
+            return
+        for (currency, curve) in engine.curves.iteritems():
+            self.recorder.write(blpapirecorder.REFERENCE, 'CURVE', currency, '', [repr(t) for t in curve.times], list(curve.rates))
+        for (bond, static) in engine.bonds.iteritems():
+            sinks = ';'.join(d.strftime('%Y-%m-%d') + ':' + repr(amount) for (d, amount) in static['sinkSchedule'])
+            (basisYield, basisSpread) = self.localBasis.get(bond, (numpy.nan, numpy.nan))
+            self.recorder.write(blpapirecorder.REFERENCE, 'ENGINE', bond, '', ['COUPON', 'MATURITY', 'FREQUENCY', 'CURRENCY', 'FACTOR', 'SINK', 'BASIS_YIELD', 'BASIS_ZSPREAD'],
+                                [static['coupon'], static['maturity'].strftime('%Y-%m-%d'), static['frequency'], static['currency'], static['factor'], sinks,
+                                 float(basisYield), float(basisSpread)])
+
+    def loadRecordedState(self):
+        """Loads the TABLE, CURVE and ENGINE records of the replay (see recordState()) instead of asking Bloomberg.
+        Returns the bonds of the table that were in the log.
+        """
+        rows = dict((bond, self.replay.lookup('TABLE', bond)) for bond in self.replay.referenceSecurities('TABLE'))
+        bonds = self.loadTable(pandas.DataFrame(rows).transpose()) if len(rows) > 0 else []
+        curves = self.replay.referenceSecurities('CURVE')
+        if len(curves) == 0:
+            self.localAnalytics = False # analytics requests are answered from the log
+            return bonds
+        settle = BondAnalytics.settlementDate(datetime.date.fromtimestamp(self.replay.replayTime))
+        engine = BondAnalytics.BondAnalyticsEngine(settle)
+        self.localBasis = {}
+        for currency in curves:
+            points = sorted((float(t), rate) for (t, rate) in self.replay.lookup('CURVE', currency).iteritems())
+            engine.setCurve(currency, BondAnalytics.ZeroCurve([t for (t, rate) in points], [rate for (t, rate) in points]))
+        for bond in self.replay.referenceSecurities('ENGINE'):
+            static = self.replay.lookup('ENGINE', bond)
+            sinks = [(datetime.datetime.strptime(d, '%Y-%m-%d').date(), float(amount)) for (d, amount) in
+                     [item.split(':') for item in static['SINK'].split(';') if item != '']]
+            engine.addBond(bond, static['COUPON'], datetime.datetime.strptime(static['MATURITY'], '%Y-%m-%d'), int(static['FREQUENCY']),
+                           static['CURRENCY'], sinks, static['FACTOR'])
+            basis = (static.get('BASIS_YIELD', numpy.nan), static.get('BASIS_ZSPREAD', numpy.nan))
+            if basis[0] == basis[0] and basis[1] == basis[1]: # NaN: the bond was on Bloomberg analytics when recorded
+                self.localBasis[bond] = basis
+        self.analyticsEngine = engine
+        return bonds
+
+    def startReplay(self, path, speed=1.):
+        """Replays a log written by startRecording() instead of the first pass and the live feed - no Bloomberg connection needed.
+        Call after reduceUniverse(), instead of fillHistoricalPricesAndRating(), firstPass() and startUpdates().
+        The table and the local analytics engine are loaded from the state recorded at the start of the log, BID events come from the log,
+        and the price only and analytics requests they trigger are answered from the log.
+        The log must have been recorded in the same mode (streamAllPrices) as the replay.
+        Only the state at the start of the recording is replayed: a first pass or a rates refresh during the recording is not.
+        Off Windows, the imports still need wx, blpapi (imported by blpapiwrapper, no session is opened), matplotlib and scipy
+        (SwapHistory), and StaticDataImport reads its csv files from the O: network drive paths, which have to be reachable.
+
+        Keyword arguments:
+        path : log file
+        speed : 1 for real time, N for N times faster, 0 for as fast as possible
+        """
+        self.replay = blpapirecorder.BLPReplay(path, speed)
+        bonds = self.loadRecordedState()
+        self.updateStaticAnalytics(bonds)
+        if self.publisher is None and self.publishInterval > 0:
+            self.publisher = BDMpublisher(self.publishInterval, self)
+        self.blptsAnalytics = self.replay.requestSource(BloombergQuery.ANALYTICS.name)
+        self.streamWatcherAnalytics = StreamWatcher(self, BloombergQuery.ANALYTICS)
+        self.blptsAnalytics.register(self.streamWatcherAnalytics, fields=['ALL'])
+        self.blptsPriceOnly = self.replay.requestSource(BloombergQuery.PRICEONLY.name)
+        self.streamWatcherPriceOnly = StreamWatcher(self, BloombergQuery.PRICEONLY)
+        self.blptsPriceOnly.register(self.streamWatcherPriceOnly, fields=['ALL'])
+        if self.streamAllPrices:
+            self.streamWatcherBID = StreamWatcher(self, BloombergQuery.STREAM)
+            self.blptsAnalyticsBatch = self.replay.requestSource(BloombergQuery.ANALYTICS.name)
+            self.analyticsBatcher = AnalyticsBatcher(self, self.analyticsInterval)
+            self.analyticsBatcher.start()
+        else:
+            self.streamWatcherBID = StreamWatcher(self, BloombergQuery.BID)
+        self.replay.register(self.streamWatcherBID, BloombergQuery.BID.name)
+        self.replay.start()
 
     def firstPass(self, priorityBondList=[]):
         """Loads initial data upon start up. After downloading data on first pass, function will check for bonds
@@ -378,168 +1090,299 @@ class BondDataModel():
         if priorityBondList == []:
             emptyLines = list(self.df.index)
             isins = self.embondsisins + BBGHand + ' Corp'
+            rfIsins = self.rfbondsisins + ' @CBBT Corp'
         else:
             emptyLines = priorityBondList
-            isins = self.df.loc[priorityBondList, 'ISIN'] + BBGHand + ' Corp'
+            isins = self.embondsisins.reindex(priorityBondList).dropna() + BBGHand + ' Corp'
+            rfIsins = self.rfbondsisins.reindex(priorityBondList).dropna() + ' @CBBT Corp'
         isins = list(isins.astype(str))
-        blpts = blpapiwrapper.BLPTS(isins, self.bbgPriceLongQuery)
-        blptsStream = StreamWatcher(self,BloombergQuery.FIRSTPASS)
-        blpts.register(blptsStream)
-        blpts.get()
-        blpts.closeSession()
-
-        isins = self.rfbondsisins + ' @CBBT Corp'
-        isins = list(isins.astype(str))
-        blpts = blpapiwrapper.BLPTS(isins, self.bbgPriceRFQuery)
-        blptsStream = StreamWatcher(self, BloombergQuery.FIRSTPASS)
-        blpts.register(blptsStream)
-        blpts.get()
-        blpts.closeSession()
-
+        rfIsins = list(rfIsins.astype(str))
         specialBondList = list(set(emptyLines) & set(SPECIALBONDS))
         specialIsins = map(lambda x:self.df.at[x,'ISIN'] + BBGHand + ' Corp',specialBondList)
-        blpts = blpapiwrapper.BLPTS(specialIsins, self.bbgPriceLongSpecialQuery)
-        specialbondStream = StreamWatcher(self,BloombergQuery.FIRSTPASS)
-        blpts.register(specialbondStream)
-        blpts.get()
-        blpts.closeSession()
 
-        for bond in emptyLines:
-            self.updateStaticAnalytics(bond)  # This will update benchmarks and fill grid. Has to be done here so all data for benchmarks is ready.
+        # The three batches are in flight at the same time. Results are applied in order so SPECIALBONDS data overwrites the first batch.
+        # Without concurrent.futures (the futures backport on Python 2) they are sent one after the other.
+        batches = [(isins, self.bbgPriceLongQuery), (rfIsins, self.bbgPriceRFQuery), (specialIsins, self.bbgPriceLongSpecialQuery)]
+        if blpapiwrapper.Future is None:
+            for (securities, fields) in batches:
+                blpts = blpapiwrapper.BLPTS(securities, fields, sessionPool=blpapiwrapper.defaultSessionPool, fieldTypes=self.bbgFloatTypes)
+                blpts.get()
+                blpts.closeSession()
+                for (isinkey, data) in blpts.output.dropna(how='all').iterrows():
+                    self.updatePrice(isinkey, 'ALL', data, BloombergQuery.FIRSTPASS)
+        else:
+            engine = blpapiwrapper.BLPRequestEngine(sessionPool=blpapiwrapper.defaultSessionPool)
+            engine.start()
+            futures = [engine.submit(securities, fields, fieldTypes=self.bbgFloatTypes) for (securities, fields) in batches]
+            for future in futures:
+                try:
+                    out = future.result()
+                except Exception as e:
+                    print 'First pass request failed: ' + str(e)
+                    continue
+                for (isinkey, data) in out.dropna(how='all').iterrows():
+                    self.updatePrice(isinkey, 'ALL', data, BloombergQuery.FIRSTPASS)
+            engine.stop()
+
+        if self.localAnalytics and self.analyticsEngine is None:
+            self.loadAnalyticsEngine()
+        self.calibrateLocalAnalytics(emptyLines) # Bloomberg's first pass numbers are kept, the local engine carries on from them
+        self.updateStaticAnalytics(emptyLines)  # This will update benchmarks and fill grid. Has to be done here so all data for benchmarks is ready.
+        if self.publisher is None:
+            self.publishDirty() # before startUpdates(): publish now, afterwards the publisher picks the bonds up on the GUI thread
+
+    def startStagedLoading(self, stages, loaded):
+        """Starts a StagedLoader for the bonds not loaded yet, one stage after the other. Call after startUpdates().
+
+        Keyword arguments:
+        stages : list of (label, list of bonds), in the order they should load
+        loaded : bonds whose first pass is already done
+        """
+        self.stagedLoader = StagedLoader(self, stages, loaded)
+        self.stagedLoader.start()
+        return self.stagedLoader
 
     def reOpenConnection(self):
         """Reopens bloomberg connection. Function is called when the 'Restart Bloomberg Connection' button from the pricer frame is clicked
         """
+        recordingPath = None if self.recorder is None else self.recorder.path
+        self.stopRecording()
+        if self.stagedLoader is not None:
+            self.stagedLoader.stop() # the full first pass below covers the bonds it hadn't loaded
+            self.stagedLoader = None
+            self.fillHistoricalPricesAndRating() # bonds already filled are read from today's file
         self.blptsAnalytics.closeSession()
         self.blptsAnalytics = None
         self.bbgstreamBIDEM.closeSubscription()
         self.bbgstreamBIDEM = None
+        if self.bidConflator is not None:
+            self.bidConflator.stop()
+            self.bidConflator = None
+        if self.bidQueue is not None:
+            self.bidQueue.stop()
+            self.bidQueue = None
+        if self.analyticsBatcher is not None:
+            self.analyticsBatcher.stop()
+            self.analyticsBatcher = None
+            self.blptsAnalyticsBatch.closeSession()
         self.streamWatcherBID = None
         self.streamWatcherAnalytics = None
         self.blptsPriceOnly.closeSession()
         self.streamWatcherPriceOnly = None
+        blpapiwrapper.defaultSessionPool.closeAll() # restart means new connections, not recycled ones
         self.firstPass()
         self.startUpdates()
+        if recordingPath is not None:
+            self.startRecording(recordingPath) # the log is appended to
 
     def refreshSwapRates(self):
         """Refreshes the swap rates. Function is called when the 'Refresh Rates' button from the pricer menu is clicked.
         """
+        if self.localAnalytics:
+            self.loadAnalyticsEngine()
         self.firstPass()
 
-    def fillHistoricalPricesAndRating(self):
-        """Fill historical prices and ratings. Function is called when the pricer menu first launches. 
+    def saveWarmStart(self, path=None):
+        """Saves the self.colsWarmStart columns of the table for the next launch, as a typed columnar numpy file (.npz):
+        one array per column, numbers and dates as they are, text as unicode with a separate missing value mask.
+        Written to a temporary file first so a crash never leaves a half written snapshot.
+
+        Keyword arguments:
+        path : file to write (defaults to self.warmStartPath if not specified)
         """
-        time_start = time.time()
-        self.buildPriceHistory()
-        savepath = TEMPPATH + 'bondhistoryrating.csv'
-        #If bondhistoryratingUAT.csv doesn't exist, download data and write file.
-        cols = ['SNP', 'MDY', 'FTC', 'P1D', 'P1W', 'P1M', 'Y1D', 'Y1W', 'Y1M', 'ACCRUED', 'D2CPN', 'SAVG', 'ISP1D', 'ISP1W', 'ISP1M', 'RISK_MID', 'PRINCIPAL_FACTOR', 'SIZE']
-        if not (os.path.exists(savepath)) or datetime.datetime.fromtimestamp(
-                os.path.getmtime(savepath)).date() < datetime.datetime.today().date():
-            isins = self.df['ISIN'] + BBGHand + ' Corp'
-            isins = list(isins.astype(str))
-
-            ##
-            flds = ['RTG_SP', 'RTG_MOODY', 'RTG_FITCH', 'INT_ACC', 'DAYS_TO_NEXT_COUPON', 'YRS_TO_SHORTEST_AVG_LIFE', 'RISK_MID', 'PRINCIPAL_FACTOR', 'AMT_OUTSTANDING']
-            out = blpapiwrapper.simpleReferenceDataRequest(pandas.Series((self.df['ISIN'] + ' Corp').values, index=self.df.index).to_dict(),flds)[flds]
-            #loop
-            for f in flds:
-                self.df[bbgToBdmDic[f]] = out[f]
-            self.df['RISK_MID'].fillna(0, inplace=True)
-            ##
-            self.df.drop(['P1D', 'P1W', 'P1M', 'Y1D', 'Y1W', 'Y1M', 'ISP1D', 'ISP1W', 'ISP1M'], axis=1, inplace=True)
-            dbPriceHistory = pandas.read_csv(PHPATH + 'dbPriceHistory.csv', index_col=0)
-            dbYieldHistory = pandas.read_csv(PHPATH + 'dbYieldHistory.csv', index_col=0)
-            dbSpreadHistory = pandas.read_csv(PHPATH + 'dbSpreadHistory.csv', index_col=0)
-            hdt = []
-            if self.dtYesterday.strftime('%Y%m%d') in dbPriceHistory.columns:
-                hdt.append(self.dtYesterday.strftime('%Y%m%d'))
+        path = self.warmStartPath if path is None else path
+        table = self.snapshot().toDataFrame()
+        columns = [c for c in self.colsWarmStart if c in table.columns]
+        arrays = {'__index__': numpy.array([unicode(bond) for bond in table.index]), '__columns__': numpy.array(columns),
+                  '__saved__': numpy.array([datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')])}
+        for (i, column) in enumerate(columns):
+            values = table[column].values
+            if values.dtype.kind in 'biufM':
+                arrays['c%d' % i] = values
             else:
-                self.df['P1D'] = pandas.np.nan
-                self.df['Y1D'] = pandas.np.nan
-                self.df['ISP1D'] = pandas.np.nan
-            if self.dtLastWeek.strftime('%Y%m%d') in dbPriceHistory.columns:
-                hdt.append(self.dtLastWeek.strftime('%Y%m%d'))
-            else:
-                self.df['P1W'] = pandas.np.nan
-                self.df['Y1W'] = pandas.np.nan
-                self.df['ISP1W'] = pandas.np.nan
-            if self.dtLastMonth.strftime('%Y%m%d') in dbPriceHistory.columns:
-                hdt.append(self.dtLastMonth.strftime('%Y%m%d'))
-            else:
-                self.df['P1M'] = pandas.np.nan
-                self.df['Y1M'] = pandas.np.nan
-                self.df['ISP1M'] = pandas.np.nan
-            ohdt = [self.dtYesterday.strftime('%Y%m%d'), self.dtLastWeek.strftime('%Y%m%d'), self.dtLastMonth.strftime('%Y%m%d')]
-            self.df = self.df.join(dbPriceHistory[hdt], on='ISIN')
-            self.df.rename(columns={ohdt[0]:'P1D', ohdt[1]:'P1W', ohdt[2]:'P1M'}, inplace=True)
-            self.df = self.df.join(dbYieldHistory[hdt], on='ISIN')
-            self.df.rename(columns={ohdt[0]:'Y1D', ohdt[1]:'Y1W', ohdt[2]:'Y1M'}, inplace=True)
-            self.df = self.df.join(dbSpreadHistory[hdt], on='ISIN')
-            self.df.rename(columns={ohdt[0]:'ISP1D', ohdt[1]:'ISP1W', ohdt[2]:'ISP1M'}, inplace=True)
-
-            self.df[cols].to_csv(savepath)
-            self.df['ACCRUED'] = self.df['ACCRUED'].apply(lambda x: '{:,.2f}'.format(float(x)))
-            self.df['D2CPN'].fillna(-1, inplace=True)
-            self.df['D2CPN'] = self.df['D2CPN'].astype(int)
-            self.df[['RISK_MID','PRINCIPAL_FACTOR','SIZE']] = self.df[['RISK_MID','PRINCIPAL_FACTOR','SIZE']].astype(float)
-            self.df[['SNP', 'MDY', 'FTC']] = self.df[['SNP', 'MDY', 'FTC']].fillna('NA')  # ,'ACCRUED','D2CPN'
-            self.df[['SNP', 'MDY', 'FTC', 'ACCRUED']] = self.df[['SNP', 'MDY', 'FTC', 'ACCRUED']].astype(str)
-
-        #Otherwise, load and read from file.
-        else:
-            print 'Found existing file from today'
-            df = pandas.read_csv(savepath, index_col=0)
-            self.df[cols] = df[cols]
-            self.df[['RISK_MID','PRINCIPAL_FACTOR','SIZE','SAVG', 'ISP1D','ISP1W','ISP1M']] = self.df[['RISK_MID','PRINCIPAL_FACTOR','SIZE','SAVG', 'ISP1D','ISP1W','ISP1M']].astype(float)
-            self.df[['SNP', 'MDY', 'FTC']] = self.df[['SNP', 'MDY', 'FTC']].astype(str)
-            self.df['ACCRUED'].fillna(-1,inplace=True)#HACK SO NEXT LINE DOESN'T BLOW UP - WE DON'T WANT TO PUT 0 THERE!
-            self.df['ACCRUED'] = self.df['ACCRUED'].astype(float)
-            self.df['ACCRUED'] = self.df['ACCRUED'].apply(lambda x: '{:,.2f}'.format(float(x)))
-            self.df['D2CPN'].fillna(-1, inplace=True)#HACK SO NEXT LINE DOESN'T BLOW UP - WE DON'T WANT TO PUT 0 THERE!
-            self.df['D2CPN'] = self.df['D2CPN'].astype(int)          
-
-        print 'History fetched in: ' + str(int(time.time() - time_start)) + ' seconds.'
+                isnull = pandas.isnull(values)
+                arrays['c%d' % i] = numpy.array([u'' if missing else unicode(x) for (x, missing) in zip(values, isnull)])
+                arrays['n%d' % i] = isnull
+        with open(path + '.tmp', 'wb') as f:
+            numpy.savez(f, **arrays)
+        if os.path.exists(path):
+            os.remove(path)
+        os.rename(path + '.tmp', path)
+
+    def loadWarmStart(self, path=None):
+        """Loads the table saved by saveWarmStart() into self.df for the bonds of the current universe, and flags them stale.
+        Snapshots older than self.warmStartMaxAge days are ignored. Returns the list of bonds loaded.
+
+        Keyword arguments:
+        path : file to read (defaults to self.warmStartPath if not specified)
+        """
+        path = self.warmStartPath if path is None else path
+        if not os.path.exists(path):
+            return []
+        try:
+            saved = numpy.load(path)
+            savedTime = datetime.datetime.strptime(str(saved['__saved__'][0]), '%Y-%m-%d %H:%M:%S')
+            if (self.dtToday - savedTime).days > self.warmStartMaxAge:
+                return []
+            columns = [str(c) for c in saved['__columns__']]
+            frame = pandas.DataFrame(index=[str(bond) for bond in saved['__index__']])
+            for (i, column) in enumerate(columns):
+                values = saved['c%d' % i]
+                if 'n%d' % i in saved.files:
+                    values = numpy.array([str(x) for x in values], dtype=object)
+                    values[saved['n%d' % i]] = numpy.nan
+                frame[column] = values
+        except Exception as e:
+            print 'Could not read ' + path + ', cold start: ' + str(e)
+            return []
+        bonds = self.loadTable(frame)
+        self.staleBonds.update(bonds)
+        if len(bonds) > 0:
+            print 'Warm start from ' + path + ' saved ' + savedTime.strftime('%Y-%m-%d %H:%M') + ', ' + str(len(bonds)) + ' bonds'
+        return bonds
+
+    def loadTable(self, frame):
+        """Writes the columns of frame (indexed by bond) into the table and the store, for the bonds of the current universe.
+        Returns the list of bonds written.
+        """
+        bonds = [bond for bond in frame.index if bond in self._df.index]
+        if len(bonds) == 0:
+            return []
+        columns = list(frame.columns)
+        self.lock.acquire()
+        for column in columns:
+            if column in self.colsLive:
+                continue
+            if not column in self._df.columns:
+                self._df[column] = numpy.nan
+            if self._df[column].dtype != frame[column].dtype:
+                self._df[column] = self._df[column].astype(object)
+            self._df.loc[bonds, column] = frame.loc[bonds, column].values
+        liveColumns = [c for c in columns if self.live.hasColumn(c)]
+        a = self.live.writable(liveColumns)
+        ids = numpy.array([self.live.bondId[bond] for bond in bonds], dtype=int)
+        for column in liveColumns:
+            a[column][ids] = pandas.to_numeric(frame.loc[bonds, column], errors='coerce').values.astype(float)
+        self.live.touch()
+        self.touchTable()
+        self.lock.release()
+        return bonds
+
+    def fillHistoricalPricesAndRating(self, bonds=None):
+        """Fill historical prices and ratings for bonds (defaults to the whole universe). Called for the tab on screen when the pricer
+        menu first launches, then by the StagedLoader for the other tabs and by refreshUniverse() for added bonds.
+        Bonds in today's file (TEMPPATH + 'bondhistoryrating.csv') are read from it, the others are downloaded and added to it.
+        """
+        time_start = time.time()
+        self.historyLock.acquire()
+        try:
+            if self.priceHistory is None:
+                self.buildPriceHistory()
+            bonds = list(self.df.index) if bonds is None else [bond for bond in bonds if bond in self.df.index]
+            savepath = TEMPPATH + 'bondhistoryrating.csv'
+            cols = ['SNP', 'MDY', 'FTC', 'P1D', 'P1W', 'P1M', 'Y1D', 'Y1W', 'Y1M', 'ACCRUED', 'D2CPN', 'SAVG', 'ISP1D', 'ISP1W', 'ISP1M', 'RISK_MID', 'PRINCIPAL_FACTOR', 'SIZE']
+            saved = pandas.DataFrame(columns=cols)
+            if os.path.exists(savepath) and datetime.datetime.fromtimestamp(os.path.getmtime(savepath)).date() == datetime.datetime.today().date():
+                saved = pandas.read_csv(savepath, index_col=0)
+            found = [bond for bond in bonds if bond in saved.index]
+            missing = [bond for bond in bonds if not bond in saved.index]
+            out = saved.loc[found, cols]
+            out[['SNP', 'MDY', 'FTC']] = out[['SNP', 'MDY', 'FTC']].astype(str)
+            if len(missing) > 0:
+                downloaded = self.downloadHistoricalPricesAndRating(missing)[cols]
+                pandas.concat([saved[cols], downloaded]).to_csv(savepath)
+                out = pandas.concat([out, downloaded])
+            if len(out) == 0:
+                return
+            self.formatHistoricalPricesAndRating(out)
+            self.lock.acquire()
+            for c in cols:
+                if not c in self._df.columns:
+                    self._df[c] = -1 if out[c].dtype.kind == 'i' else numpy.nan
+                if self._df[c].dtype != out[c].dtype:
+                    self._df[c] = self._df[c].astype(object)
+                self._df.loc[out.index, c] = out[c].values
+            if 'POSITION' in self._df.columns:
+                self._df.loc[out.index, 'RISK'] = -self._df.loc[out.index, 'RISK_MID'].astype(float) * self._df.loc[out.index, 'POSITION'] / 10000.
+            self.touchTable()
+            self.lock.release()
+            self.loadLiveInputs()
+        finally:
+            self.historyLock.release()
+        print 'History fetched for ' + str(len(bonds)) + ' bonds in: ' + str(int(time.time() - time_start)) + ' seconds.'
+
+    def downloadHistoricalPricesAndRating(self, bonds):
+        """Ratings, accrued, risk and size from Bloomberg (through the reference cache) and the 1D, 1W and 1M history from the
+        price history store, as a DataFrame indexed by bonds, not formatted yet (see formatHistoricalPricesAndRating()).
+        """
+        out = pandas.DataFrame(index=bonds)
+        flds = ['RTG_SP', 'RTG_MOODY', 'RTG_FITCH', 'INT_ACC', 'DAYS_TO_NEXT_COUPON', 'YRS_TO_SHORTEST_AVG_LIFE', 'RISK_MID', 'PRINCIPAL_FACTOR', 'AMT_OUTSTANDING']
+        fltTypes = dict.fromkeys(['INT_ACC', 'DAYS_TO_NEXT_COUPON', 'YRS_TO_SHORTEST_AVG_LIFE', 'RISK_MID', 'PRINCIPAL_FACTOR', 'AMT_OUTSTANDING'], float)
+        tickers = pandas.Series((self.df.loc[bonds, 'ISIN'] + ' Corp').values, index=bonds)
+        data = self.referenceCache.get(list(tickers.unique()), flds, fieldTypes=fltTypes).reindex(tickers.values) # only expired fields are requested
+        data.index = tickers.index
+        for f in flds:
+            out[bbgToBdmDic[f]] = data[f]
+        out['RISK_MID'].fillna(0, inplace=True)
+        # only the three days needed are read from the history store, days it doesn't have are NaN
+        isins = self.df.loc[bonds, 'ISIN'].values
+        for (suffix, dt) in [('1D', self.dtYesterday), ('1W', self.dtLastWeek), ('1M', self.dtLastMonth)]:
+            day = dt.strftime('%Y%m%d')
+            for (col, field) in [('P', 'MID'), ('Y', 'YLDM'), ('ISP', 'ZM')]:
+                history = self.priceHistory.lookup(isins, [day], field)
+                out[col + suffix] = history[day].values if day in history.columns else pandas.np.nan
+        return out
+
+    @staticmethod
+    def formatHistoricalPricesAndRating(frame):
+        """Display formats of the columns from downloadHistoricalPricesAndRating() or today's file, in place.
+        """
+        frame['ACCRUED'] = frame['ACCRUED'].apply(lambda x: '{:,.2f}'.format(float(x)))
+        frame['D2CPN'].fillna(-1, inplace=True)
+        frame['D2CPN'] = frame['D2CPN'].astype(int)
+        frame[['RISK_MID','PRINCIPAL_FACTOR','SIZE','SAVG', 'ISP1D','ISP1W','ISP1M']] = frame[['RISK_MID','PRINCIPAL_FACTOR','SIZE','SAVG', 'ISP1D','ISP1W','ISP1M']].astype(float)
+        frame[['SNP', 'MDY', 'FTC']] = frame[['SNP', 'MDY', 'FTC']].fillna('NA')  # ,'ACCRUED','D2CPN'
+        frame[['SNP', 'MDY', 'FTC', 'ACCRUED']] = frame[['SNP', 'MDY', 'FTC', 'ACCRUED']].astype(str)
 
     def updateBenchmarks(self):
         for grid in self.gridList:
             grid.updateBenchmarks()
 
     def buildPriceHistory(self):
-        self.dbPriceHistory = pandas.read_csv(PHPATH+'dbPriceHistory.csv', index_col=0)
-        self.dbYieldHistory = pandas.read_csv(PHPATH+'dbYieldHistory.csv', index_col=0)
-        self.dbSpreadHistory = pandas.read_csv(PHPATH+'dbSpreadHistory.csv', index_col=0)
-        todayStr = datetime.date.today().strftime('%Y%m%d')
-        if not todayStr in self.dbPriceHistory.columns:
-            last_existing_date = datetime.datetime.strptime(max(self.dbPriceHistory.columns),'%Y%m%d').date()
-            start_date = last_existing_date + datetime.timedelta(1)
-            end_date = datetime.date.today()
-            day_count = (end_date - start_date).days # until yesterday
-            for single_date in (start_date + datetime.timedelta(n) for n in range(day_count)):
-                single_date_str = single_date.strftime('%Y-%m-%d')
-                filenames = []
-                isSuccess = False
-                for trader in traderLogins:
-                    fp = PHPATH + 'bdm-' + single_date_str + '-' + trader + '.csv'
-                    if os.path.isfile(fp):
-                        isSuccess = True
-                        break
-                if not isSuccess:
-                    continue
-                df = pandas.read_csv(fp, index_col=0)
-                self.dbPriceHistory = pandas.concat([self.dbPriceHistory,df['MID']], axis=1)
-                self.dbYieldHistory = pandas.concat([self.dbYieldHistory,df['YLDM']], axis=1)
-                self.dbSpreadHistory = pandas.concat([self.dbSpreadHistory,df['ZM']], axis=1)
-                single_date_str_short = single_date.strftime('%Y%m%d')
-                self.dbPriceHistory.rename(columns={'MID':single_date_str_short}, inplace=True)
-                self.dbYieldHistory.rename(columns={'YLDM':single_date_str_short}, inplace=True)
-                self.dbSpreadHistory.rename(columns={'ZM':single_date_str_short}, inplace=True)
-            self.dbPriceHistory.to_csv(PHPATH + 'dbPriceHistory.csv')
-            self.dbYieldHistory.to_csv(PHPATH + 'dbYieldHistory.csv')
-            self.dbSpreadHistory.to_csv(PHPATH + 'dbSpreadHistory.csv')
-        else:
-            pass
-        pass
+        """Brings the price history store up to yesterday: each missing day is appended from the first end of day file (bdm-YYYY-MM-DD-trader.csv)
+        found for it, one partition per day. The first time, the store is filled from the old wide csv files, or if there are none
+        it starts at the earliest end of day file.
+        """
+        self.priceHistory = PriceHistoryStore.PriceHistoryStore(PHPATH + 'pricehistory/')
+        if self.priceHistory.lastDate() is None and os.path.exists(PHPATH + 'dbPriceHistory.csv'):
+            n = PriceHistoryStore.importWideHistory(self.priceHistory, PHPATH + 'dbPriceHistory.csv', PHPATH + 'dbYieldHistory.csv', PHPATH + 'dbSpreadHistory.csv')
+            print 'Imported ' + str(n) + ' days into the price history store'
+        if self.priceHistory.lastDate() is None:
+            today = datetime.date.today().strftime('%Y-%m-%d')
+            eodFiles = []
+            for fp in glob.glob(PHPATH + 'bdm-*.csv'):
+                name = os.path.basename(fp)[4:-4] # YYYY-MM-DD-trader
+                if name[10:11] == '-' and name[:10].replace('-', '').isdigit() and name[11:] in traderLogins and name[:10] < today:
+                    eodFiles.append((name[:10], fp))
+            if len(eodFiles) == 0:
+                return
+            (single_date_str, fp) = min(eodFiles)
+            self.priceHistory.append(single_date_str.replace('-', ''), pandas.read_csv(fp, index_col=0))
+            print 'Started the price history store at ' + single_date_str
+        start_date = datetime.datetime.strptime(self.priceHistory.lastDate(), '%Y%m%d').date() + datetime.timedelta(1)
+        day_count = (datetime.date.today() - start_date).days # until yesterday
+        for single_date in (start_date + datetime.timedelta(n) for n in range(day_count)):
+            single_date_str = single_date.strftime('%Y-%m-%d')
+            isSuccess = False
+            for trader in traderLogins:
+                fp = PHPATH + 'bdm-' + single_date_str + '-' + trader + '.csv'
+                if os.path.isfile(fp):
+                    isSuccess = True
+                    break
+            if not isSuccess:
+                continue
+            df = pandas.read_csv(fp, index_col=0)
+            self.priceHistory.append(single_date.strftime('%Y%m%d'), df)
 
 
 # class StreamWatcher(blpapiwrapper.Observer):
@@ -0,0 +1,131 @@
+"""
+Vectorized yield and z-spread solvers: one Newton iteration for all the bonds at once, over padded cashflow matrices.
+Released under Apache 2.0 license. More info at http://www.apache.org/licenses/LICENSE-2.0
+
+Each bond is a row: times, periods and amounts have one column per cashflow, padded with zero amounts up to the longest bond,
+so padding adds nothing to the price and its derivative. A row that doesn't converge is reported in the converged mask
+and set to NaN, the others are unaffected.
+
+Functions:
+padCashflows(): stacks per bond cashflow arrays into padded matrices
+newtonBisect(): root of a vector function, Newton with a bisection fallback per row
+solveYields(): yields (decimal) from dirty prices
+solveZSpreads(): z-spreads (decimal) from dirty prices and discount factors, compounded at the coupon frequency or continuously
+"""
+
+import numpy
+
+
+def padCashflows(rows):
+    """Stacks a list of 1-d arrays (or lists) into a matrix padded with zeros, one row each.
+    """
+    width = max([len(row) for row in rows] + [1])
+    out = numpy.zeros((len(rows), width))
+    for (i, row) in enumerate(rows):
+        out[i, :len(row)] = row
+    return out
+
+
+def newtonBisect(f, x0, lo, hi, tol=1e-10, xtol=1e-12, maxIterations=50):
+    """Roots of f, with the root of row i bracketed by [lo[i], hi[i]]. f(x, rows) returns (values, derivatives) for the rows
+    of the index array rows at the points x, so each iteration only evaluates the rows still active.
+    Every iteration takes a Newton step where it stays inside the bracket and bisects elsewhere, then narrows the brackets.
+    Returns (x, converged): rows that aren't bracketed or don't converge are NaN and False.
+
+    Keyword arguments:
+    x0 : starting points
+    lo, hi : brackets
+    tol : absolute tolerance on f
+    xtol : a row has converged when its step is smaller than this
+    maxIterations : Newton iterations before giving up
+    """
+    x = numpy.array(x0, dtype=float)
+    lo = numpy.array(lo, dtype=float) * numpy.ones_like(x)
+    hi = numpy.array(hi, dtype=float) * numpy.ones_like(x)
+    allRows = numpy.arange(len(x))
+    with numpy.errstate(divide='ignore', invalid='ignore', over='ignore'):
+        (flo, dummy) = f(lo, allRows)
+        (fhi, dummy) = f(hi, allRows)
+        converged = numpy.zeros(len(x), dtype=bool)
+        rows = allRows[flo * fhi <= 0]
+        for i in range(0, maxIterations):
+            if len(rows) == 0:
+                break
+            (fx, dfx) = f(x[rows], rows)
+            done = numpy.abs(fx) < tol
+            converged[rows[done]] = True
+            (rows, fx, dfx) = (rows[~done], fx[~done], dfx[~done])
+            xr = x[rows]
+            below = fx * flo[rows] > 0
+            lo[rows] = numpy.where(below, xr, lo[rows])
+            flo[rows] = numpy.where(below, fx, flo[rows])
+            hi[rows] = numpy.where(below, hi[rows], xr)
+            step = xr - fx / dfx
+            inside = (lo[rows] < step) & (step < hi[rows])
+            step = numpy.where(inside, step, (lo[rows] + hi[rows]) / 2.)
+            x[rows] = step
+            small = numpy.abs(step - xr) < xtol
+            converged[rows[small]] = True
+            rows = rows[~small]
+        if len(rows) > 0:
+            (fx, dummy) = f(x[rows], rows)
+            converged[rows[numpy.abs(fx) < 1e-6]] = True
+    return (numpy.where(converged, x, numpy.nan), converged)
+
+
+def solveYields(periods, amounts, frequency, dirty, x0=None):
+    """Yields (decimal, compounded at frequency) that price the cashflows at dirty, per row. Returns (yields, converged).
+
+    Keyword arguments:
+    periods : matrix of coupon periods to each cashflow
+    amounts : matrix of cashflow amounts, zero for padding
+    frequency : vector of coupons a year
+    dirty : vector of dirty prices, same unit as amounts
+    x0 : starting yields (defaults to 5% if not specified)
+    """
+    frequency = numpy.asarray(frequency, dtype=float)
+    dirty = numpy.asarray(dirty, dtype=float)
+    x0 = numpy.full(len(dirty), 0.05) if x0 is None else x0
+    k = frequency[:, numpy.newaxis]
+
+    def f(y, rows):
+        p = periods[rows]
+        a = amounts[rows]
+        discount = numpy.exp(-p * numpy.log1p(y[:, numpy.newaxis] / k[rows]))
+        value = (a * discount).sum(axis=1) - dirty[rows]
+        derivative = -(a * p * discount).sum(axis=1) / (frequency[rows] + y)
+        return (value, derivative)
+
+    return newtonBisect(f, x0, -0.5 * frequency + 1e-6, 2.)
+
+
+def solveZSpreads(times, amounts, discount, dirty, x0=None, frequency=None):
+    """Spreads (decimal) over the discount factors that price the cashflows at dirty, per row. Returns (spreads, converged).
+
+    Keyword arguments:
+    times : matrix of times in years to each cashflow
+    amounts : matrix of cashflow amounts, zero for padding
+    discount : matrix of discount factors at times
+    dirty : vector of dirty prices, same unit as amounts
+    x0 : starting spreads (defaults to 2% if not specified)
+    frequency : vector of compounding periods a year, the coupon frequency (defaults to continuous compounding if not specified)
+    """
+    dirty = numpy.asarray(dirty, dtype=float)
+    x0 = numpy.full(len(dirty), 0.02) if x0 is None else x0
+    weighted = amounts * discount
+    k = None if frequency is None else numpy.asarray(frequency, dtype=float)[:, numpy.newaxis]
+
+    def f(z, rows):
+        t = times[rows]
+        w = weighted[rows]
+        if k is None:
+            spread = numpy.exp(-z[:, numpy.newaxis] * t)
+            derivative = -(w * t * spread).sum(axis=1)
+        else:
+            growth = 1 + z[:, numpy.newaxis] / k[rows]
+            spread = numpy.exp(-k[rows] * t * numpy.log(growth))
+            derivative = -(w * t * spread / growth).sum(axis=1)
+        value = (w * spread).sum(axis=1) - dirty[rows]
+        return (value, derivative)
+
+    return newtonBisect(f, x0, -0.1, 2.)
@@ -0,0 +1,143 @@
+"""
+Tick latency instrumentation for the pricer
+Follows each Bloomberg tick from the stream to the grid and keeps per-stage latency statistics.
+Released under Apache 2.0 license. More info at http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import datetime
+import threading
+import time
+
+import numpy
+import pandas
+
+import blpapiwrapper
+
+STAGES = ['RECEIPT', 'UPDATE_PRICE', 'PRICE_RESPONSE', 'ANALYTICS_RESPONSE', 'STATIC_ANALYTICS', 'PUBLISH', 'PAINT']
+
+
+class LatencySamples():
+    """Last sampleSize latencies of one stage in a ring buffer, plus the count and maximum since the start.
+    """
+    def __init__(self, sampleSize=10000):
+        self.samples = numpy.zeros(sampleSize)
+        self.count = 0
+        self.max = 0.
+
+    def add(self, seconds):
+        self.samples[self.count % len(self.samples)] = seconds
+        self.count += 1
+        self.max = max(self.max, seconds)
+
+    def percentile(self, q):
+        return numpy.percentile(self.samples[:min(self.count, len(self.samples))], q)
+
+
+def eventTimeToSeconds(bbgTime):
+    """Bloomberg EVENT_TIME ('10:15:30.000' or '2017-06-01T10:15:30.000', UTC) to seconds since midnight, None if it can't be read.
+    """
+    try:
+        t = bbgTime.split('T')[-1].split('+')[0]
+        (h, m, s) = t.split(':')
+        return int(h) * 3600 + int(m) * 60 + float(s)
+    except:
+        return None
+
+
+class LatencyMonitor(blpapiwrapper.Observer):
+    """Per-bond traces of a tick going through the pricer, and latency statistics per stage.
+    Register it on the BLPStream (before the other observers) to open a trace on receipt, then call mark(bond, stage) along the way:
+    UPDATE_PRICE, PRICE_RESPONSE, ANALYTICS_RESPONSE, STATIC_ANALYTICS, PUBLISH and PAINT, which closes the trace.
+    Each mark records the time since the previous stage and since receipt. EVENT_TIME->RECEIPT compares Bloomberg's EVENT_TIME
+    with the local UTC clock, so it includes any clock difference.
+    Ticks arriving while a trace is open for the bond are merged into it, like the conflation and the queue merge them.
+
+    Keyword arguments:
+    keyFunction : stream security -> bond, None to ignore the security
+    sampleSize : number of latencies kept per stage for the percentiles
+    maxTraceAge : seconds after which an unfinished trace is replaced (e.g. a bond that is not in any grid)
+    """
+    def __init__(self, keyFunction=None, sampleSize=10000, maxTraceAge=60.):
+        self.keyFunction = keyFunction
+        self.sampleSize = sampleSize
+        self.maxTraceAge = maxTraceAge
+        self.traces = {} # bond -> list of (stage, time)
+        self.samples = {} # 'STAGE1->STAGE2' -> LatencySamples
+        self.lock = threading.Lock()
+        self.isActive = True
+
+    def update(self, *args, **kwargs):
+        if kwargs['field'] == 'ALL':
+            self.start(kwargs['security'], kwargs.get('bbgTime', ''))
+
+    def updateBatch(self, updates, time=None):
+        for u in updates:
+            self.start(u.security, u.bbgTime)
+
+    def start(self, security, bbgTime=''):
+        if not self.isActive:
+            return
+        now = time.time()
+        key = security if self.keyFunction is None else self.keyFunction(security)
+        if key is None:
+            return
+        self.lock.acquire()
+        trace = self.traces.get(key)
+        if trace is None or now - trace[0][1] > self.maxTraceAge:
+            self.traces[key] = [('RECEIPT', now)]
+            eventSeconds = eventTimeToSeconds(bbgTime)
+            if eventSeconds is not None:
+                utc = datetime.datetime.utcnow()
+                delay = (utc.hour * 3600 + utc.minute * 60 + utc.second + utc.microsecond / 1e6 - eventSeconds) % 86400
+                self.record('EVENT_TIME->RECEIPT', delay)
+        self.lock.release()
+
+    def mark(self, bond, stage):
+        if not self.isActive:
+            return
+        now = time.time()
+        self.lock.acquire()
+        trace = self.traces.get(bond)
+        if trace is not None:
+            (previousStage, previousTime) = trace[-1]
+            self.record(previousStage + '->' + stage, now - previousTime)
+            if previousStage != 'RECEIPT':
+                self.record('RECEIPT->' + stage, now - trace[0][1])
+            if stage == 'PAINT':
+                del self.traces[bond]
+            else:
+                trace.append((stage, now))
+        self.lock.release()
+
+    def record(self, name, seconds):
+        if not name in self.samples:
+            self.samples[name] = LatencySamples(self.sampleSize)
+        self.samples[name].add(seconds)
+
+    def report(self):
+        """Returns a DataFrame with one row per stage transition: count, p50, p99 and max in milliseconds.
+        """
+        self.lock.acquire()
+        rows = {}
+        for (name, samples) in self.samples.iteritems():
+            rows[name] = {'count': samples.count, 'p50': 1000 * samples.percentile(50), 'p99': 1000 * samples.percentile(99), 'max': 1000 * samples.max}
+        self.lock.release()
+        out = pandas.DataFrame(rows, index=['count', 'p50', 'p99', 'max']).transpose()
+        order = lambda name: [STAGES.index(s) if s in STAGES else -1 for s in reversed(name.split('->'))] # by stage reached, then stage from
+        return out.reindex(sorted(out.index, key=order))
+
+    def dump(self, path=None):
+        """Prints the report, and writes it to path as csv if specified.
+        """
+        out = self.report()
+        print 'Tick latency (ms) at ' + datetime.datetime.now().strftime('%H:%M:%S')
+        print out.to_string(float_format=lambda x: '{:,.1f}'.format(x))
+        if path is not None:
+            out.to_csv(path)
+        return out
+
+    def reset(self):
+        self.lock.acquire()
+        self.traces = {}
+        self.samples = {}
+        self.lock.release()
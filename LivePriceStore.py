@@ -0,0 +1,166 @@
+"""
+Live price store for the BondDataModel
+Numeric columns updated on every tick, kept as one contiguous float64 array per column indexed by an integer bond id.
+Released under Apache 2.0 license. More info at http://www.apache.org/licenses/LICENSE-2.0
+"""
+
+import numpy
+import pandas
+
+
+def _toFloat(values):
+    """Array of float64 from any sequence, values that can't be converted become NaN.
+    """
+    try:
+        return numpy.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        out = numpy.empty(len(values))
+        for (i, x) in enumerate(values):
+            try:
+                out[i] = float(x)
+            except (TypeError, ValueError):
+                out[i] = numpy.nan
+        return out
+
+
+class LivePriceStore():
+    """Struct of arrays: self.arrays[column][self.bondId[bond]] is the value of column for bond.
+    Reading or writing a value is an array access instead of a label lookup in a mostly object dtype DataFrame.
+    Callers that need pandas get a view built on demand with toDataFrame() or row().
+    self.version changes on every write, so a copy of the data can tell when it is out of date.
+    snapshot() hands the current arrays to a read-only LivePriceSnapshot without copying them: the first write to a column after that
+    copies the column (copy on write), so the snapshot never changes. Writers go through set(), setRow() or writable().
+    The store doesn't lock: the BondDataModel writes and takes snapshots under its own lock.
+
+    Keyword arguments:
+    columns : numeric columns held in the store
+    frame : DataFrame the bonds and initial values are taken from (defaults to an empty store if not specified)
+    """
+    def __init__(self, columns, frame=None):
+        self.columns = list(columns)
+        self.version = 0
+        self.reset(pandas.DataFrame() if frame is None else frame)
+
+    def reset(self, frame):
+        """Rebuilds the store with the bonds of frame's index, taking values from the columns of frame that are in the store.
+        """
+        self.bonds = list(frame.index)
+        self.bondId = dict(zip(self.bonds, range(len(self.bonds))))
+        self.arrays = dict((column, numpy.full(len(self.bonds), numpy.nan)) for column in self.columns)
+        self.shared = set() # columns whose array is held by a snapshot
+        self.load(frame)
+
+    def load(self, frame, columns=None):
+        """Copies columns (defaults to all the store columns) from frame, for the bonds of the store. Columns missing from frame are left alone.
+        """
+        for column in (self.columns if columns is None else columns):
+            if column in frame.columns:
+                self.writable([column])[column][:] = _toFloat(frame[column].reindex(self.bonds).values)
+        self.touch()
+
+    def __contains__(self, bond):
+        return bond in self.bondId
+
+    def __len__(self):
+        return len(self.bonds)
+
+    def hasColumn(self, column):
+        return column in self.arrays
+
+    def writable(self, columns):
+        """Returns self.arrays after making sure the arrays of columns can be written to (copies those a snapshot holds).
+        Call touch() after writing.
+        """
+        for column in columns:
+            if column in self.shared:
+                self.arrays[column] = self.arrays[column].copy()
+                self.shared.discard(column)
+        return self.arrays
+
+    def touch(self):
+        """To be called after writing to the arrays returned by writable().
+        """
+        self.version += 1
+
+    def get(self, bond, column):
+        return self.arrays[column][self.bondId[bond]]
+
+    def set(self, bond, column, value):
+        array = self.writable([column])[column]
+        try:
+            array[self.bondId[bond]] = value
+        except (TypeError, ValueError):
+            array[self.bondId[bond]] = numpy.nan
+        self.version += 1
+
+    def setRow(self, bond, items):
+        """Writes (column, value) pairs for one bond.
+        """
+        i = self.bondId[bond]
+        for (column, value) in items:
+            array = self.writable([column])[column]
+            try:
+                array[i] = value
+            except (TypeError, ValueError):
+                array[i] = numpy.nan
+        self.version += 1
+
+    def values(self, bond, columns=None):
+        i = self.bondId[bond]
+        return [self.arrays[column][i] for column in (self.columns if columns is None else columns)]
+
+    def row(self, bond, columns=None):
+        columns = self.columns if columns is None else columns
+        return pandas.Series(self.values(bond, columns), index=columns, name=bond)
+
+    def toDataFrame(self, columns=None):
+        columns = self.columns if columns is None else columns
+        return pandas.DataFrame(dict((column, self.arrays[column].copy()) for column in columns), index=self.bonds, columns=columns)
+
+    def copyTo(self, frame, columns=None):
+        """Writes the store columns into frame, which must have the same index as the store.
+        """
+        for column in (self.columns if columns is None else columns):
+            frame[column] = self.arrays[column].copy()
+
+    def snapshot(self, static=None):
+        """Read-only LivePriceSnapshot of the store at its current version. Cheap: the arrays are shared until the next write.
+
+        Keyword arguments:
+        static : DataFrame for the columns that are not in the store, kept by the snapshot as is - pass a copy nobody writes to
+        """
+        for array in self.arrays.itervalues():
+            array.flags.writeable = False
+        self.shared = set(self.columns)
+        return LivePriceSnapshot(self.version, self.bonds, self.bondId, dict(self.arrays), static)
+
+
+class LivePriceSnapshot():
+    """Immutable view of a LivePriceStore (and optionally of a static table) at one version.
+    Readers use it without any lock, for as long as they need, while the store keeps being written to.
+    """
+    def __init__(self, version, bonds, bondId, arrays, static=None):
+        self.version = version
+        self.bonds = bonds
+        self.bondId = bondId
+        self.arrays = arrays
+        self.static = static
+        self.frame = None
+
+    def __contains__(self, bond):
+        return bond in self.bondId
+
+    def get(self, bond, column):
+        if column in self.arrays:
+            return self.arrays[column][self.bondId[bond]]
+        return self.static.at[bond, column]
+
+    def toDataFrame(self):
+        """The whole table as a DataFrame, built on the first call. Don't modify it, other readers may share the snapshot.
+        """
+        if self.frame is None:
+            frame = pandas.DataFrame(index=self.bonds) if self.static is None else self.static.copy()
+            for (column, array) in self.arrays.iteritems():
+                frame[column] = array.copy() # some pandas routines need writable buffers
+            self.frame = frame
+        return self.frame
@@ -0,0 +1,160 @@
+"""
+End of day price history, partitioned by date.
+Released under Apache 2.0 license. More info at http://www.apache.org/licenses/LICENSE-2.0
+
+Each day is one compact numpy file (YYYYMMDD.npz) with the ISINs sorted, so they index the day by binary search,
+and one float64 array per field (MID, YLDM, ZM). The days available are the partitions in the directory; manifest.csv
+only logs them (one line appended per day, unlocked, so several pricers can leave it incomplete or with duplicates).
+Adding a day writes that day only, and a lookup reads only the days it asks for.
+
+Classes:
+PriceHistoryStore: append and lookup of daily partitions
+
+Functions:
+importWideHistory(): fills a store from the old wide csv files (one row per ISIN, one column per day)
+"""
+
+import glob
+import os
+import tempfile
+
+import numpy
+import pandas
+
+FIELDS = ['MID', 'YLDM', 'ZM']
+
+
+class PriceHistoryStore():
+    """Daily partitions of FIELDS by ISIN, in directory path.
+
+    Example:
+    store = PriceHistoryStore(PHPATH + 'pricehistory/')
+    store.append('20170601', bdmDataFrame) # indexed by ISIN, with MID, YLDM and ZM columns
+    store.lookup(isins, ['20170531', '20170524'], 'MID') # DataFrame indexed by isins, one column per day available
+    """
+    def __init__(self, path, cacheSize=8):
+        """
+        Keyword arguments:
+        path : directory of the partitions and the manifest, created if it doesn't exist
+        cacheSize : number of days kept in memory once read
+        """
+        self.path = path
+        self.cacheSize = cacheSize
+        self.cache = {} # day -> DataFrame
+        if not os.path.exists(path):
+            try:
+                os.makedirs(path)
+            except OSError: # created by another pricer in the meantime
+                if not os.path.isdir(path):
+                    raise
+        self.dates = self.scanDates()
+
+    def scanDates(self):
+        """Sorted list of the days (YYYYMMDD) with a partition in the directory. Temporary files of writes in progress are ignored.
+        """
+        days = [os.path.basename(f)[:-4] for f in glob.glob(os.path.join(self.path, '*.npz'))]
+        return sorted(day for day in days if len(day) == 8 and day.isdigit())
+
+    def partitionPath(self, day):
+        return os.path.join(self.path, day + '.npz')
+
+    def hasDate(self, day):
+        return day in self.dates
+
+    def lastDate(self):
+        return self.dates[-1] if len(self.dates) > 0 else None
+
+    def append(self, day, frame):
+        """Writes the partition of day (YYYYMMDD) from frame, indexed by ISIN, with the FIELDS columns (missing ones are NaN).
+        A day already in the store is replaced. The partition is written to a temporary file of this process then renamed, and if
+        another pricer holds or writes the same day at that moment its partition is kept.
+        """
+        frame = frame[~frame.index.duplicated()]
+        isins = numpy.array([str(isin) for isin in frame.index])
+        order = numpy.argsort(isins)
+        arrays = {'ISIN': isins[order]}
+        for field in FIELDS:
+            values = pandas.to_numeric(frame[field], errors='coerce').values if field in frame.columns else numpy.full(len(frame), numpy.nan)
+            arrays[field] = numpy.asarray(values, dtype=float)[order]
+        path = self.partitionPath(day)
+        isNewDay = not os.path.exists(path)
+        (fd, tmp) = tempfile.mkstemp(prefix=day + '-', suffix='.tmp', dir=self.path)
+        with os.fdopen(fd, 'wb') as f:
+            numpy.savez(f, **arrays)
+        try:
+            if os.path.exists(path):
+                os.remove(path) # os.rename doesn't replace on Windows
+            os.rename(tmp, path)
+        except OSError:
+            os.remove(tmp)
+            if not os.path.exists(path):
+                raise
+            print 'Partition ' + day + ' is being written by another process, keeping it'
+        self.cache.pop(day, None)
+        if isNewDay:
+            manifest = os.path.join(self.path, 'manifest.csv')
+            isNew = not os.path.exists(manifest)
+            with open(manifest, 'a') as f:
+                if isNew:
+                    f.write('date,bonds\n')
+                f.write(day + ',' + str(len(isins)) + '\n')
+        self.dates = self.scanDates()
+
+    def read(self, day):
+        """DataFrame of day indexed by ISIN with the FIELDS columns, None if the day is not in the store (or is being replaced
+        by another pricer).
+        """
+        if not day in self.dates:
+            return None
+        if not day in self.cache:
+            try:
+                partition = numpy.load(self.partitionPath(day))
+            except (IOError, OSError):
+                return None
+            frame = pandas.DataFrame(dict((field, partition[field]) for field in FIELDS), index=partition['ISIN'], columns=FIELDS)
+            if len(self.cache) >= self.cacheSize:
+                self.cache.clear()
+            self.cache[day] = frame
+        return self.cache[day]
+
+    def lookup(self, isins, days, field='MID'):
+        """DataFrame indexed by isins with one column per day of days that is in the store, values of field (NaN for ISINs not priced that day).
+        Only the partitions of those days are read, and each ISIN is found by binary search in the sorted ISIN index.
+        """
+        isins = numpy.array([str(isin) for isin in isins])
+        out = pandas.DataFrame(index=isins)
+        for day in days:
+            if not day in self.dates:
+                continue
+            frame = self.read(day)
+            if frame is None:
+                continue
+            index = frame.index.values
+            if len(index) == 0:
+                out[day] = numpy.nan
+                continue
+            position = numpy.minimum(numpy.searchsorted(index, isins), len(index) - 1)
+            out[day] = numpy.where(index[position] == isins, frame[field].values[position], numpy.nan)
+        return out
+
+    def lookback(self, isins, day, field='MID'):
+        """Values of field on the last day in the store up to day (YYYYMMDD), as a Series indexed by isins, with the day found.
+        Returns (Series, day found) - all NaN and None if there is no such day.
+        """
+        earlier = [d for d in self.dates if d <= day]
+        if len(earlier) == 0:
+            return (pandas.Series(numpy.nan, index=[str(isin) for isin in isins]), None)
+        return (self.lookup(isins, [earlier[-1]], field)[earlier[-1]], earlier[-1])
+
+
+def importWideHistory(store, priceFile, yieldFile, spreadFile):
+    """Splits the wide history csv files (index ISIN, one YYYYMMDD column per day) into partitions, for the days not in the store yet.
+    Returns the number of days imported.
+    """
+    wide = dict(zip(FIELDS, [pandas.read_csv(f, index_col=0) for f in [priceFile, yieldFile, spreadFile]]))
+    days = [day for day in wide['MID'].columns if not store.hasDate(day)]
+    for day in days:
+        frame = pandas.DataFrame(dict((field, wide[field][day] if day in wide[field].columns else numpy.nan) for field in FIELDS),
+                                 index=wide['MID'].index, columns=FIELDS)
+        store.append(day, frame.dropna(how='all'))
+    return len(days)
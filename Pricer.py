@@ -38,7 +38,7 @@ from subprocess import Popen
 from win32api import GetUserName
 
 
-from StaticDataImport import bonds, DEFPATH, APPPATH, bondRuns, frontToEmail, SPECIALBONDS, colFormats, runTitleStr, regsToBondName, tabList, columnListByTrader
+from StaticDataImport import bonds, DEFPATH, APPPATH, TEMPPATH, bondRuns, frontToEmail, SPECIALBONDS, colFormats, runTitleStr, regsToBondName, tabList, columnListByTrader
 from BondDataModel import BondDataModel
 
 class MessageContainer():
@@ -134,22 +134,23 @@ class AxeGrid(wx.Frame):
         for (j, header) in enumerate(self.columnList):
             self.grid.SetColLabelValue(j, header)
 
+        df = bdm.snapshot().toDataFrame() # consistent rows, without holding up price updates
         i = 0
         for bond in bondList:
-            if bond not in bdm.df.index:
+            if bond not in df.index:
                 continue
-            if bdm.df.at[bond,'POSITION']==0:
+            if df.at[bond,'POSITION']==0:
                 continue
             self.grid.SetRowLabelValue(i, bond)
-            self.grid.SetCellValue(i, 0, bdm.df.at[bond, 'ISIN'])
-            if bdm.df.at[bond,'POSITION']<0:
+            self.grid.SetCellValue(i, 0, df.at[bond, 'ISIN'])
+            if df.at[bond,'POSITION']<0:
                 self.grid.SetCellValue(i, 1, 'Y')
-                self.grid.SetCellValue(i, 2, '{:.0f}'.format(-bdm.df.at[bond, 'POSITION']/1000.))
-                self.grid.SetCellValue(i, 3, '{:,.3f}'.format(bdm.df.at[bond, 'BID']))
-            if bdm.df.at[bond,'POSITION']>0:
+                self.grid.SetCellValue(i, 2, '{:.0f}'.format(-df.at[bond, 'POSITION']/1000.))
+                self.grid.SetCellValue(i, 3, '{:,.3f}'.format(df.at[bond, 'BID']))
+            if df.at[bond,'POSITION']>0:
                 self.grid.SetCellValue(i, 4, 'Y')
-                self.grid.SetCellValue(i, 5, '{:.0f}'.format(bdm.df.at[bond, 'POSITION']/1000.))
-                self.grid.SetCellValue(i, 6, '{:,.3f}'.format(bdm.df.at[bond, 'ASK']))
+                self.grid.SetCellValue(i, 5, '{:.0f}'.format(df.at[bond, 'POSITION']/1000.))
+                self.grid.SetCellValue(i, 6, '{:,.3f}'.format(df.at[bond, 'ASK']))
             i = i + 1
         panel.SetSizerAndFit(sizer)
         self.Show()
@@ -373,36 +374,37 @@ class RunsGrid(gridlib.Grid):
         else:
             strHeader = strHeader + "  YChgD YChgW"
         strHeader = strHeader + '\n' + "-------------------------------------------------------------------------------" + '\n'
+        df = self.bdm.snapshot().toDataFrame() # all lines of the run at the same version, without holding up price updates
         strRunOutput = ''
         for i in range(4, bondCol.shape[0]):
             bond = bondCol.iloc[i]
             #The line below makes it works regardless whether user types 'END' in the top columns.
             if bond == 'END' or type(bond) == float:
                 break
-            strPrice = '{:>7.3f}'.format(self.bdm.df.at[bond, 'BID']) + "-" + '{:<7.3f}'.format(
-                self.bdm.df.at[bond, 'ASK'])
-            strYield = '{:>5.2f}'.format(self.bdm.df.at[bond, 'YLDB']) + "/" + '{:<5.2f}'.format(
-                self.bdm.df.at[bond, 'YLDA'])
-            strBidAskZ = '{:>4.0f}'.format(self.bdm.df.at[bond, 'ZB']) + "/" + '{:<4.0f}'.format(
-                self.bdm.df.at[bond, 'ZA'])
+            strPrice = '{:>7.3f}'.format(df.at[bond, 'BID']) + "-" + '{:<7.3f}'.format(
+                df.at[bond, 'ASK'])
+            strYield = '{:>5.2f}'.format(df.at[bond, 'YLDB']) + "/" + '{:<5.2f}'.format(
+                df.at[bond, 'YLDA'])
+            strBidAskZ = '{:>4.0f}'.format(df.at[bond, 'ZB']) + "/" + '{:<4.0f}'.format(
+                df.at[bond, 'ZA'])
 
             if len(strYield) > 11:
                 strYield = '  nan/nan  '
             if len(strBidAskZ) > 9:
                 strBidAskZ = ' nan/nan '
 
-            strLine = self.bdm.df.at[bond, 'CRNCY'] + ' ' + self.bdm.df.at[bond, 'SECURITY_NAME'].ljust(
+            strLine = df.at[bond, 'CRNCY'] + ' ' + df.at[bond, 'SECURITY_NAME'].ljust(
                 23) + strPrice + '  ' + strYield + '  ' + strBidAskZ + '  '
 
             if dailyChange == 'Price':
-                strChange = '{: >+5.2f}'.format(self.bdm.df.at[bond, 'DP1D']) + "/" + '{: <+5.2f}'.format(
-                    self.bdm.df.at[bond, 'DP1W'])
+                strChange = '{: >+5.2f}'.format(df.at[bond, 'DP1D']) + "/" + '{: <+5.2f}'.format(
+                    df.at[bond, 'DP1W'])
             elif dailyChange == 'Spread':
-                strChange = '{: >+5.0f}'.format(self.bdm.df.at[bond, 'DISP1D']) + "/" + '{: <+5.0f}'.format(
-                    self.bdm.df.at[bond, 'DISP1W'])
+                strChange = '{: >+5.0f}'.format(df.at[bond, 'DISP1D']) + "/" + '{: <+5.0f}'.format(
+                    df.at[bond, 'DISP1W'])
             else: #Yield
-                strChange = '{: >+5.0f}'.format(self.bdm.df.at[bond, 'DY1D']) + "/" + '{: <+5.0f}'.format(
-                    self.bdm.df.at[bond, 'DY1W'])
+                strChange = '{: >+5.0f}'.format(df.at[bond, 'DY1D']) + "/" + '{: <+5.0f}'.format(
+                    df.at[bond, 'DY1W'])
             
             if len(strChange) > 11:
                 strChange = '  nan/nan  '
@@ -438,6 +440,7 @@ class PricingGrid(gridlib.Grid):
     Methods: 
     __init__()
     initialPaint() : Function to paint the background colour orange when Pricer is first loaded.
+    reloadTab() : Reloads the bond list from a new tab definition and repaints the grid
     showPopUpMenu() : Create and display a popup menu on right-click event: 
     showTradeHistory() : Shows the TradeHistory 
     copyLine() : Copies the selected line 
@@ -448,12 +451,12 @@ class PricingGrid(gridlib.Grid):
     showALLQ() : Shows ALLQ on bloomberg 
     bbgScreenSendKeys() : Sends shell command to bloomberg.
     updateBenchmarks() : updates benchmarks 
-    updateOneBenchmark() : Updates single benchmark 
     singleBenchmarkUpdate(): Updates bond in the benchmark 
     updatePositions() : Holding function to only update positions after thread has died.
     updateAllPositions() : Updates all the position 
-    updateLine() : Holding function to only update line after thread has died.
-    updateLineAction() : Updates each line 
+    updateLines() : Holding function to only update a batch of lines after thread has died.
+    updateLinesAction() : Updates a batch of lines (numpy records) with a single refresh
+    paintLine() : Writes one line, without refreshing the grid
     createField() : Creates the fields to be displayed
 
     ---------------------
@@ -503,20 +506,17 @@ class PricingGrid(gridlib.Grid):
         sendattr.SetFont(self.fontBold)
 
         self.daysToCouponWarning = 10
+        self.staleLineColour = wx.Colour(255, 250, 205) # lines shown from the warm start file, until Bloomberg data comes in
         self.clickedISIN = ''
         self.clickedBond = ''
         self.tabKeyCounter = 0
 
-        pub.subscribe(self.updateLine, "BOND_PRICE_UPDATE")
+        pub.subscribe(self.updateLines, "BOND_PRICE_BATCH_UPDATE")
         pub.subscribe(self.updatePositions, "POSITION_UPDATE")
         pub.subscribe(self.updateBGNPrices, "BGN_PRICE_UPDATE")
 
-        self.tab = tab
-        self.bondList = list(self.tab['Bonds'])
+        self.setTab(tab)
         self.columnList = columnList
-        self.bondsWithBenchmark = list(self.tab[self.tab['Benchmarks'].notnull()]['Bonds'])
-
-        self.bondToBenchmark = self.tab.loc[self.tab['Benchmarks'].notnull(),['Bonds','Benchmarks']].set_index('Bonds')['Benchmarks'].to_dict()
 
         self.bdm = bdm
         self.pricer = pricer
@@ -577,6 +577,27 @@ class PricingGrid(gridlib.Grid):
 
         self.askCol = self.columnList.index('ASK')
 
+    def setTab(self, tab):
+        self.tab = tab
+        self.bondList = list(self.tab['Bonds'])
+        self.bondsWithBenchmark = list(self.tab[self.tab['Benchmarks'].notnull()]['Bonds'])
+        self.bondToBenchmark = self.tab.loc[self.tab['Benchmarks'].notnull(),['Bonds','Benchmarks']].set_index('Bonds')['Benchmarks'].to_dict()
+
+    def reloadTab(self, tab):
+        """
+        Reloads the bond list from tab (the tab csv as a DataFrame) and resizes the grid. Call BondDataModel.refreshUniverse()
+        next so added bonds are priced, then initialPaint().
+        """
+        self.setTab(tab)
+        rows = self.GetNumberRows()
+        if len(self.bondList) > rows:
+            self.AppendRows(len(self.bondList) - rows)
+        elif len(self.bondList) < rows:
+            self.DeleteRows(len(self.bondList), rows - len(self.bondList))
+        self.ClearGrid()
+        for i in range(0, len(self.bondList)):
+            self.SetRowAttr(i, wx.grid.GridCellAttr())
+
     def initialPaint(self):
         """
         Function to paint the background colour orange when Pricer is first loaded. Function is called by
@@ -593,14 +614,15 @@ class PricingGrid(gridlib.Grid):
         self.oddlineattr = wx.grid.GridCellAttr()
         self.oddlineattr.SetBackgroundColour(self.oddLineColour)
 
+        df = self.bdm.snapshot().toDataFrame() # consistent rows, read without the lock
         for (j, header) in enumerate(self.columnList):
             self.SetColLabelValue(j, header)
             for (i, bond) in enumerate(self.bondList):
-                if bond in self.bdm.df.index:
+                if bond in df.index:
                     if i % 2:
                         self.SetRowAttr(i,self.oddlineattr.Clone())#this clone thing is needed in wxPython 3.0 (worked fine without in 2.8)
-                    if header in self.bdm.df.columns:
-                        value = self.bdm.df.at[bond, header]
+                    if header in df.columns:
+                        value = df.at[bond, header]
                         if header == 'POSITION':
                             if self.bdm.mainframe is None or self.bdm.mainframe.isTrader:
                                 value = '{:,.0f}'.format(value)
@@ -616,10 +638,10 @@ class PricingGrid(gridlib.Grid):
                         else:
                             value = str(value)
                         self.SetCellValue(i, j, value)
-                        if header == 'D2CPN' and self.bdm.df.at[bond, header] <= self.daysToCouponWarning:
+                        if header == 'D2CPN' and df.at[bond, header] <= self.daysToCouponWarning:
                             self.SetCellBackgroundColour(i, j, wx.RED)
                     if header in ['BID_S', 'ASK_S']:
-                        self.SetCellValue(i,j,'{:,.0f}'.format(self.bdm.df.at[bond, header + 'IZE']/1000.))
+                        self.SetCellValue(i,j,'{:,.0f}'.format(df.at[bond, header + 'IZE']/1000.))
                 else:
                     if j == 0:
                         self.SetCellValue(i, j, bond)
@@ -646,9 +668,10 @@ class PricingGrid(gridlib.Grid):
     def onSingleSelection(self, event):
         if not (self.pricer.mainframe is None):
             bond = self.GetCellValue(event.GetRow(), 1)
-            if bond in self.bdm.df.index and self.bdm.mainframe.isTrader:
-                postxt = 'REGS: ' + '{:,.0f}'.format(self.bdm.df.at[bond, 'REGS']) + '    144A: '+ '{:,.0f}'.format(self.bdm.df.at[bond, '144A'])
-                risktxt = 'SPV01: ' + '{:,.0f}'.format(self.bdm.df.at[bond, 'RISK'])
+            df = self.bdm.df
+            if bond in df.index and self.bdm.mainframe.isTrader:
+                postxt = 'REGS: ' + '{:,.0f}'.format(df.at[bond, 'REGS']) + '    144A: '+ '{:,.0f}'.format(df.at[bond, '144A'])
+                risktxt = 'SPV01: ' + '{:,.0f}'.format(df.at[bond, 'RISK'])
                 wx.CallAfter(self.writeToStatusBar, bond + ':    ' + postxt + '    ' + risktxt)
         event.Skip()
 
@@ -664,8 +687,9 @@ class PricingGrid(gridlib.Grid):
         if self.selected_col_number == 1 and self.GetGridCursorCol() == self.columnList.index('POSITION') and self.bdm.mainframe.isTrader:
             rowstart = self.GetGridCursorRow()
             bondlist = [self.GetCellValue(rowstart + r, 1) for r in range(self.selected_row_number)]
-            postxt = 'Position: ' + '{:,.0f}'.format(self.bdm.df.loc[bondlist,'POSITION'].sum())
-            risktxt = 'SPV01: ' + '{:,.0f}'.format(self.bdm.df.loc[bondlist,'RISK'].sum())
+            df = self.bdm.df
+            postxt = 'Position: ' + '{:,.0f}'.format(df.loc[bondlist,'POSITION'].sum())
+            risktxt = 'SPV01: ' + '{:,.0f}'.format(df.loc[bondlist,'RISK'].sum())
             wx.CallAfter(self.writeToStatusBar, 'Sum:' + '    ' + postxt + '    ' + risktxt)
             pass
 
@@ -937,13 +961,6 @@ class PricingGrid(gridlib.Grid):
         except:
             print 'Failed to send command to Bloomberg'
 
-    def updateOneBenchmark(self, bond):
-        """Checks if bond behchmarked or benchmarker
-        """
-        for b, bc in self.bondToBenchmark.iteritems():
-            if bond == bc or bond == b:
-                self.singleBenchmarkUpdate(b)
-
     def updateBenchmarks(self):
         """Called by the bond data model on first pass
         """
@@ -958,7 +975,8 @@ class PricingGrid(gridlib.Grid):
         try:
             #bench = self.tab[self.tab['Bonds'] == bond]['Benchmarks'].iloc[0]
             bench = self.bondToBenchmark[bond]
-            value = self.bdm.df.at[bond, 'ZB'] - self.bdm.df.at[bench, 'ZB']
+            snapshot = self.bdm.snapshot()
+            value = snapshot.get(bond, 'ZB') - snapshot.get(bench, 'ZB')
             self.SetCellBackgroundColour(i, j, wx.RED)
             self.SetCellValue(i, j, '{:,.0f}'.format(value) + ' vs ' + bench)
         except:
@@ -982,7 +1000,7 @@ class PricingGrid(gridlib.Grid):
         positions = message.data
         j = self.columnList.index('POSITION')
         for (i, bond) in enumerate(self.bondList):
-            if bond in self.bdm.df.index and bond in positions.index:
+            if bond in self.bdm.live and bond in positions.index:
                 value = '{:,.0f}'.format(positions.at[bond, 'Qty'])
                 if value != self.GetCellValue(i, j):
                     self.SetCellBackgroundColour(i, j, wx.RED)
@@ -993,36 +1011,48 @@ class PricingGrid(gridlib.Grid):
                         wx.CallLater(1000, self.SetCellBackgroundColour, i, j, wx.WHITE)
                     wx.CallLater(1100, self.ForceRefresh)
 
-    def updateLine(self, message=None):
-        """Holding function that listens to the BOND_PRICE_UPDATE event and calls updateLineAction() after 
+    def updateLines(self, message=None):
+        """Holding function that listens to the BOND_PRICE_BATCH_UPDATE event and calls updateLinesAction() after
         the parent thread dies.
         """
-        wx.CallAfter(self.updateLineAction, message)
+        wx.CallAfter(self.updateLinesAction, message)
 
-    def updateLineAction(self, message):
-        """Updates each line. Function is called by updateLine().
+    def updateLinesAction(self, message):
+        """Updates the lines of a batch (numpy records with a BOND field) and refreshes the grid once. Function is called by updateLines().
         """
-        series = message.data
-        bond = series.name
-        if bond in self.bondList:
-            i = self.bondList.index(bond)
-            # print self.columnList
-            for col in self.columnList:
-                j = self.columnList.index(col)
-                value = self.createField(series, col)
-                if value != 'N/A':
-                    # print str(i)+'-'+str(j)
-                    self.SetCellBackgroundColour(i, j, wx.RED)
-                    self.SetCellValue(i, j, value)
-            wx.CallLater(1000, self.resetLineColor, i)
-            self.ForceRefresh() #Note, this line should be outside the for loop! Otherwise screen will refresh for every cell, which will crash the program!
-        self.updateOneBenchmark(bond)
-        pass
+        painted = []
+        for record in message.data:
+            if self.paintLine(record['BOND'], record):
+                painted.append(record['BOND'])
+        if len(painted) > 0:
+            self.ForceRefresh()
+            for bond in painted:
+                self.bdm.latency.mark(bond, 'PAINT')
+        batch = set(message.data['BOND'])
+        for b in [b for (b, bc) in self.bondToBenchmark.iteritems() if b in batch or bc in batch]:
+            self.singleBenchmarkUpdate(b)
+
+    def paintLine(self, bond, data):
+        """Writes the cells of bond if it is in the grid, returns True if it is. data is indexed by column. The caller refreshes the grid.
+        """
+        if not bond in self.bondList:
+            return False
+        i = self.bondList.index(bond)
+        for (j, col) in enumerate(self.columnList):
+            value = self.createField(data, col)
+            if value != 'N/A':
+                self.SetCellBackgroundColour(i, j, wx.RED)
+                self.SetCellValue(i, j, value)
+        wx.CallLater(1000, self.resetLineColor, i)
+        return True
 
     def resetLineColor(self, i):
+        stale = self.bondList[i] in self.bdm.staleBonds
         for col in self.columnList:
             j = self.columnList.index(col)
-            if i % 2:
+            if stale:
+                self.SetCellBackgroundColour(i, j, self.staleLineColour)
+            elif i % 2:
                 self.SetCellBackgroundColour(i, j, self.oddLineColour)
             else:
                 self.SetCellBackgroundColour(i, j, wx.WHITE)
@@ -1064,9 +1094,10 @@ class PricingGrid(gridlib.Grid):
 
     def updateBGNPricesAction(self):
         j = self.columnList.index('BGN_M')
+        snapshot = self.bdm.snapshot()
         for (i, bond) in enumerate(self.bondList):
-            if bond in self.bdm.df.index:
-                self.SetCellValue(i, j, '{:,.3f}'.format(self.bdm.df.at[bond, 'BGN_MID']))
+            if bond in snapshot:
+                self.SetCellValue(i, j, '{:,.3f}'.format(snapshot.get(bond, 'BGN_MID')))
 
 
 class PricerWindow(wx.Frame):
@@ -1089,7 +1120,11 @@ class PricerWindow(wx.Frame):
     onRestartBloombergConnection() : Restarts Bloomberg Connection by calling the reOpenConnection method from the BondDataModel class. 
     onRefreshSwapRates() : Refreshes the swaprate by calling refreshSwapRates (Class method of BondDataModel)
     lastSwapRefreshTime() : Calls the lastRefreshTime attribute of SwapHistory.SwapHistory to and print the time when the swap was last downlaoded from bloomberg.
-    updateTime(): Function to update time whenever there's a BOND_PRICE_UPDATE event.
+    updateTime(): Function to update time whenever there's a BOND_PRICE_BATCH_UPDATE event.
+    loadingStages() : Tabs and their bonds in loading order, the selected tab first
+    updateLoadProgress() : Shows the progress of the background loading in the status bar
+    onLoadComplete() : Sends BDM_READY once all the tabs are loaded
+    onReloadTab() : Reloads the selected tab from its csv and refreshes the bond universe
 
     ---------------------
     Back to PricingGrid
@@ -1105,10 +1140,13 @@ class PricerWindow(wx.Frame):
         self.mainframe = mainframe
         self.bdm = BondDataModel(self, mainframe)
         self.gridList = []
+        self.gridLabels = []
 
-        pub.subscribe(self.updateTime, "BOND_PRICE_UPDATE")
+        pub.subscribe(self.updateTime, "BOND_PRICE_BATCH_UPDATE")
         pub.subscribe(self.updatePositions, "POSITION_UPDATE")
         pub.subscribe(self.updateBGNPrices, "BGN_PRICE_UPDATE")
+        pub.subscribe(self.updateLoadProgress, "BDM_LOAD_PROGRESS")
+        pub.subscribe(self.onLoadComplete, "BDM_LOAD_COMPLETE")
 
         wx.Frame.__init__(self, None, wx.ID_ANY, "Eurobond pricer", size=(1280, 800))
         favicon = wx.Icon(APPPATH+'keyboard.ico', wx.BITMAP_TYPE_ICO, 32,32)
@@ -1153,6 +1191,7 @@ class PricerWindow(wx.Frame):
             tab = wx.Panel(parent=self.notebook)
             grid = PricingGrid(tab, csv, columnList, self.bdm, self)
             self.gridList.append(grid)
+            self.gridLabels.append(label)
             self.notebook.AddPage(tab, label)
             sizer = wx.BoxSizer()
             sizer.Add(grid, proportion=1, flag=wx.EXPAND)
@@ -1160,14 +1199,24 @@ class PricerWindow(wx.Frame):
 
         self.bdm.reduceUniverse()
         number_of_bonds = len(self.bdm.df['ISIN'])
+        warmBonds = self.bdm.loadWarmStart() # last session's table, painted straight away and refreshed in the background
+
+        # The tab on screen loads first, the others in the background once the feed has started
+        stages = self.loadingStages()
+        priorityBondList = stages[0][1] if len(stages) > 0 else []
+        if len(priorityBondList) == 0:
+            stages = []
+        warmStart = len(warmBonds) > 0 and len(stages) > 0
 
         topframe = self if mainframe is None else mainframe
         #old_style = mainframe.GetWindowStyle()
         #mainframe.SetWindowStyle(old_style | wx.STAY_ON_TOP)
-        busyDlg = wx.BusyInfo('Fetching price history from Bloomberg for '+str(number_of_bonds)+' bonds...', parent=topframe)
-        self.bdm.fillHistoricalPricesAndRating()
+        if not warmStart:
+            # history and ratings of the other tabs are fetched by the StagedLoader
+            busyDlg = wx.BusyInfo('Fetching price history from Bloomberg for '+str(len(priorityBondList) if len(stages) > 0 else number_of_bonds)+' bonds...', parent=topframe)
+            self.bdm.fillHistoricalPricesAndRating(priorityBondList if len(stages) > 0 else None)
+            busyDlg = None
         self.bdm.fillPositions()
-        busyDlg = None
         #topframe.SetWindowStyle(old_style)
 
         if mainframe is None or mainframe.isTrader:
@@ -1183,7 +1232,7 @@ class PricerWindow(wx.Frame):
         sizer = wx.BoxSizer(wx.VERTICAL)
         buttonsPanel = wx.Panel(self.panel)
         sizer.Add(buttonsPanel, 0.25, wx.EXPAND, 10)
-        buttonPanelSizer = wx.GridSizer(1,7,0,0)
+        buttonPanelSizer = wx.GridSizer(1,9,0,0)
         #Create buttons
         self.frontButton = wx.Button(buttonsPanel, label='Refresh trades')
         self.frontButton.Bind(wx.EVT_BUTTON, self.onRefreshFrontData)
@@ -1198,10 +1247,14 @@ class PricerWindow(wx.Frame):
         #self.bloomUpdateTime = wx.TextCtrl(buttonsPanel, -1, 'Starting...')
         editTabButton = wx.Button(buttonsPanel, label='Edit tab')
         editTabButton.Bind(wx.EVT_BUTTON, self.onEditTab)
+        reloadTabButton = wx.Button(buttonsPanel, label='Reload tab')
+        reloadTabButton.Bind(wx.EVT_BUTTON, self.onReloadTab)
         tipButton = wx.Button(buttonsPanel, label='Tips')
         tipButton.Bind(wx.EVT_BUTTON, self.onTips)
         aboutButton = wx.Button(buttonsPanel, label='Pricer guide')
         aboutButton.Bind(wx.EVT_BUTTON, self.onAbout)
+        latencyButton = wx.Button(buttonsPanel, label='Tick latency')
+        latencyButton.Bind(wx.EVT_BUTTON, self.onDumpLatency)
         if mainframe is None:
             self.frontButton.Enable(False)
         else:
@@ -1213,8 +1266,10 @@ class PricerWindow(wx.Frame):
             (bloomButton,1,wx.EXPAND,2),
             (axeButton,1,wx.EXPAND,2),
             (editTabButton,1,wx.EXPAND,2),
+            (reloadTabButton,1,wx.EXPAND,2),
             (tipButton,1,wx.EXPAND,2),
-            (aboutButton,1,wx.EXPAND,2)#,
+            (aboutButton,1,wx.EXPAND,2),
+            (latencyButton,1,wx.EXPAND,2)#,
             #(self.lastUpdateTime,1,wx.EXPAND,2),
             #(self.ratesUpdateTime,1,wx.EXPAND,2),
             #(self.bloomUpdateTime,1,wx.EXPAND,2)
@@ -1233,19 +1288,66 @@ class PricerWindow(wx.Frame):
         ################START UPDATES###############
         for grid in self.gridList:
             wx.CallAfter(grid.initialPaint)
-        
-        priorityBondList = []
-        busyDlg = wx.BusyInfo('Downloading analytics for ' + str(number_of_bonds) + ' bonds...', parent=topframe)
-        self.bdm.firstPass(priorityBondList)
-        # self.ratesUpdateTime.SetValue(self.lastSwapRefreshTime())
-        busyDlg = None 
+
+        if warmStart:
+            # warm start: no blocking history fetch or first pass, every tab reconciles in the background
+            self.bdm.updateStaticAnalytics(warmBonds)
+            self.bdm.publishDirty()
+            priorityBondList = []
+        else:
+            busyDlg = wx.BusyInfo('Downloading analytics for ' + str(len(priorityBondList) if len(stages) > 0 else number_of_bonds) + ' bonds...', parent=topframe)
+            self.bdm.firstPass(priorityBondList)
+            # self.ratesUpdateTime.SetValue(self.lastSwapRefreshTime())
+            busyDlg = None 
+            stages = stages[1:]
         self.bdm.startUpdates()
-        pub.sendMessage('BDM_READY', message = MessageContainer(self.bdm))
+        if len(stages) > 0:
+            self.bdm.startStagedLoading(stages, priorityBondList)
+        else:
+            self.onLoadComplete()
         ############################################
 
+    def loadingStages(self):
+        '''
+        Returns a list of (tab label, bonds of the reduced universe in the tab), the selected tab first (or the first pricing tab
+        if the selected one isn't a pricing tab), then the other pricing tabs from left to right.
+        '''
+        selected = self.notebook.GetCurrentPage()
+        order = range(0, len(self.gridList))
+        for (i, grid) in enumerate(self.gridList):
+            if grid.GetParent() is selected:
+                order = [i] + [j for j in order if j != i]
+        stages = []
+        for i in order:
+            bondList = [bond for bond in self.gridList[i].bondList if bond in self.bdm.live]
+            stages.append((self.gridLabels[i], sorted(set(bondList), key=bondList.index)))
+        return stages
+
+    def updateLoadProgress(self, message=None):
+        '''
+        Shows the progress of the background loading of the other tabs.
+        '''
+        (label, count, total) = message.data
+        self.statusbar.SetStatusText('Loaded ' + label + ' (' + str(count) + '/' + str(total) + ' bonds)', 3)
+
+    def onLoadComplete(self, message=None):
+        '''
+        All the tabs are loaded: tells the main frame the BondDataModel is ready.
+        '''
+        self.bdm.stagedLoader = None
+        self.statusbar.SetStatusText('Sum:', 3)
+        pub.sendMessage('BDM_READY', message = MessageContainer(self.bdm))
+
     def onAbout(self, event):
         TextDisplayWindow("Pricer Guide",'documentation//PricerGuide.txt')
 
+    def onDumpLatency(self, event):
+        """Prints the tick latency report and saves it to TEMPPATH.
+        """
+        filename = 'latency-' + datetime.datetime.now().strftime('%Y-%m-%d-%H%M%S') + '.csv'
+        out = self.bdm.latency.dump(TEMPPATH + filename)
+        self.statusbar.SetStatusText('Tick latency saved to ' + filename + ' (' + str(len(out)) + ' stages)', 2)
+
     def onTips(self,event):
         TextDisplayWindow("Usage tips",'documentation//PricerInputTips.txt')
 
@@ -1258,10 +1360,34 @@ class PricerWindow(wx.Frame):
                 filename = DEFPATH + tabName + 'Tab.csv'
             Popen(filename, shell = True)
 
+    def onReloadTab(self, event):
+        '''
+        Reloads the selected pricing tab from its csv (after Edit tab): the grid gets the new bond list, added bonds are
+        priced and removed ones unsubscribed, without restarting the pricer.
+        '''
+        tabName = self.notebook.GetPageText(self.notebook.GetSelection())
+        if not tabName in self.gridLabels:
+            return
+        grid = self.gridList[self.gridLabels.index(tabName)]
+        csv = pandas.read_csv(DEFPATH+tabName+'Tab.csv')
+        csv['Bonds'].fillna('', inplace=True)
+        busyDlg = wx.BusyInfo('Reloading ' + tabName + '...', parent=self)
+        grid.reloadTab(csv)
+        self.bdm.refreshUniverse()
+        busyDlg = None
+        grid.initialPaint()
+        grid.updateBenchmarks()
+        grid.ForceRefresh()
+        self.statusbar.SetStatusText('Reloaded ' + tabName + ' (' + str(len([bond for bond in grid.bondList if bond in self.bdm.live])) + ' bonds)', 3)
+
     def onClose(self, event):
         '''
         Terminates all data streams from Bloomberg
         '''
+        try:
+            self.bdm.saveWarmStart()
+        except Exception as e:
+            print 'Warm start file not saved: ' + str(e)
         try:
             self.bdm.blptsAnalytics.closeSession()
             self.bdm.blptsAnalytics = None
@@ -1341,7 +1467,7 @@ class PricerWindow(wx.Frame):
         return 'Last refreshed at: ' + self.bdm.USDswapRate.lastRefreshTime.strftime('%H:%M:%S') + '.' 
 
     def updateTime(self, message=None):
-        """Function to update time whenever there's a BOND_PRICE_UPDATE event.
+        """Function to update time whenever there's a BOND_PRICE_BATCH_UPDATE event.
         """
         #self.statusbar.SetStatusText('Last Bloomberg update: ' + datetime.datetime.now().strftime('%H:%M'),2)
         pass
@@ -38,9 +38,17 @@ class HistoryRequest(blpapiwrapper.Observer):
     def __init__(self,bondisins):
         self.bondisinsDC={}
     def update(self, *args, **kwargs):
-        if kwargs['field']!='ALL':
+        if kwargs['field']=='ALL':
             self.bondisinsDC[kwargs['security']]=kwargs['data']
 
+def historicalRates(tickers, date):
+    '''
+    Returns a dictionary ticker -> DataFrame of LAST_PRICE on date (empty if there is no fixing that day).
+    Goes through blpapiwrapper.defaultHistoryCache so past dates are only downloaded once.
+    '''
+    out = blpapiwrapper.defaultHistoryCache.get(tickers, 'LAST_PRICE', date, date)
+    return {security: df for ((security, field), df) in out.iteritems()}
+
 class SwapHistory():
     '''
     Class to construct yield curve.
@@ -101,12 +109,12 @@ class SwapHistory():
         '''
         if self.anchorDate.date()==datetime.datetime.today().date():
 
-            request = blpapiwrapper.BLPTS(self.swapTickers.keys(),'LAST_PRICE')
+            request = blpapiwrapper.BLPTS(self.swapTickers.keys(),'LAST_PRICE',sessionPool=blpapiwrapper.defaultSessionPool,fieldTypes={'LAST_PRICE':float})
             request.get()
             self.df=request.output.copy()
             request.closeSession()
             request = None
-            request = blpapiwrapper.BLPTS(self.LiborTickers.keys(),'LAST_PRICE')
+            request = blpapiwrapper.BLPTS(self.LiborTickers.keys(),'LAST_PRICE',sessionPool=blpapiwrapper.defaultSessionPool,fieldTypes={'LAST_PRICE':float})
             request.get()
             self.df2=request.output.copy()
             request.closeSession()
@@ -115,20 +123,15 @@ class SwapHistory():
         else:
             #Download Swap Rates
 
-            request = blpapiwrapper.BLPTS(self.swapTickers.keys(),'LAST_PRICE',startDate=self.anchorDate,endDate=self.anchorDate)
-            hr = HistoryRequest(self.swapTickers.keys())
-            request.register(hr)
-            request.get()
-            request.closeSession()
-            request = None
-            self.df = pandas.DataFrame(index=hr.bondisinsDC.keys(),columns=['LAST_PRICE'])
+            hrDC = historicalRates(self.swapTickers.keys(), self.anchorDate)
+            self.df = pandas.DataFrame(index=hrDC.keys(),columns=['LAST_PRICE'])
             #Download Libor rates
 
             #Populate Swap Rate DF. 
-            for i in hr.bondisinsDC:
+            for i in hrDC:
                 try:
                     #Try to convert them to float for each swap data downlaoded.
-                    self.df.loc[i] = float(hr.bondisinsDC[i].values)
+                    self.df.loc[i] = float(hrDC[i].values)
                 except:
                     #If converting to float fails, we leave the dataframe empty.
                     pass
@@ -159,19 +162,14 @@ class SwapHistory():
                 
                 else:
                     #Re-downlaod the dates with the new anchorDate
-                    request = blpapiwrapper.BLPTS(self.swapTickers.keys(),'LAST_PRICE',startDate=newDate,endDate=newDate)
-                    hr = HistoryRequest(self.swapTickers.keys())
-                    request.register(hr)
-                    request.get()
-                    request.closeSession()
-                    request = None
+                    hrDC = historicalRates(self.swapTickers.keys(), newDate)
 
                     #Repopulate the df.
-                    self.df = pandas.DataFrame(index=hr.bondisinsDC.keys(),columns=['LAST_PRICE'])
-                    for i in hr.bondisinsDC:
+                    self.df = pandas.DataFrame(index=hrDC.keys(),columns=['LAST_PRICE'])
+                    for i in hrDC:
                         try :
-                            #print hr.bondisinsDC[i].values
-                            self.df.loc[i] = float(hr.bondisinsDC[i].values)
+                            #print hrDC[i].values
+                            self.df.loc[i] = float(hrDC[i].values)
                         except:
                             pass
                     #Update notavail!
@@ -180,18 +178,13 @@ class SwapHistory():
             #Download Libor Rates 
             liborDate = newDate
 
-            request = blpapiwrapper.BLPTS(self.LiborTickers.keys(),'LAST_PRICE',startDate=liborDate,endDate=liborDate)
-            hr2 = HistoryRequest(self.LiborTickers.keys())
-            request.register(hr2)
-            request.get()
-            request.closeSession()
-            request = None
-            self.df2 = pandas.DataFrame(index=hr2.bondisinsDC.keys(),columns=['LAST_PRICE'])
+            hr2DC = historicalRates(self.LiborTickers.keys(), liborDate)
+            self.df2 = pandas.DataFrame(index=hr2DC.keys(),columns=['LAST_PRICE'])
             
             #Populate Libor Rate DF
-            for i in hr2.bondisinsDC:
+            for i in hr2DC:
                 try:
-                    self.df2.loc[i] = float(hr2.bondisinsDC[i].values)
+                    self.df2.loc[i] = float(hr2DC[i].values)
                 except:
                     pass
 
@@ -214,19 +207,14 @@ class SwapHistory():
                 
                 else:
                     #Re-downlaod the dates with the new anchorDate
-                    request = blpapiwrapper.BLPTS(self.LiborTickers.keys(),'LAST_PRICE',startDate=liborDate,endDate=liborDate)
-                    hr2 = HistoryRequest(self.LiborTickers.keys())
-                    request.register(hr2)
-                    request.get()
-                    request.closeSession()
-                    request = None
+                    hr2DC = historicalRates(self.LiborTickers.keys(), liborDate)
 
                     #Repopulate the df.
-                    self.df2 = pandas.DataFrame(index=hr2.bondisinsDC.keys(),columns=['LAST_PRICE'])
-                    for i in hr2.bondisinsDC:
+                    self.df2 = pandas.DataFrame(index=hr2DC.keys(),columns=['LAST_PRICE'])
+                    for i in hr2DC:
                         try :
-                            #print hr.bondisinsDC[i].values
-                            self.df2.loc[i] = float(hr2.bondisinsDC[i].values)
+                            #print hrDC[i].values
+                            self.df2.loc[i] = float(hr2DC[i].values)
                         except:
                             pass
                     #Update notavail!
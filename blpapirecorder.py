@@ -0,0 +1,320 @@
+"""
+Record and replay of Bloomberg traffic, to load test the pricer without a Bloomberg connection.
+
+BLPRecorder registers on BLPStream and BLPTS objects and appends every update it receives to a binary log.
+BLPReplay reads the log back and feeds the same observer interface at 1x, Nx or maximum speed.
+
+Log format: an 8 byte header, then one record per update, all little-endian:
+receipt time (double, seconds since epoch), kind (uint8, STREAM or REFERENCE), number of fields (uint16),
+then tag, security and Bloomberg EVENT_TIME as strings (uint16 length + utf-8 bytes, read back as str),
+then for each field its name (string), a value type (uint8) and the value (double for VALUE_FLOAT, string for VALUE_STRING).
+Historical data requests are not recorded.
+"""
+
+import bisect
+import datetime
+import struct
+import threading
+import time
+from collections import namedtuple
+
+import numpy
+import pandas
+
+import blpapiwrapper
+
+HEADER = 'BLPREC1\n'
+STREAM = 0
+REFERENCE = 1
+VALUE_FLOAT = 0
+VALUE_STRING = 1
+VALUE_NONE = 2
+
+_recordHeader = struct.Struct('<dBH')
+_length = struct.Struct('<H')
+_valueType = struct.Struct('<B')
+_double = struct.Struct('<d')
+
+LogRecord = namedtuple('LogRecord', ['receiptTime', 'kind', 'tag', 'security', 'eventTime', 'fields', 'values'])
+
+
+def _packString(s):
+    if isinstance(s, unicode):
+        s = s.encode('utf-8')
+    else:
+        s = str(s)
+    return _length.pack(len(s)) + s
+
+
+def _packValue(value):
+    if value is None:
+        return _valueType.pack(VALUE_NONE)
+    if isinstance(value, (float, int, long, numpy.number, numpy.bool_)) and not isinstance(value, bool):
+        return _valueType.pack(VALUE_FLOAT) + _double.pack(float(value))
+    return _valueType.pack(VALUE_STRING) + _packString(value)
+
+
+def packRecord(receiptTime, kind, tag, security, eventTime, fields, values):
+    chunks = [_recordHeader.pack(receiptTime, kind, len(fields)), _packString(tag), _packString(security), _packString(eventTime)]
+    for (field, value) in zip(fields, values):
+        chunks.append(_packString(field))
+        chunks.append(_packValue(value))
+    return ''.join(chunks)
+
+
+def readLog(path):
+    """Generator of LogRecord, in the order they were written. A record cut short at the end of the file (crash while writing) is ignored.
+    """
+    with open(path, 'rb') as f:
+        data = f.read()
+    if data[:len(HEADER)] != HEADER:
+        raise ValueError(path + ' is not a Bloomberg recording')
+    pos = len(HEADER)
+    end = len(data)
+
+    def readString(pos):
+        (n,) = _length.unpack_from(data, pos)
+        pos = pos + _length.size
+        if pos + n > end:
+            raise struct.error('truncated string')
+        return (data[pos:pos + n], pos + n)
+
+    while pos < end:
+        try:
+            (receiptTime, kind, nFields) = _recordHeader.unpack_from(data, pos)
+            pos = pos + _recordHeader.size
+            (tag, pos) = readString(pos)
+            (security, pos) = readString(pos)
+            (eventTime, pos) = readString(pos)
+            fields = []
+            values = []
+            for i in range(0, nFields):
+                (field, pos) = readString(pos)
+                (valueType,) = _valueType.unpack_from(data, pos)
+                pos = pos + _valueType.size
+                if valueType == VALUE_FLOAT:
+                    (value,) = _double.unpack_from(data, pos)
+                    pos = pos + _double.size
+                elif valueType == VALUE_STRING:
+                    (value, pos) = readString(pos)
+                else:
+                    value = None
+                fields.append(field)
+                values.append(value)
+        except struct.error:
+            print 'Truncated record at the end of ' + path + ', ignored'
+            break
+        yield LogRecord(receiptTime, kind, tag, security, eventTime, fields, values)
+
+
+class _RecordingObserver(blpapiwrapper.Observer):
+    """Registered on one source by BLPRecorder.attach(), writes what the source sends with the source's tag.
+    """
+    def __init__(self, recorder, tag):
+        self.recorder = recorder
+        self.tag = tag
+
+    def update(self, *args, **kwargs):
+        # BLPTS: the 'ALL' call carries the whole row, per field calls are redundant. Historical DataFrames are skipped.
+        if kwargs['field'] == 'ALL' and isinstance(kwargs['data'], pandas.Series):
+            row = kwargs['data']
+            self.recorder.write(REFERENCE, self.tag, kwargs['security'], '', list(row.index), list(row.values))
+
+    def updateBatch(self, updates, time=None):
+        receiptTime = self.recorder.clock() # one timestamp for the whole event, so the replay sends it as one batch
+        for u in updates:
+            self.recorder.write(STREAM, self.tag, u.security, u.bbgTime, u.fields, u.values, receiptTime)
+
+
+class BLPRecorder():
+    """Append-only binary log of the updates received from BLPStream and BLPTS objects.
+
+    Example:
+    recorder = BLPRecorder(TEMPPATH + 'bbg-2017-06-01.rec')
+    recorder.attach(stream, 'BID')
+    recorder.attach(blpts, 'ANALYTICS')
+    ...
+    recorder.close()
+    """
+    def __init__(self, path):
+        """
+        Keyword arguments:
+        path : log file, appended to if it already exists
+        """
+        self.path = path
+        self.lock = threading.Lock()
+        self.file = open(path, 'ab')
+        if self.file.tell() == 0:
+            self.file.write(HEADER)
+        self.recordCount = 0
+        self.observers = {} # source -> _RecordingObserver
+
+    def attach(self, source, tag):
+        """Starts recording what source (BLPStream or BLPTS) sends to its observers. tag tells the sources apart on replay.
+        """
+        observer = _RecordingObserver(self, tag)
+        self.observers[source] = observer
+        source.register(observer, fields=['ALL'])
+
+    def detach(self, source):
+        if source in self.observers:
+            source.unregister(self.observers.pop(source))
+
+    @staticmethod
+    def clock():
+        return time.time()
+
+    def write(self, kind, tag, security, eventTime, fields, values, receiptTime=None):
+        if receiptTime is None:
+            receiptTime = time.time()
+        record = packRecord(receiptTime, kind, tag, security, eventTime, fields, values)
+        self.lock.acquire()
+        if not self.file.closed:
+            self.file.write(record)
+            self.recordCount += 1
+        self.lock.release()
+
+    def close(self):
+        for source in self.observers.keys():
+            self.detach(source)
+        self.lock.acquire()
+        self.file.close()
+        self.lock.release()
+
+
+class BLPReplayRequest():
+    """Stands in for a BLPTS object during a replay: get() answers from the recorded reference data of one tag.
+    The answer is the first response recorded at or after the current replay time, or the last one before if there is none.
+    Observers get the same calls as from BLPTS: once per field, then field='ALL' with a pandas Series.
+    """
+    def __init__(self, replay, tag):
+        self.replay = replay
+        self.tag = tag
+        self.observers = blpapiwrapper.ObserverRegistry()
+        self.securities = []
+        self.fields = []
+        self.output = pandas.DataFrame()
+
+    def register(self, observer, fields=None, securityFilter=None):
+        self.observers.register(observer, fields, securityFilter)
+
+    def unregister(self, observer):
+        self.observers.unregister(observer)
+
+    def unregisterAll(self):
+        self.observers.unregisterAll()
+
+    def updateObservers(self, *args, **kwargs):
+        self.observers.update(**kwargs)
+
+    def fillRequest(self, securities, fields, **kwargs):
+        self.securities = [securities] if type(securities) == str else list(securities)
+        self.fields = [fields] if type(fields) == str else list(fields)
+
+    def get(self, newSecurities=[], newFields=[], **kwargs):
+        if len(newSecurities) > 0 or len(newFields) > 0:
+            self.fillRequest(newSecurities, newFields, **kwargs)
+        rows = {}
+        for security in self.securities:
+            recorded = self.replay.lookup(self.tag, security)
+            if recorded is None:
+                print 'No recorded ' + self.tag + ' data for ' + security
+                continue
+            row = pandas.Series([recorded.get(field, numpy.nan) for field in self.fields], index=self.fields)
+            for field in self.fields:
+                self.updateObservers(security=security, field=field, data=row[field])
+            self.updateObservers(security=security, field='ALL', data=row)
+            rows[security] = row
+        self.output = pandas.DataFrame(rows).transpose().reindex(self.securities)
+
+    def closeSession(self):
+        pass
+
+
+class BLPReplay(threading.Thread):
+    """Plays a BLPRecorder log back to observers.
+    Stream records are sent with updateBatch(), one call per recorded event, to the observers registered for their tag.
+    Reference records are served by the BLPReplayRequest objects returned by requestSource(tag).
+
+    Keyword arguments:
+    path : log written by BLPRecorder
+    speed : 1 for real time, N for N times faster, 0 for as fast as possible
+    """
+    def __init__(self, path, speed=1.):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        self.path = path
+        self.speed = speed
+        self.records = list(readLog(path))
+        self.observers = {} # tag -> list of observers
+        self.reference = {} # (tag, security) -> ([receipt times], [dictionary field -> value])
+        for r in self.records:
+            if r.kind == REFERENCE:
+                (times, values) = self.reference.setdefault((r.tag, r.security), ([], []))
+                times.append(r.receiptTime)
+                values.append(dict(zip(r.fields, r.values)))
+        self.replayTime = self.records[0].receiptTime if len(self.records) > 0 else 0.
+        self.eventsSent = 0
+        self.isRunning = False
+        self.isFinished = threading.Event()
+
+    def register(self, observer, tag):
+        self.observers.setdefault(tag, [])
+        if not observer in self.observers[tag]:
+            self.observers[tag].append(observer)
+
+    def unregister(self, observer, tag):
+        if observer in self.observers.get(tag, []):
+            self.observers[tag].remove(observer)
+
+    def requestSource(self, tag):
+        return BLPReplayRequest(self, tag)
+
+    def referenceSecurities(self, tag):
+        """Securities with reference records under tag.
+        """
+        return [security for (t, security) in self.reference.iterkeys() if t == tag]
+
+    def lookup(self, tag, security):
+        if not (tag, security) in self.reference:
+            return None
+        (times, values) = self.reference[(tag, security)]
+        i = bisect.bisect_left(times, self.replayTime)
+        return values[min(i, len(values) - 1)]
+
+    def events(self):
+        """Groups consecutive stream records written for the same event (same tag and receipt time).
+        """
+        current = []
+        for r in self.records:
+            if r.kind != STREAM:
+                continue
+            if len(current) > 0 and (r.tag != current[0].tag or r.receiptTime != current[0].receiptTime):
+                yield current
+                current = []
+            current.append(r)
+        if len(current) > 0:
+            yield current
+
+    def run(self):
+        self.isRunning = True
+        wallStart = time.time()
+        logStart = self.replayTime
+        for records in self.events():
+            if not self.isRunning:
+                break
+            if self.speed > 0:
+                wait = (records[0].receiptTime - logStart) / self.speed - (time.time() - wallStart)
+                if wait > 0:
+                    time.sleep(wait)
+            self.replayTime = records[0].receiptTime
+            updates = [blpapiwrapper.StreamUpdate(r.security, r.fields, r.values, r.eventTime, 0) for r in records]
+            now = datetime.datetime.now()
+            for observer in self.observers.get(records[0].tag, []):
+                observer.updateBatch(updates, time=now)
+            self.eventsSent += 1
+        self.isRunning = False
+        self.isFinished.set()
+
+    def stop(self):
+        self.isRunning = False
@@ -9,8 +9,21 @@ Released under Apache 2.0 license. More info at http://www.apache.org/licenses/L
 from abc import ABCMeta, abstractmethod
 import blpapi
 import datetime
+import hashlib
+import itertools
+import numpy
+import os
 import pandas
+import re
+import tempfile
 import threading
+import time
+from collections import namedtuple, OrderedDict
+
+try:
+    from concurrent.futures import Future # Python 2 needs the futures backport (pip install futures)
+except ImportError:
+    Future = None
 
 #This makes successive requests faster
 DATE             = blpapi.Name("date")
@@ -19,10 +32,123 @@ EVENT_TIME       = blpapi.Name("EVENT_TIME")
 FIELD_DATA       = blpapi.Name("fieldData")
 FIELD_EXCEPTIONS = blpapi.Name("fieldExceptions")
 FIELD_ID         = blpapi.Name("fieldId")
+RESPONSE_ERROR   = blpapi.Name("responseError")
 SECURITY         = blpapi.Name("security")
 SECURITY_DATA    = blpapi.Name("securityData")
+SECURITY_ERROR   = blpapi.Name("securityError")
+
+SESSION_CONNECTION_DOWN = blpapi.Name("SessionConnectionDown")
+SESSION_STARTUP_FAILURE = blpapi.Name("SessionStartupFailure")
+SESSION_TERMINATED      = blpapi.Name("SessionTerminated")
+
+MKTDATA = '//BLP/mktdata'
+REFDATA = '//BLP/refdata'
+
+_correlationIDs = itertools.count(1) # unique across requests, so a recycled session can't confuse them
+
+# One message of a subscription event: fields and values are lists of the fields present in the message, in strDataList order
+StreamUpdate = namedtuple('StreamUpdate', ['security', 'fields', 'values', 'bbgTime', 'corrID'])
+
+################################################
+class SessionPool():
+    """Pool of warm Bloomberg sessions, with one list of idle sessions per service (REFDATA or MKTDATA).
+    acquire() hands out a started session with the service already opened, release() gives it back to the pool.
+    Sessions are health-checked when handed out and when given back: pending events are drained and a session that reported
+    SessionTerminated, SessionConnectionDown or SessionStartupFailure is stopped and transparently replaced by a new one.
+    Sessions are only started on demand, so creating a pool doesn't connect to Bloomberg.
+    A session should only be used by one borrower at a time - the pool doesn't make blpapi sessions thread-safe.
+    """
+
+    def __init__(self, maxIdle=4):
+        """
+        Keyword arguments:
+        maxIdle : maximum number of idle sessions kept per service, extra sessions are stopped on release
+        """
+        self.maxIdle = maxIdle
+        self.idle    = {}
+        self.lock    = threading.Lock()
+
+    def acquire(self, service=REFDATA):
+        while True:
+            with self.lock:
+                sessions = self.idle.setdefault(service, [])
+                if len(sessions) == 0:
+                    break
+                session = sessions.pop()
+            if self.isHealthy(session, service):
+                return session
+            self.invalidate(session)
+        return self.newSession(service)
+
+    def release(self, session, service=REFDATA):
+        if self.isHealthy(session, service):
+            with self.lock:
+                sessions = self.idle.setdefault(service, [])
+                if session in sessions:
+                    return # already given back
+                if len(sessions) < self.maxIdle:
+                    sessions.append(session)
+                    return
+        self.invalidate(session)
+
+    def replace(self, session, service=REFDATA):
+        """Stops a session that went down and returns a new one for the same service.
+        """
+        self.invalidate(session)
+        return self.acquire(service)
+
+    def warmUp(self, service=REFDATA, n=1):
+        """Starts n sessions in advance so the first requests don't pay for session setup.
+        """
+        sessions = [self.newSession(service) for i in range(0, n)]
+        for session in sessions:
+            self.release(session, service)
 
+    def closeAll(self):
+        """Stops all idle sessions, e.g. to force new connections to Bloomberg. Borrowed sessions are unaffected.
+        """
+        with self.lock:
+            sessions = [session for serviceSessions in self.idle.values() for session in serviceSessions]
+            self.idle = {}
+        for session in sessions:
+            self.invalidate(session)
+
+    @staticmethod
+    def newSession(service):
+        session = blpapi.Session()
+        if not session.start():
+            raise RuntimeError('Failed to start Bloomberg session')
+        if not session.openService(service):
+            session.stop()
+            raise RuntimeError('Failed to open Bloomberg service ' + service)
+        return session
+
+    @staticmethod
+    def isHealthy(session, service):
+        try:
+            while True:
+                event = session.tryNextEvent()
+                if event is None:
+                    break
+                if isSessionDownEvent(event):
+                    return False
+            session.getService(service)
+        except:
+            return False
+        return True
+
+    @staticmethod
+    def invalidate(session):
+        try:
+            session.stop()
+        except:
+            pass
+
+
+defaultSessionPool = SessionPool() # shared by the convenience functions and the pricer
 ################################################
+
+
 class BLP():
     """Naive implementation of the Request/Response Paradigm closely matching the Excel API.
     Sharing one session for subsequent requests is faster, however it is not thread-safe, as some events can come faster than others.
@@ -30,11 +156,19 @@ class BLP():
     This is mostly useful for scripting, but care should be taken when used in a real world application.
     """
 
-    def __init__(self):
-        self.session = blpapi.Session()
-        self.session.start()
-        self.session.openService('//BLP/refdata')
-        self.refDataSvc = self.session.getService('//BLP/refdata')
+    def __init__(self, sessionPool=None):
+        """
+        Keyword arguments:
+        sessionPool : optional SessionPool to borrow the session from, it is given back by closeSession()
+        """
+        self.sessionPool = sessionPool
+        if sessionPool is None:
+            self.session = blpapi.Session()
+            self.session.start()
+            self.session.openService(REFDATA)
+        else:
+            self.session = sessionPool.acquire(REFDATA)
+        self.refDataSvc = self.session.getService(REFDATA)
 
     def bdp(self, strSecurity='US900123AL40 Govt', strData='PX_LAST', strOverrideField='', strOverrideValue=''):
         request = self.refDataSvc.createRequest('ReferenceDataRequest')
@@ -97,7 +231,76 @@ class BLP():
         return self.bdh(strSecurity, ['PX_OPEN', 'PX_HIGH', 'PX_LOW', 'PX_LAST'], startdate, enddate, periodicity)
 
     def closeSession(self):
-        self.session.stop()
+        if self.sessionPool is None:
+            self.session.stop()
+        else:
+            self.sessionPool.release(self.session, REFDATA)
+################################################
+
+
+class ReferenceDataBuffer():
+    """Columnar result buffer for ReferenceDataRequest responses.
+    Each field is a NumPy array with its own dtype, rows are found through a security -> row dictionary.
+    Values are written in place as events arrive and the DataFrame is only built once with toDataFrame().
+    Float fields are converted with getValueAsFloat (NaN if that fails), other fields are stored as returned by _dict_from_element.
+    """
+
+    def __init__(self, securities, fields, fieldTypes=None):
+        """
+        Keyword arguments:
+        securities : list of securities, one row each
+        fields : list of fields, one column each
+        fieldTypes : dictionary field -> dtype (e.g. {'BID': float}). Fields that are not declared are stored as objects.
+        """
+        fieldTypes = {} if fieldTypes is None else fieldTypes
+        self.securities = list(securities)
+        self.fields     = []
+        self.rowIndex   = dict(zip(self.securities, range(0, len(self.securities))))
+        self.fieldTypes = fieldTypes
+        self.columns    = {}
+        self.securityErrors = set() # securities the response reported a securityError for
+        for field in fields:
+            self.addField(field)
+
+    def addField(self, field):
+        dtype = numpy.dtype(self.fieldTypes.get(field, object))
+        if dtype.kind in ['f', 'O']:
+            self.columns[field] = numpy.full(len(self.securities), numpy.nan, dtype=dtype)
+        else:
+            self.columns[field] = numpy.zeros(len(self.securities), dtype=dtype)
+        self.fields.append(field)
+
+    def setElement(self, security, field, element):
+        """Writes one fieldData element in place and returns the converted value.
+        """
+        if not field in self.columns:
+            self.addField(field) # Bloomberg may spell the field differently from the request
+        column = self.columns[field]
+        if column.dtype.kind == 'f':
+            try:
+                value = element.getValueAsFloat()
+            except:
+                value = numpy.nan
+        elif column.dtype.kind == 'O':
+            value = _dict_from_element(element)
+        else:
+            try:
+                value = column.dtype.type(element.getValueAsString())
+            except:
+                value = column.dtype.type(0)
+        row = self.rowIndex.get(security)
+        if row is not None:
+            column[row] = value
+        return value
+
+    def row(self, security):
+        """Returns the current values for one security as a pandas Series.
+        """
+        i = self.rowIndex[security]
+        return pandas.Series([self.columns[f][i] for f in self.fields], index=self.fields, name=security)
+
+    def toDataFrame(self):
+        return pandas.DataFrame(self.columns, index=self.securities, columns=self.fields)
 ################################################
 
 
@@ -105,27 +308,49 @@ class BLPTS():
     """Thread-safe implementation of the Request/Response Paradigm.
     The functions don't return anything but notify observers of results.
     Including startDate as a keyword argument will define a HistoricalDataRequest, otherwise it will be a ReferenceDataRequest.
-    HistoricalDataRequest sends observers a pandas DataFrame, whereas ReferenceDataRequest sends a pandas Series.
+    HistoricalDataRequest sends observers one float DataFrame per security with field='ALL', whereas ReferenceDataRequest sends a pandas Series.
+    ReferenceDataRequest results are written to a ReferenceDataBuffer as they arrive and copied to self.output once the response is complete.
+    Pass fieldTypes={'BID': float, ...} to get typed columns, undeclared fields are object columns holding the values as returned by _dict_from_element.
     Override seems to only work when there's one security, one field, and one override.
+    With chunkSize > 0, security lists longer than chunkSize are split into chunks and up to maxInFlight chunks are requested at the same time.
+    A failed chunk is retried on its own up to maxRetries times, then split in two until the failing securities are isolated.
+    With chunkSize = 0 (the default) a failed request is not sent again, all its securities are failed.
+    After get(), failedSecurities lists the securities without a complete answer: failed requests, abandoned on a session loss,
+    or reported with a securityError.
     Examples:
     BLPTS(['ESA Index', 'VGA Index'], ['BID', 'ASK'])
     BLPTS('US900123AL40 Govt','YLD_YTM_BID',strOverrideField='PX_BID',strOverrideValue='200')
+    BLPTS(['XS0316524130 Corp', 'US900123CG37 Corp'], ['PX_BID', 'INT_ACC'], fieldTypes={'PX_BID': float, 'INT_ACC': float})
     BLPTS(['SPX Index','SX5E Index','EUR Curncy'],['PX_LAST','VOLUME'],startDate=datetime.datetime(2014,1,1),endDate=datetime.datetime(2015,5,14),periodicity='DAILY')
     """
 
-    def __init__(self, securities=[], fields=[], **kwargs):
+    def __init__(self, securities=[], fields=[], sessionPool=None, chunkSize=0, maxInFlight=4, maxRetries=1, **kwargs):
         """
         Keyword arguments:
         securities : list of ISINS 
         fields : list of fields 
+        sessionPool : optional SessionPool to borrow the session from, it is given back by closeSession()
+        chunkSize : maximum number of securities per request, 0 to send everything in one request
+        maxInFlight : maximum number of chunks requested at the same time
+        maxRetries : number of times a failed chunk is sent again before it is split (only with chunkSize > 0)
         kwargs : startDate and endDate (datetime.datetime object, note: hours, minutes, seconds, and microseconds must be replaced by 0)
+                 fieldTypes (dictionary field -> dtype, e.g. float) for a ReferenceDataRequest
         """
-        self.session    = blpapi.Session()
-        self.session.start()
-        self.session.openService('//BLP/refdata')
-        self.refDataSvc = self.session.getService('//BLP/refdata')
-        self.observers  = []
-        self.kwargs     = kwargs
+        self.sessionPool = sessionPool
+        if sessionPool is None:
+            self.session = blpapi.Session()
+            self.session.start()
+            self.session.openService(REFDATA)
+        else:
+            self.session = sessionPool.acquire(REFDATA)
+        self.refDataSvc  = self.session.getService(REFDATA)
+        self.chunkSize   = chunkSize
+        self.maxInFlight = maxInFlight
+        self.maxRetries  = maxRetries
+        self.observers   = ObserverRegistry()
+        self.kwargs      = kwargs
+        self.fieldTypes = kwargs.get('fieldTypes', {})
+        self.failedSecurities = []
 
         if len(securities) > 0 and len(fields) > 0:
             # also works if securities and fields are a string
@@ -137,6 +362,7 @@ class BLPTS():
         securities : list of ISINS
         fields : list of fields 
         kwargs : startDate and endDate (datetime.datetime object, note: hours, minutes, seconds, and microseconds must be replaced by 0)
+                 fieldTypes (dictionary field -> dtype) for a ReferenceDataRequest, kept for subsequent requests
         """
         self.kwargs = kwargs
 
@@ -146,8 +372,12 @@ class BLPTS():
         if type(fields) == str:
             fields = [fields]
 
+        if 'fieldTypes' in kwargs:
+            self.fieldTypes = kwargs['fieldTypes']
+
+        self.request = _createRequest(self.refDataSvc, securities, fields, **kwargs)
+
         if 'startDate' in kwargs:
-            self.request   = self.refDataSvc.createRequest('HistoricalDataRequest')
             self.startDate = kwargs['startDate']
             self.endDate   = kwargs['endDate']
 
@@ -156,27 +386,13 @@ class BLPTS():
             else:
                 self.periodicity = 'DAILY'
 
-            self.request.set('startDate', self.startDate.strftime('%Y%m%d'))
-            self.request.set('endDate', self.endDate.strftime('%Y%m%d'))
-            self.request.set('periodicitySelection', self.periodicity)
-
         else:
-            self.request = self.refDataSvc.createRequest('ReferenceDataRequest')
-            self.output  = pandas.DataFrame(index=securities, columns=fields)
-
-            if 'strOverrideField' in kwargs:
-                o = self.request.getElement('overrides').appendElement()
-                o.setElement('fieldId', kwargs['strOverrideField'])
-                o.setElement('value', kwargs['strOverrideValue'])
+            self.buffer  = ReferenceDataBuffer(securities, fields, self.fieldTypes)
+            self.output  = self.buffer.toDataFrame()
 
         self.securities = securities
         self.fields     = fields
-
-        for s in securities:
-            self.request.append('securities', s)
-
-        for f in fields:
-            self.request.append('fields', f)
+        self.fieldNames = [blpapi.Name(field) for field in fields]
 
     def get(self, newSecurities=[], newFields=[], **kwargs):
         """
@@ -188,76 +404,270 @@ class BLPTS():
         if len(newSecurities) > 0 or len(newFields) > 0:
             self.fillRequest(newSecurities, newFields, **kwargs)
 
-        self.requestID = self.session.sendRequest(self.request)
+        if self.chunkSize > 0 and len(self.securities) > self.chunkSize:
+            queue = [(self.securities[i:i + self.chunkSize], 0) for i in range(0, len(self.securities), self.chunkSize)]
+        else:
+            queue = [(self.securities, 0)]
+        inFlight = {} # correlation ID -> (securities, failed attempts)
+        self.failedSecurities = []
+        # only the callbacks registered observers listen to are built
+        notify       = self.notifyObservers if len(self.observers) > 0 else None
+        notifyFields = self.observers.fields()
+
+        while len(queue) > 0 or len(inFlight) > 0:
+            while len(queue) > 0 and len(inFlight) < max(1, self.maxInFlight):
+                (chunk, attempts) = queue.pop(0)
+                if chunk is self.securities:
+                    request = self.request
+                else:
+                    request = _createRequest(self.refDataSvc, chunk, self.fields, **self.kwargs)
+                corrID = _correlationIDs.next()
+                inFlight[corrID] = (chunk, attempts)
+                self.session.sendRequest(request, correlationId=blpapi.CorrelationId(corrID))
 
-        while True:
             event = self.session.nextEvent()
-            if event.eventType() in [blpapi.event.Event.RESPONSE, blpapi.event.Event.PARTIAL_RESPONSE]:
-                responseSize = blpapi.event.MessageIterator(event).next().getElement(SECURITY_DATA).numValues()
-
-                for i in range(0, responseSize):
-
+            if isSessionDownEvent(event):
+                if self.sessionPool is None:
+                    print 'Bloomberg session down, request abandoned'
+                    self.failedSecurities.extend(security for (chunk, attempts) in inFlight.values() + queue for security in chunk)
+                    break
+                # pooled session: reconnect and send the outstanding chunks again
+                print 'Bloomberg session down, reconnecting'
+                self.session    = self.sessionPool.replace(self.session, REFDATA)
+                self.refDataSvc = self.session.getService(REFDATA)
+                self.request    = _createRequest(self.refDataSvc, self.securities, self.fields, **self.kwargs)
+                queue           = inFlight.values() + queue
+                inFlight        = {}
+                continue
+
+            eventType = event.eventType()
+            if eventType in [blpapi.event.Event.RESPONSE, blpapi.event.Event.PARTIAL_RESPONSE, blpapi.event.Event.REQUEST_STATUS]:
+                for msg in event:
+                    corrID = msg.correlationIds()[0].value()
+                    if not corrID in inFlight:
+                        continue # stale event from an earlier request
+                    if eventType == blpapi.event.Event.REQUEST_STATUS or msg.hasElement(RESPONSE_ERROR):
+                        (chunk, attempts) = inFlight.pop(corrID)
+                        queue.extend(self.retryChunk(chunk, attempts))
+                        continue
                     if 'startDate' in self.kwargs:
                         # HistoricalDataRequest
-                        output         = blpapi.event.MessageIterator(event).next().getElement(SECURITY_DATA)
-                        security       = output.getElement(SECURITY).getValueAsString()
-                        fieldDataArray = output.getElement(FIELD_DATA)
-                        fieldDataList  = [fieldDataArray.getValueAsElement(i) for i in range(0, fieldDataArray.numValues())]
-                        dates          = map(lambda x: x.getElement(DATE).getValueAsString(), fieldDataList)
-                        outDF          = pandas.DataFrame(index=dates, columns=self.fields)
-                        outDF.index    = outDF.index.to_datetime()
-
-                        for field in self.fields:
-                            data = []
-                            for row in fieldDataList:
-                                if row.hasElement(field):
-                                    data.append(row.getElement(field).getValueAsFloat())
-                                else:
-                                    data.append(pandas.np.nan)
-
-                            outDF[field] = data
-                            self.updateObservers(security=security, field=field, data=outDF) # update one security one field
-
+                        (security, outDF, hasError) = _parseHistoricalData(msg, self.fields, self.fieldNames)
+                        if hasError:
+                            self.failedSecurities.append(security)
                         self.updateObservers(security=security, field='ALL', data=outDF) # update one security all fields
-
                     else:
                         # ReferenceDataRequest
-                        output   = blpapi.event.MessageIterator(event).next().getElement(SECURITY_DATA).getValueAsElement(i)
-                        n_elmts  = output.getElement(FIELD_DATA).numElements()
-                        security = output.getElement(SECURITY).getValueAsString()
-                        for j in range(0, n_elmts):
-                            data     = output.getElement(FIELD_DATA).getElement(j)
-                            field    = str(data.name())
-                            outData  = _dict_from_element(data)
-                            self.updateObservers(security=security, field=field, data=outData) # update one security one field
-                            self.output.loc[security, field] = outData
-                            
-                        if n_elmts>0:
-                            self.updateObservers(security=security, field='ALL', data=self.output.loc[security]) # update one security all fields
-                        else:
-                            print 'Empty response received for ' + security
+                        _parseReferenceData(msg, self.buffer, notify, notifyFields)
+                    if eventType == blpapi.event.Event.RESPONSE:
+                        del inFlight[corrID]
 
-            if event.eventType() == blpapi.event.Event.RESPONSE:
-                break
+        if not 'startDate' in self.kwargs:
+            self.output = self.buffer.toDataFrame()
+            self.failedSecurities.extend(self.buffer.securityErrors)
+
+    def retryChunk(self, chunk, attempts):
+        """Returns the chunks to send again after a failure: the same chunk while retries are left, then its two halves.
+        The halves keep the attempt count so they are split again straight away if they fail. Nothing is sent again without chunking.
+        """
+        if self.chunkSize <= 0:
+            print 'Request failed for ' + str(len(chunk)) + ' securities'
+            self.failedSecurities.extend(chunk)
+            return []
+        attempts = attempts + 1
+        if attempts <= self.maxRetries:
+            print 'Request failed for ' + str(len(chunk)) + ' securities, retrying'
+            return [(chunk, attempts)]
+        elif len(chunk) > 1:
+            half = len(chunk) // 2
+            return [(chunk[:half], attempts), (chunk[half:], attempts)]
+        else:
+            print 'Request failed for ' + chunk[0]
+            self.failedSecurities.append(chunk[0])
+            return []
 
-    def register(self, observer):
-        if not observer in self.observers:
-            self.observers.append(observer)
+    def register(self, observer, fields=None, securityFilter=None):
+        """fields : optional list of the fields the observer wants, 'ALL' included - defaults to everything
+        securityFilter : optional function security -> bool
+        """
+        self.observers.register(observer, fields, securityFilter)
 
     def unregister(self, observer):
-        if observer in self.observers:
-            self.observers.remove(observer)
+        self.observers.unregister(observer)
 
     def unregisterAll(self):
-        if self.observers:
-            del self.observers[:]
+        self.observers.unregisterAll()
 
     def updateObservers(self, *args, **kwargs):
-        for observer in self.observers:
-            observer.update(*args, **kwargs)
+        self.observers.update(**kwargs)
+
+    def notifyObservers(self, security, field, data):
+        self.updateObservers(security=security, field=field, data=data)
 
     def closeSession(self):
-        self.session.stop()
+        if self.sessionPool is None:
+            self.session.stop()
+        else:
+            self.sessionPool.release(self.session, REFDATA)
+################################################
+
+
+class BLPRequestEngine(threading.Thread):
+    """Asynchronous Request/Response Paradigm: many requests multiplexed on one session.
+    Each request is sent with its own blpapi.CorrelationId and a reader thread routes the response events to that request,
+    so the ReferenceDataRequests and HistoricalDataRequests submitted are all in flight at the same time.
+    submit() returns a concurrent.futures.Future, submitAsync() the same result as an asyncio future.
+    A ReferenceDataRequest resolves to a pandas DataFrame (securities x fields, typed with fieldTypes like BLPTS),
+    a HistoricalDataRequest (startDate in kwargs) to a dictionary security -> pandas DataFrame indexed by date.
+    Example:
+    engine = BLPRequestEngine(sessionPool=defaultSessionPool)
+    engine.start()
+    prices = engine.submit(['XS0316524130 Corp', 'US900123CG37 Corp'], ['BID', 'ASK'], fieldTypes={'BID': float, 'ASK': float})
+    history = engine.submit(['SPX Index'], ['PX_LAST'], startDate=datetime.datetime(2017,1,2), endDate=datetime.datetime(2017,2,1))
+    print prices.result()
+    print history.result()['SPX Index']
+    engine.stop()
+    """
+
+    def __init__(self, sessionPool=None):
+        """
+        Keyword arguments:
+        sessionPool : optional SessionPool to borrow the session from, it is given back by stop()
+        """
+        if Future is None:
+            raise ImportError('BLPRequestEngine needs concurrent.futures - on Python 2 install the futures package')
+        threading.Thread.__init__(self)
+        self.daemon      = True
+        self.sessionPool = sessionPool
+        if sessionPool is None:
+            self.session = blpapi.Session()
+            self.session.start()
+            self.session.openService(REFDATA)
+        else:
+            self.session = sessionPool.acquire(REFDATA)
+        self.refDataSvc  = self.session.getService(REFDATA)
+        self.pending     = {}
+        self.lock        = threading.Lock()
+        self.isRunning   = False
+
+    def submit(self, securities, fields, **kwargs):
+        """
+        securities : list of ISINS
+        fields : list of fields
+        kwargs : same keywords as BLPTS.fillRequest (startDate, endDate, periodicity, fieldTypes, strOverrideField...)
+        """
+        if type(securities) == str:
+            securities = [securities]
+
+        if type(fields) == str:
+            fields = [fields]
+
+        future  = Future()
+        pending = _PendingRequest(securities, fields, future, **kwargs)
+        if len(securities) == 0 or len(fields) == 0:
+            future.set_result(pending.result())
+            return future
+
+        request = _createRequest(self.refDataSvc, securities, fields, **kwargs)
+        corrID  = _correlationIDs.next()
+        with self.lock:
+            self.pending[corrID] = pending # registered before sending so the reader thread can't miss the response
+        try:
+            self.session.sendRequest(request, correlationId=blpapi.CorrelationId(corrID))
+        except Exception as e:
+            with self.lock:
+                del self.pending[corrID]
+            future.set_exception(e)
+        return future
+
+    def submitAsync(self, securities, fields, loop=None, **kwargs):
+        """asyncio front-end to submit(), returns an awaitable asyncio future (Python 3 only).
+        """
+        import asyncio
+        return asyncio.wrap_future(self.submit(securities, fields, **kwargs), loop=loop)
+
+    def run(self):
+        self.isRunning = True
+        while self.isRunning:
+            event = self.session.nextEvent(500) # timeout so stop() can end the loop
+            eventType = event.eventType()
+            if eventType in [blpapi.event.Event.RESPONSE, blpapi.event.Event.PARTIAL_RESPONSE, blpapi.event.Event.REQUEST_STATUS]:
+                for msg in event:
+                    self.handleMessage(msg, eventType)
+            elif isSessionDownEvent(event):
+                self.failAll(RuntimeError('Bloomberg session down'))
+                if self.sessionPool is not None and self.isRunning:
+                    print 'Bloomberg request engine session down, reconnecting'
+                    self.session    = self.sessionPool.replace(self.session, REFDATA)
+                    self.refDataSvc = self.session.getService(REFDATA)
+
+    def handleMessage(self, msg, eventType):
+        corrID = msg.correlationIds()[0].value()
+        with self.lock:
+            pending = self.pending.get(corrID)
+        if pending is None:
+            return
+        try:
+            if eventType == blpapi.event.Event.REQUEST_STATUS:
+                raise RuntimeError('Request failed: ' + msg.toString())
+            if msg.hasElement(RESPONSE_ERROR):
+                raise RuntimeError('Response error: ' + msg.getElement(RESPONSE_ERROR).toString())
+            pending.parse(msg)
+            if eventType == blpapi.event.Event.RESPONSE:
+                self.complete(corrID)
+                pending.future.set_result(pending.result())
+        except Exception as e:
+            self.complete(corrID)
+            pending.future.set_exception(e)
+
+    def complete(self, corrID):
+        with self.lock:
+            self.pending.pop(corrID, None)
+
+    def failAll(self, exception):
+        with self.lock:
+            pendingList = self.pending.values()
+            self.pending = {}
+        for pending in pendingList:
+            pending.future.set_exception(exception)
+
+    def stop(self):
+        self.isRunning = False
+        if self.is_alive() and threading.current_thread() is not self:
+            self.join()
+        self.failAll(RuntimeError('Request engine stopped'))
+        if self.sessionPool is None:
+            self.session.stop()
+        else:
+            self.sessionPool.release(self.session, REFDATA)
+
+
+class _PendingRequest():
+    """Holds the partial results of one request of a BLPRequestEngine until its RESPONSE event arrives.
+    """
+
+    def __init__(self, securities, fields, future, **kwargs):
+        self.fields       = fields
+        self.fieldNames   = [blpapi.Name(field) for field in fields]
+        self.future       = future
+        self.isHistorical = 'startDate' in kwargs
+        if self.isHistorical:
+            self.output = {}
+        else:
+            self.buffer = ReferenceDataBuffer(securities, fields, kwargs.get('fieldTypes', {}))
+
+    def parse(self, msg):
+        if self.isHistorical:
+            (security, outDF, hasError) = _parseHistoricalData(msg, self.fields, self.fieldNames)
+            self.output[security] = outDF
+        else:
+            _parseReferenceData(msg, self.buffer)
+
+    def result(self):
+        if self.isHistorical:
+            return self.output
+        else:
+            return self.buffer.toDataFrame()
 ################################################
 
 
@@ -268,13 +678,22 @@ class BLPStream(threading.Thread):
     intCorrID is a user defined ID for the request
     It is sometimes safer to ask for each data (for instance BID and ASK) in a separate stream.
     Note that for corporate bonds, a change in the ASK price will still trigger a BID event.
+    Every message of a subscription event is parsed, and observers get one updateBatch() call per event with a list of StreamUpdate.
+    Observers that only implement update() get the older one call per field plus one call for 'ALL' through Observer.updateBatch().
+    With a sessionPool, the session is borrowed from the pool, replaced if it goes down, and given back by closeSubscription().
+    subscribe() and unsubscribe() change the securities of a running stream: correlation IDs and the rows of self.output follow.
     """
 
-    def __init__(self, strSecurityList=['ESM5 Index', 'VGM5 Index'], strDataList=['BID', 'ASK'], floatInterval=0, intCorrIDList=[0, 1]):
+    def __init__(self, strSecurityList=['ESM5 Index', 'VGM5 Index'], strDataList=['BID', 'ASK'], floatInterval=0, intCorrIDList=[0, 1], sessionPool=None):
         threading.Thread.__init__(self)
-        self.session = blpapi.Session()
-        self.session.start()
-        self.session.openService("//BLP/mktdata")
+        self.sessionPool = sessionPool
+        if sessionPool is None:
+            self.session = blpapi.Session()
+            self.session.start()
+            self.session.openService(MKTDATA)
+        else:
+            self.session = sessionPool.acquire(MKTDATA)
+        self.isRunning = False
 
         if type(strSecurityList) == str:
             strSecurityList = [strSecurityList]
@@ -294,68 +713,137 @@ class BLPStream(threading.Thread):
         else:
             self.intCorrIDList = intCorrIDList
 
-        self.subscriptionList = blpapi.subscriptionlist.SubscriptionList()
-        for (security, intCorrID) in zip(self.strSecurityList, self.intCorrIDList):
-            self.subscriptionList.add(security, self.strDataList, "interval="+str(floatInterval), blpapi.CorrelationId(intCorrID))
+        self.floatInterval    = floatInterval
+        self.subscriptionList = self.createSubscriptionList(self.strSecurityList, self.intCorrIDList)
+        self.lock             = threading.Lock() # guards the security lists, self.output and self.dictCorrID against subscribe/unsubscribe
 
-        self.output               = pandas.DataFrame(index=self.strSecurityList, columns=self.strDataList)
+        self.output               = pandas.DataFrame(numpy.nan, index=self.strSecurityList, columns=self.strDataList)
+        self.rowIndex             = dict(zip(self.strSecurityList, range(0, len(self.strSecurityList))))
+        self.fieldNames           = [blpapi.Name(field) for field in self.strDataList]
         self.dictCorrID           = dict(zip(self.intCorrIDList, self.strSecurityList))
         self.lastUpdateTimeBlmbrg = ''  # Warning - if you mix live and delayed data you could have non increasing data
         self.lastUpdateTime       = datetime.datetime(1900, 1, 1)
-        self.observers            = []
+        self.observers            = ObserverRegistry()
 
-    def register(self, observer):
-        if not observer in self.observers:
-            self.observers.append(observer)
+    def register(self, observer, fields=None, securityFilter=None):
+        """fields : optional list of the fields the observer wants, 'ALL' included - defaults to everything
+        securityFilter : optional function security -> bool
+        """
+        self.observers.register(observer, fields, securityFilter)
 
     def unregister(self, observer):
-        if observer in self.observers:
-            self.observers.remove(observer)
+        self.observers.unregister(observer)
 
     def unregisterAll(self):
-        if self.observers:
-            del self.observers[:]
+        self.observers.unregisterAll()
 
     def updateObservers(self, *args, **kwargs):
-        for observer in self.observers:
-            observer.update(*args, **kwargs)
+        self.observers.update(**kwargs)
+
+    def updateObserversBatch(self, updates):
+        self.observers.updateBatch(updates, time=self.lastUpdateTime)
+
+    def createSubscriptionList(self, securities, corrIDs):
+        subscriptionList = blpapi.subscriptionlist.SubscriptionList()
+        for (security, intCorrID) in zip(securities, corrIDs):
+            subscriptionList.add(security, self.strDataList, "interval="+str(self.floatInterval), blpapi.CorrelationId(intCorrID))
+        return subscriptionList
+
+    def subscribe(self, securities):
+        """Adds securities to the stream. They get new correlation IDs and new rows in self.output.
+        If the stream is running they are subscribed straight away, otherwise when it starts. Securities already in the stream are ignored.
+        """
+        if type(securities) == str:
+            securities = [securities]
+        self.lock.acquire()
+        newSecurities = [s for s in pandas.unique(securities) if not s in self.rowIndex]
+        if len(newSecurities) > 0:
+            firstCorrID = max(self.intCorrIDList) + 1 if len(self.intCorrIDList) > 0 else 0
+            newCorrIDs = range(firstCorrID, firstCorrID + len(newSecurities))
+            self.strSecurityList = self.strSecurityList + newSecurities
+            self.intCorrIDList = self.intCorrIDList + newCorrIDs
+            self.dictCorrID.update(zip(newCorrIDs, newSecurities))
+            self.output = self.output.reindex(self.strSecurityList)
+            self.rowIndex = dict(zip(self.strSecurityList, range(0, len(self.strSecurityList))))
+            self.subscriptionList = self.createSubscriptionList(self.strSecurityList, self.intCorrIDList)
+            if self.isRunning:
+                self.session.subscribe(self.createSubscriptionList(newSecurities, newCorrIDs))
+        self.lock.release()
+        return newSecurities
+
+    def unsubscribe(self, securities):
+        """Removes securities from the stream and their rows from self.output. Late events for them are ignored.
+        """
+        if type(securities) == str:
+            securities = [securities]
+        self.lock.acquire()
+        removed = [(s, c) for (s, c) in zip(self.strSecurityList, self.intCorrIDList) if s in set(securities)]
+        if len(removed) > 0:
+            if self.isRunning:
+                self.session.unsubscribe(self.createSubscriptionList([s for (s, c) in removed], [c for (s, c) in removed]))
+            for (security, corrID) in removed:
+                del self.dictCorrID[corrID]
+            kept = [(s, c) for (s, c) in zip(self.strSecurityList, self.intCorrIDList) if not s in set(securities)]
+            self.strSecurityList = [s for (s, c) in kept]
+            self.intCorrIDList = [c for (s, c) in kept]
+            self.output = self.output.loc[self.strSecurityList]
+            self.rowIndex = dict(zip(self.strSecurityList, range(0, len(self.strSecurityList))))
+            self.subscriptionList = self.createSubscriptionList(self.strSecurityList, self.intCorrIDList)
+        self.lock.release()
+        return [s for (s, c) in removed]
 
     def run(self, verbose=False):
+        self.lock.acquire()
+        self.isRunning = True
         self.session.subscribe(self.subscriptionList)
-        while True:
-            event = self.session.nextEvent()
+        self.lock.release()
+        while self.isRunning:
+            event = self.session.nextEvent(500) # timeout so closeSubscription() can stop the loop
             if event.eventType() == blpapi.event.Event.SUBSCRIPTION_DATA:
                 self.handleDataEvent(event)
+            elif isSessionDownEvent(event) and self.sessionPool is not None and self.isRunning:
+                print 'Bloomberg stream session down, reconnecting'
+                self.lock.acquire()
+                self.session = self.sessionPool.replace(self.session, MKTDATA)
+                self.session.subscribe(self.subscriptionList)
+                self.lock.release()
             else:
                 if verbose:
                     self.handleOtherEvent(event)
 
     def handleDataEvent(self, event):
-        output              = blpapi.event.MessageIterator(event).next()
         self.lastUpdateTime = datetime.datetime.now()
-        corrID              = output.correlationIds()[0].value()
-        security            = self.dictCorrID[corrID]
-        isParsed            = False
-        #print output.toString()
-
-        if output.hasElement(EVENT_TIME):
-            self.lastUpdateTimeBlmbrg = output.getElement(EVENT_TIME).toString()
-
-        for field in self.strDataList:
-            if output.hasElement(field):
-                isParsed = True
-                try:
-                    data = output.getElement(field).getValueAsFloat()
-                except:
-                    data = pandas.np.nan
-                    print 'error: ',security,field#,output.getElement(field).getValueAsString() # this can still error if field is there but is empty
-                self.output.loc[security, field] = data
-                self.updateObservers(time=self.lastUpdateTime, security=security, field=field, corrID=corrID, data=data, bbgTime=self.lastUpdateTimeBlmbrg)
-         
-        # It can happen that you get an event without the data behind the event!
-        self.updateObservers(time=self.lastUpdateTime, security=security, field='ALL', corrID=corrID, data=0, bbgTime=self.lastUpdateTimeBlmbrg)
-        # if not isParsed:
-        #     print output.toString()
+        updates             = []
+        self.lock.acquire()
+        for output in event:
+            corrID   = output.correlationIds()[0].value()
+            security = self.dictCorrID.get(corrID)
+            if security is None:
+                continue
+            #print output.toString()
+
+            if output.hasElement(EVENT_TIME):
+                self.lastUpdateTimeBlmbrg = output.getElement(EVENT_TIME).toString()
+
+            fields = []
+            values = []
+            for (j, (field, fieldName)) in enumerate(zip(self.strDataList, self.fieldNames)):
+                if output.hasElement(fieldName):
+                    try:
+                        data = output.getElement(fieldName).getValueAsFloat()
+                    except:
+                        data = pandas.np.nan
+                        print 'error: ',security,field#,output.getElement(field).getValueAsString() # this can still error if field is there but is empty
+                    self.output.iat[self.rowIndex[security], j] = data
+                    fields.append(field)
+                    values.append(data)
+
+            # It can happen that you get an event without the data behind the event! The update is still sent, with empty fields.
+            updates.append(StreamUpdate(security, fields, values, self.lastUpdateTimeBlmbrg, corrID))
+        self.lock.release()
+
+        if len(updates) > 0:
+            self.updateObserversBatch(updates)
 
     def handleOtherEvent(self, event):
         output = blpapi.event.MessageIterator(event).next()
@@ -368,12 +856,109 @@ class BLPStream(threading.Thread):
             print "Other event: event "+str(event.eventType())
 
     def closeSubscription(self):
+        self.lock.acquire()
+        self.isRunning = False
         self.session.unsubscribe(self.subscriptionList)
+        self.lock.release()
+        if self.sessionPool is not None:
+            if self.is_alive() and threading.current_thread() is not self:
+                self.join() # the session can only go back to the pool once the loop has stopped reading from it
+            self.sessionPool.release(self.session, MKTDATA)
 ################################################
 #Convenience functions below####################
 ################################################
 
 
+def _createRequest(refDataSvc, securities, fields, **kwargs):
+    """Creates a HistoricalDataRequest if startDate is in kwargs, a ReferenceDataRequest otherwise (see BLPTS for the keywords).
+    """
+    if 'startDate' in kwargs:
+        request = refDataSvc.createRequest('HistoricalDataRequest')
+        request.set('startDate', kwargs['startDate'].strftime('%Y%m%d'))
+        request.set('endDate', kwargs['endDate'].strftime('%Y%m%d'))
+        request.set('periodicitySelection', kwargs.get('periodicity', 'DAILY'))
+    else:
+        request = refDataSvc.createRequest('ReferenceDataRequest')
+        if 'strOverrideField' in kwargs:
+            o = request.getElement('overrides').appendElement()
+            o.setElement('fieldId', kwargs['strOverrideField'])
+            o.setElement('value', kwargs['strOverrideValue'])
+
+    for s in securities:
+        request.append('securities', s)
+
+    for f in fields:
+        request.append('fields', f)
+
+    return request
+
+
+def _parseReferenceData(msg, buffer, notify=None, notifyFields=None):
+    """Writes a ReferenceDataResponse message into a ReferenceDataBuffer.
+    notify(security, field, data) is called for every field, then once with field='ALL' and the row of the security.
+    With notifyFields (a set of fields, 'ALL' included), notify is only called for those.
+    """
+    securityDataArray = msg.getElement(SECURITY_DATA)
+    for i in range(0, securityDataArray.numValues()):
+        output    = securityDataArray.getValueAsElement(i)
+        fieldData = output.getElement(FIELD_DATA)
+        n_elmts   = fieldData.numElements()
+        security  = output.getElement(SECURITY).getValueAsString()
+        if output.hasElement(SECURITY_ERROR):
+            buffer.securityErrors.add(security)
+        for j in range(0, n_elmts):
+            data    = fieldData.getElement(j)
+            field   = str(data.name())
+            outData = buffer.setElement(security, field, data)
+            if notify is not None and (notifyFields is None or field in notifyFields):
+                notify(security, field, outData) # update one security one field
+
+        if n_elmts>0:
+            if notify is not None and (notifyFields is None or 'ALL' in notifyFields):
+                notify(security, 'ALL', buffer.row(security)) # update one security all fields
+        else:
+            print 'Empty response received for ' + security
+
+
+def _parseHistoricalData(msg, fields, fieldNames=None):
+    """Reads a HistoricalDataResponse message, which holds one security.
+    Returns (security, float pandas DataFrame indexed by date, True if the response has a securityError or fieldExceptions).
+    fieldNames are the blpapi.Name of fields, resolved once by the caller. Dates and values are filled in one pass over the rows.
+    """
+    if fieldNames is None:
+        fieldNames = [blpapi.Name(field) for field in fields]
+    output         = msg.getElement(SECURITY_DATA)
+    security       = output.getElement(SECURITY).getValueAsString()
+    hasError       = output.hasElement(SECURITY_ERROR) or (output.hasElement(FIELD_EXCEPTIONS) and output.getElement(FIELD_EXCEPTIONS).numValues() > 0)
+    fieldDataArray = output.getElement(FIELD_DATA)
+    n              = fieldDataArray.numValues()
+    dates          = numpy.empty(n, dtype='datetime64[D]')
+    values         = numpy.full((n, len(fieldNames)), numpy.nan)
+
+    for i in range(0, n):
+        row      = fieldDataArray.getValueAsElement(i)
+        dates[i] = row.getElement(DATE).getValueAsString()[:10]
+        for (j, fieldName) in enumerate(fieldNames):
+            if row.hasElement(fieldName):
+                try:
+                    values[i, j] = row.getElement(fieldName).getValueAsFloat()
+                except:
+                    pass
+
+    return (security, pandas.DataFrame(values, index=pandas.DatetimeIndex(dates), columns=fields), hasError)
+
+
+def isSessionDownEvent(event):
+    """True if the event reports that the session was terminated or lost its connection.
+    """
+    if event.eventType() != blpapi.event.Event.SESSION_STATUS:
+        return False
+    for msg in event:
+        if msg.messageType() in [SESSION_TERMINATED, SESSION_CONNECTION_DOWN, SESSION_STARTUP_FAILURE]:
+            return True
+    return False
+
+
 def _dict_from_element(element):
     '''
     Used for e.g. dividends
@@ -403,6 +988,317 @@ class Observer(object):
     def update(self, *args, **kwargs):
         pass
 
+    def updateBatch(self, updates, time=None):
+        """Called by BLPStream once per event with a list of StreamUpdate.
+        Default implementation calls update() once per field and once with field='ALL' for each update - override to handle the batch at once.
+        """
+        for u in updates:
+            for (field, data) in zip(u.fields, u.values):
+                self.update(time=time, security=u.security, field=field, corrID=u.corrID, data=data, bbgTime=u.bbgTime)
+            self.update(time=time, security=u.security, field='ALL', corrID=u.corrID, data=0, bbgTime=u.bbgTime)
+
+
+class ConflatingObserver(Observer):
+    """Sits between a BLPStream and an observer, and merges ticks for the same security.
+    The first tick for a security opens a window. Later ticks in the window overwrite the fields they carry, and when the window
+    closes the observer gets one StreamUpdate with the latest value of every field seen. A window of 0 passes ticks through.
+    Notifications are sent from the conflator's own thread. stop() sends what is still pending before returning.
+
+    Keyword arguments:
+    observer : the Observer to notify
+    window : default window in seconds
+    securityWindows : optional dictionary security -> window in seconds
+    groups : optional dictionary security -> group name, for instance the issuer
+    groupWindows : optional dictionary group name -> window in seconds, used for securities not in securityWindows
+
+    Counters: ticksReceived, ticksMerged, notificationsSent, and mergedBySecurity (security -> ticks merged).
+    """
+    def __init__(self, observer, window=0.5, securityWindows={}, groups={}, groupWindows={}):
+        self.observer = observer
+        self.window = window
+        self.securityWindows = dict(securityWindows)
+        self.groups = dict(groups)
+        self.groupWindows = dict(groupWindows)
+        self.pending = OrderedDict() # security -> [deadline, OrderedDict field -> value, corrID, bbgTime]
+        self.ticksReceived = 0
+        self.ticksMerged = 0
+        self.notificationsSent = 0
+        self.mergedBySecurity = {}
+        self.counterLock = threading.Lock() # notify() runs on the conflator thread and on the stream thread for pass through ticks
+        self.condition = threading.Condition()
+        self.isRunning = True
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def getWindow(self, security):
+        if security in self.securityWindows:
+            return self.securityWindows[security]
+        group = self.groups.get(security)
+        if group in self.groupWindows:
+            return self.groupWindows[group]
+        return self.window
+
+    @staticmethod
+    def now():
+        return time.time() # the time argument of updateBatch shadows the module there
+
+    def setWindow(self, security, window):
+        self.condition.acquire()
+        self.securityWindows[security] = window
+        self.condition.release()
+
+    def update(self, *args, **kwargs):
+        if kwargs['field'] == 'ALL':
+            return
+        self.updateBatch([StreamUpdate(kwargs['security'], [kwargs['field']], [kwargs['data']], kwargs.get('bbgTime', ''), kwargs.get('corrID'))], time=kwargs.get('time'))
+
+    def updateBatch(self, updates, time=None):
+        passThrough = []
+        self.condition.acquire()
+        for u in updates:
+            self.ticksReceived += 1
+            window = self.getWindow(u.security)
+            if window <= 0:
+                passThrough.append(u)
+                continue
+            if u.security in self.pending:
+                state = self.pending[u.security]
+                state[1].update(zip(u.fields, u.values))
+                state[2] = u.corrID
+                state[3] = u.bbgTime
+                self.ticksMerged += 1
+                self.mergedBySecurity[u.security] = self.mergedBySecurity.get(u.security, 0) + 1
+            else:
+                self.pending[u.security] = [self.now() + window, OrderedDict(zip(u.fields, u.values)), u.corrID, u.bbgTime]
+        self.condition.notify()
+        self.condition.release()
+        if len(passThrough) > 0:
+            self.notify(passThrough)
+
+    def notify(self, updates):
+        self.counterLock.acquire()
+        self.notificationsSent += len(updates)
+        self.counterLock.release()
+        try:
+            self.observer.updateBatch(updates, time=datetime.datetime.now())
+        except Exception as e:
+            print 'ConflatingObserver: observer failed - ' + str(e)
+
+    def run(self):
+        while self.isRunning:
+            self.condition.acquire()
+            now = self.now()
+            due = [security for (security, state) in self.pending.iteritems() if state[0] <= now]
+            updates = []
+            for security in due:
+                (deadline, values, corrID, bbgTime) = self.pending.pop(security)
+                updates.append(StreamUpdate(security, values.keys(), values.values(), bbgTime, corrID))
+            if len(updates) == 0:
+                wait = min([state[0] for state in self.pending.itervalues()]) - now if len(self.pending) > 0 else 1.
+                self.condition.wait(max(wait, 0.001))
+            self.condition.release()
+            if len(updates) > 0:
+                self.notify(updates)
+
+    def flush(self):
+        """Sends every pending security now, without waiting for the end of its window.
+        """
+        self.condition.acquire()
+        updates = [StreamUpdate(security, state[1].keys(), state[1].values(), state[3], state[2]) for (security, state) in self.pending.iteritems()]
+        self.pending.clear()
+        self.condition.release()
+        if len(updates) > 0:
+            self.notify(updates)
+
+    def stats(self):
+        return {'ticksReceived': self.ticksReceived, 'ticksMerged': self.ticksMerged, 'notificationsSent': self.notificationsSent, 'pending': len(self.pending)}
+
+    def stop(self):
+        self.isRunning = False
+        self.condition.acquire()
+        self.condition.notify()
+        self.condition.release()
+        self.thread.join()
+        self.flush()
+
+
+class QueuedObserver(Observer):
+    """Bounded handoff queue between a BLPStream (or ConflatingObserver) and a slow observer, so the reader thread never blocks on it.
+    The queue holds at most one update per security: a new update for a queued security replaces the older one (drop oldest per security).
+    If maxSize securities are already queued, the oldest entry is dropped to make room.
+    Consumer threads deliver the updates to the observer with updateBatch(), never two updates for the same security at the same time.
+
+    Keyword arguments:
+    observer : the Observer to notify
+    maxSize : maximum number of queued securities
+    consumers : number of consumer threads - keep 1 if the observer is not thread safe
+
+    Metrics: depth (queued now), highWater, dropped (replaced or evicted), received, delivered - see stats().
+    """
+    def __init__(self, observer, maxSize=1000, consumers=1):
+        self.observer = observer
+        self.maxSize = maxSize
+        self.pending = OrderedDict() # security -> (StreamUpdate, time)
+        self.inProgress = set()
+        self.received = 0
+        self.delivered = 0
+        self.dropped = 0
+        self.highWater = 0
+        self.condition = threading.Condition()
+        self.isRunning = True
+        self.threads = [threading.Thread(target=self.run) for i in range(0, consumers)]
+        for thread in self.threads:
+            thread.daemon = True
+            thread.start()
+
+    @property
+    def depth(self):
+        return len(self.pending)
+
+    def update(self, *args, **kwargs):
+        if kwargs['field'] == 'ALL':
+            return
+        self.updateBatch([StreamUpdate(kwargs['security'], [kwargs['field']], [kwargs['data']], kwargs.get('bbgTime', ''), kwargs.get('corrID'))], time=kwargs.get('time'))
+
+    def updateBatch(self, updates, time=None):
+        self.condition.acquire()
+        for u in updates:
+            self.received += 1
+            if u.security in self.pending:
+                del self.pending[u.security] # the new update goes to the back of the queue
+                self.dropped += 1
+            elif len(self.pending) >= self.maxSize:
+                self.pending.popitem(last=False)
+                self.dropped += 1
+            self.pending[u.security] = (u, time)
+        self.highWater = max(self.highWater, len(self.pending))
+        self.condition.notify(len(updates))
+        self.condition.release()
+
+    def next(self):
+        """Waits for the oldest queued security that no other consumer is working on. Returns None once stopped.
+        """
+        self.condition.acquire()
+        try:
+            while self.isRunning:
+                for security in self.pending:
+                    if not security in self.inProgress:
+                        self.inProgress.add(security)
+                        return self.pending.pop(security)
+                self.condition.wait(0.5)
+            return None
+        finally:
+            self.condition.release()
+
+    def run(self):
+        while self.isRunning:
+            item = self.next()
+            if item is None:
+                break
+            (u, time) = item
+            try:
+                self.observer.updateBatch([u], time=time)
+            except Exception as e:
+                print 'QueuedObserver: observer failed for ' + u.security + ' - ' + str(e)
+            self.condition.acquire()
+            self.inProgress.discard(u.security)
+            self.delivered += 1
+            self.condition.notify() # another consumer may be waiting for this security
+            self.condition.release()
+
+    def stats(self):
+        return {'depth': self.depth, 'highWater': self.highWater, 'dropped': self.dropped, 'received': self.received, 'delivered': self.delivered}
+
+    def stop(self):
+        self.isRunning = False
+        self.condition.acquire()
+        self.condition.notifyAll()
+        self.condition.release()
+        for thread in self.threads:
+            if thread is not threading.current_thread():
+                thread.join()
+
+
+class ObserverRegistry():
+    """Observers of a BLPTS or BLPStream, each registered with an optional filter:
+    fields - the fields it wants, 'ALL' included (None for everything), and securityFilter - a function security -> bool.
+    update() only calls the observers that want the field and the security.
+    updateBatch() gives observers that implement updateBatch the updates for their securities, restricted to their fields unless they
+    asked for 'ALL', and only makes the update() calls other observers want (see Observer.updateBatch for the unfiltered calls).
+    """
+    def __init__(self):
+        self.entries = [] # (observer, frozenset of fields or None, securityFilter or None)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def __contains__(self, observer):
+        return any(entry[0] is observer for entry in self.entries)
+
+    def __iter__(self):
+        return iter([entry[0] for entry in self.entries])
+
+    def register(self, observer, fields=None, securityFilter=None):
+        if observer in self:
+            self.unregister(observer)
+        if type(fields) == str:
+            fields = [fields]
+        self.entries.append((observer, None if fields is None else frozenset(fields), securityFilter))
+
+    def unregister(self, observer):
+        self.entries = [entry for entry in self.entries if not entry[0] is observer]
+
+    def unregisterAll(self):
+        self.entries = []
+
+    def fields(self):
+        """Returns the set of fields someone listens to, or None if an observer wants everything.
+        """
+        out = set()
+        for (observer, fields, securityFilter) in self.entries:
+            if fields is None:
+                return None
+            out.update(fields)
+        return out
+
+    def update(self, **kwargs):
+        for (observer, fields, securityFilter) in self.entries:
+            if fields is not None and not kwargs['field'] in fields:
+                continue
+            if securityFilter is not None and not securityFilter(kwargs['security']):
+                continue
+            observer.update(**kwargs)
+
+    def updateBatch(self, updates, time=None):
+        for (observer, fields, securityFilter) in self.entries:
+            if securityFilter is not None:
+                selected = [u for u in updates if securityFilter(u.security)]
+            else:
+                selected = updates
+            if len(selected) == 0:
+                continue
+            if fields is None:
+                observer.updateBatch(selected, time=time)
+            elif _overridesUpdateBatch(observer):
+                if not 'ALL' in fields:
+                    selected = [StreamUpdate(u.security, [f for f in u.fields if f in fields], [v for (f, v) in zip(u.fields, u.values) if f in fields], u.bbgTime, u.corrID) for u in selected]
+                    selected = [u for u in selected if len(u.fields) > 0]
+                if len(selected) > 0:
+                    observer.updateBatch(selected, time=time)
+            else:
+                for u in selected:
+                    for (field, data) in zip(u.fields, u.values):
+                        if field in fields:
+                            observer.update(time=time, security=u.security, field=field, corrID=u.corrID, data=data, bbgTime=u.bbgTime)
+                    if 'ALL' in fields:
+                        observer.update(time=time, security=u.security, field='ALL', corrID=u.corrID, data=0, bbgTime=u.bbgTime)
+
+
+def _overridesUpdateBatch(observer):
+    method = getattr(observer.__class__, 'updateBatch', None)
+    return method is not None and getattr(method, '__func__', None) is not Observer.updateBatch.__func__
+
 
 class HistoryWatcher(Observer):
     """Object to stream and record history data from Bloomberg.
@@ -410,18 +1306,252 @@ class HistoryWatcher(Observer):
     def __init__(self):
         self.outputDC={}
     def update(self, *args, **kwargs):
-        if kwargs['field']!='ALL':
-            self.outputDC[(kwargs['security'],kwargs['field'])]=kwargs['data'][[kwargs['field']]]#double brackets keep it a dataframe, not a series
+        if kwargs['field']=='ALL':
+            for field in kwargs['data'].columns:
+                self.outputDC[(kwargs['security'],field)]=kwargs['data'][[field]]#double brackets keep it a dataframe, not a series
+
+
+class HistoryCache():
+    """On-disk cache of historical data, one time series per (security, field, periodicity).
+    Each series remembers the date intervals already requested, so get() only asks Bloomberg for the missing ones.
+    Series are kept in memory once loaded and saved as one .npz file each (dates, float values and fetched intervals).
+    Intervals are day ordinals, so only DAILY series are cached: other periodicities are passed straight through to Bloomberg.
+    Yesterday's close can be published late, so only dates up to the day before yesterday are cached: the part of a request
+    from yesterday onwards is always fetched and never stored. Securities that came back with an error are not cached either.
+    """
+    def __init__(self, folder, sessionPool=None):
+        """
+        Keyword arguments:
+        folder : directory for the .npz files, created on first save
+        sessionPool : optional SessionPool for the requests
+        """
+        self.folder = folder
+        self.sessionPool = sessionPool
+        self.series = {} # (security, field, periodicity) -> [dates (datetime64[D]), values (float64), fetched intervals as [first, last] day ordinals]
+        self.lock = threading.Lock()
+        self.requestCount = 0
+
+    def fileName(self, key):
+        name = re.sub('[^A-Za-z0-9]+', '_', '_'.join(key))
+        return os.path.join(self.folder, name + '_' + hashlib.md5('|'.join(key)).hexdigest()[:8] + '.npz')
+
+    def load(self, key):
+        if not key in self.series:
+            self.series[key] = [numpy.array([], dtype='datetime64[D]'), numpy.array([], dtype=numpy.float64), []]
+            path = self.fileName(key)
+            if os.path.exists(path):
+                try:
+                    f = numpy.load(path)
+                    self.series[key] = [f['dates'], f['values'], [list(x) for x in f['intervals']]]
+                    f.close()
+                except Exception as e:
+                    print 'Could not read ' + path + ', data will be requested again: ' + str(e)
+        return self.series[key]
+
+    def save(self, key):
+        if not os.path.exists(self.folder):
+            os.makedirs(self.folder)
+        (dates, values, intervals) = self.series[key]
+        numpy.savez(self.fileName(key), dates=dates, values=values, intervals=numpy.array(intervals, dtype=numpy.int64).reshape(-1, 2))
+
+    @staticmethod
+    def missingIntervals(intervals, first, last):
+        missing = []
+        for (a, b) in sorted(intervals):
+            if b < first or a > last:
+                continue
+            if a > first:
+                missing.append((first, a - 1))
+            first = max(first, b + 1)
+        if first <= last:
+            missing.append((first, last))
+        return missing
+
+    @staticmethod
+    def addInterval(intervals, first, last):
+        merged = []
+        for (a, b) in sorted(intervals + [[first, last]]):
+            if len(merged) > 0 and a <= merged[-1][1] + 1:
+                merged[-1][1] = max(merged[-1][1], b)
+            else:
+                merged.append([a, b])
+        return merged
+
+    def merge(self, key, data, first, last):
+        """Replaces the cached dates between first and last (day ordinals) by data, a pandas Series indexed by date.
+        """
+        (dates, values, intervals) = self.load(key)
+        keep = (dates < numpy.datetime64(datetime.date.fromordinal(first))) | (dates > numpy.datetime64(datetime.date.fromordinal(last)))
+        dates = numpy.concatenate([dates[keep], data.index.values.astype('datetime64[D]')])
+        values = numpy.concatenate([values[keep], data.values.astype(numpy.float64)])
+        order = numpy.argsort(dates, kind='mergesort')
+        self.series[key] = [dates[order], values[order], self.addInterval(intervals, first, last)]
+
+    def request(self, securities, fields, first, last, periodicity):
+        blpts = BLPTS(securities, fields, sessionPool=self.sessionPool, startDate=datetime.datetime.fromordinal(first), endDate=datetime.datetime.fromordinal(last), periodicity=periodicity)
+        historyWatcher = HistoryWatcher()
+        blpts.register(historyWatcher, fields=['ALL'])
+        blpts.get()
+        blpts.closeSession()
+        self.requestCount += 1
+        return (historyWatcher.outputDC, set(blpts.failedSecurities))
+
+    def get(self, securities, fields, startDate, endDate, periodicity='DAILY'):
+        """Returns a dictionary (security, field) -> pandas DataFrame indexed by date with one column named field, like HistoryWatcher.outputDC.
+        Securities missing the same dates are requested together.
+        """
+        if type(securities) == str:
+            securities = [securities]
+        if type(fields) == str:
+            fields = [fields]
+        first = startDate.toordinal()
+        last = endDate.toordinal()
+        if periodicity != 'DAILY':
+            (received, failed) = self.request(securities, fields, first, last, periodicity)
+            return dict((key, df[[key[1]]].astype(float)) for (key, df) in received.iteritems())
+        lastCached = datetime.date.today().toordinal() - 2
+        self.lock.acquire()
+        try:
+            toFetch = {} # (first, last) -> (securities, fields)
+            for security in securities:
+                for field in fields:
+                    intervals = self.load((security, field, periodicity))[2]
+                    for interval in self.missingIntervals(intervals, first, min(last, lastCached)):
+                        toFetch.setdefault(interval, (set(), set()))
+                        toFetch[interval][0].add(security)
+                        toFetch[interval][1].add(field)
+            dirty = set()
+            for ((a, b), (missingSecurities, missingFields)) in toFetch.iteritems():
+                (received, failed) = self.request(list(missingSecurities), list(missingFields), a, b, periodicity)
+                for ((security, field), df) in received.iteritems():
+                    if security in failed:
+                        continue # asked for again next time
+                    key = (security, field, periodicity)
+                    self.merge(key, df[field].dropna(), a, b)
+                    dirty.add(key)
+            for key in dirty:
+                self.save(key)
+            live = {}
+            if last > lastCached:
+                (live, failed) = self.request(securities, fields, max(first, lastCached + 1), last, periodicity)
+
+            output = {}
+            for security in securities:
+                for field in fields:
+                    (dates, values, intervals) = self.series[(security, field, periodicity)]
+                    i = numpy.searchsorted(dates, numpy.datetime64(datetime.date.fromordinal(first)), side='left')
+                    j = numpy.searchsorted(dates, numpy.datetime64(datetime.date.fromordinal(last)), side='right')
+                    df = pandas.DataFrame({field: values[i:j]}, index=pandas.DatetimeIndex(dates[i:j]))
+                    if (security, field) in live:
+                        df = pandas.concat([df, live[(security, field)][[field]].astype(float)])
+                    output[(security, field)] = df
+        finally:
+            self.lock.release()
+        return output
 
 
-def simpleReferenceDataRequest(id_to_ticker_dic, fields):
+# Applications replace it with a cache in their own temp folder (BondDataModel uses TEMPPATH)
+defaultHistoryCache = HistoryCache(os.path.join(tempfile.gettempdir(), 'bbghistorycache'), sessionPool=defaultSessionPool)
+
+
+class ReferenceDataCache():
+    """Reference data cache for slow-moving fields, one entry per (security, field) with the date it was fetched.
+    Each field has its own time to live in days: an entry fetched on day D is used up to day D + ttl - 1, so ttl=1 means today only
+    and ttl=0 means never cached. get() only requests the expired entries, in one BLPTS per set of expired fields.
+    Only values that came back are cached: missing values, failed requests and securityErrors are asked for again on the next get().
+    The cache is saved as a csv file (security, field, value, fetched) after every request that went out.
+    Example:
+    cache = ReferenceDataCache('refdata.csv', ttl={'RTG_SP': 1, 'AMT_OUTSTANDING': 7})
+    cache.get(['XS0316524130 Corp'], ['RTG_SP', 'AMT_OUTSTANDING'], fieldTypes={'AMT_OUTSTANDING': float})
+    """
+    def __init__(self, path, ttl={}, defaultTTL=1, sessionPool=None, chunkSize=200, maxInFlight=4):
+        """
+        Keyword arguments:
+        path : csv file, loaded if it exists
+        ttl : dictionary field -> time to live in days
+        defaultTTL : time to live of fields that are not in ttl
+        sessionPool, chunkSize, maxInFlight : passed to BLPTS
+        """
+        self.path = path
+        self.ttl = dict(ttl)
+        self.defaultTTL = defaultTTL
+        self.sessionPool = sessionPool
+        self.chunkSize = chunkSize
+        self.maxInFlight = maxInFlight
+        self.entries = {} # (security, field) -> (value, day ordinal fetched)
+        self.lock = threading.Lock()
+        self.requestCount = 0
+        if os.path.exists(path):
+            try:
+                df = pandas.read_csv(path, dtype=str, keep_default_na=False)
+                for (security, field, value, fetched) in zip(df['security'], df['field'], df['value'], df['fetched']):
+                    value = numpy.nan if value == '' else value # missing values are written as empty strings
+                    self.entries[(security, field)] = (value, datetime.datetime.strptime(fetched, '%Y-%m-%d').toordinal())
+            except Exception as e:
+                print 'Could not read ' + path + ', reference data will be requested again: ' + str(e)
+
+    def isFresh(self, security, field, today):
+        entry = self.entries.get((security, field))
+        return entry is not None and today < entry[1] + self.ttl.get(field, self.defaultTTL)
+
+    def save(self):
+        keys = self.entries.keys()
+        df = pandas.DataFrame({'security': [k[0] for k in keys], 'field': [k[1] for k in keys],
+                               'value': [self.entries[k][0] for k in keys],
+                               'fetched': [datetime.date.fromordinal(self.entries[k][1]).strftime('%Y-%m-%d') for k in keys]},
+                              columns=['security', 'field', 'value', 'fetched'])
+        df.to_csv(self.path, index=False)
+
+    def get(self, securities, fields, fieldTypes=None):
+        """Returns a DataFrame indexed by securities with columns equal to fields. Fields in fieldTypes are converted to that type.
+        """
+        fieldTypes = {} if fieldTypes is None else fieldTypes
+        if type(securities) == str:
+            securities = [securities]
+        if type(fields) == str:
+            fields = [fields]
+        today = datetime.date.today().toordinal()
+        self.lock.acquire()
+        try:
+            toFetch = {} # tuple of expired fields -> securities
+            for security in securities:
+                expired = tuple(f for f in fields if not self.isFresh(security, f, today))
+                if len(expired) > 0:
+                    toFetch.setdefault(expired, []).append(security)
+            for (expired, expiredSecurities) in toFetch.iteritems():
+                blpts = BLPTS(expiredSecurities, list(expired), sessionPool=self.sessionPool, chunkSize=self.chunkSize, maxInFlight=self.maxInFlight, fieldTypes=fieldTypes)
+                blpts.get()
+                blpts.closeSession()
+                self.requestCount += 1
+                failed = set(blpts.failedSecurities)
+                for field in expired:
+                    for (security, value) in blpts.output[field].iteritems():
+                        if security in failed or pandas.isnull(value):
+                            self.entries.pop((security, field), None) # requested again next time
+                        else:
+                            self.entries[(security, field)] = (value, today)
+            if len(toFetch) > 0:
+                self.save()
+            output = pandas.DataFrame({f: [self.entries.get((s, f), (numpy.nan, today))[0] for s in securities] for f in fields}, index=securities, columns=fields)
+        finally:
+            self.lock.release()
+        for (field, dtype) in fieldTypes.iteritems():
+            if field in output.columns:
+                output[field] = pandas.to_numeric(output[field], errors='coerce').astype(dtype)
+        return output
+
+
+def simpleReferenceDataRequest(id_to_ticker_dic, fields, fieldTypes=None, chunkSize=200, maxInFlight=4):
     '''
     Common use case for reference data request
     id_to_ticker_dic: dictionnary with user id mapped to Bloomberg security ticker e.g. {'Apple':'AAPL US Equity'}
+    fieldTypes: optional dictionary field -> dtype, e.g. {'PX_MID': float}
+    chunkSize, maxInFlight: large requests are split in chunks of chunkSize securities, maxInFlight chunks at a time (see BLPTS)
     Returns a dataframe indexed by the user id, with columns equal to fields
     '''
+    fieldTypes = {} if fieldTypes is None else fieldTypes
     ticker_to_id_dic =  {v: k for k, v in id_to_ticker_dic.items()}
-    blpts = BLPTS(id_to_ticker_dic.values(), fields)
+    blpts = BLPTS(id_to_ticker_dic.values(), fields, sessionPool=defaultSessionPool, chunkSize=chunkSize, maxInFlight=maxInFlight, fieldTypes=fieldTypes)
     blpts.get()
     blpts.closeSession()
     blpts.output['id'] = blpts.output.index
@@ -430,20 +1560,25 @@ def simpleReferenceDataRequest(id_to_ticker_dic, fields):
     return blpts.output.copy()
 
 
-def simpleHistoryRequest(securities=[], fields=[], startDate=datetime.datetime(2015,1,1), endDate=datetime.datetime(2016,1,1), periodicity='DAILY'):
+def simpleHistoryRequest(securities=[], fields=[], startDate=datetime.datetime(2015,1,1), endDate=datetime.datetime(2016,1,1), periodicity='DAILY', useCache=True):
     '''
     Convenience function to retrieve historical data for a list of securities and fields
     As returned data can have different length, missing data will be replaced with pandas.np.nan (note it's already taken care of in one security several fields)
     If multiple securities and fields, a MultiIndex dataframe will be returned.
+    useCache: dates already in defaultHistoryCache are not requested again
     '''
-    blpts=BLPTS(securities, fields, startDate=startDate, endDate=endDate, periodicity=periodicity)
-    historyWatcher=HistoryWatcher()
-    blpts.register(historyWatcher)
-    blpts.get()
-    blpts.closeSession()
-    for key,df in historyWatcher.outputDC.iteritems():
+    if useCache:
+        outputDC = defaultHistoryCache.get(securities, fields, startDate, endDate, periodicity)
+    else:
+        blpts=BLPTS(securities, fields, sessionPool=defaultSessionPool, startDate=startDate, endDate=endDate, periodicity=periodicity)
+        historyWatcher=HistoryWatcher()
+        blpts.register(historyWatcher, fields=['ALL'])
+        blpts.get()
+        blpts.closeSession()
+        outputDC = historyWatcher.outputDC
+    for key,df in outputDC.iteritems():
         df.columns=[key]
-    output=pandas.concat(historyWatcher.outputDC.values(),axis=1)
+    output=pandas.concat(outputDC.values(),axis=1)
     output.columns=pandas.MultiIndex.from_tuples(output.columns)
     output.columns.names=['Security','Field']
     return output